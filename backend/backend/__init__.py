@@ -61,3 +61,7 @@ with app.app_context():
         app.logger.info("Dropping and re-creating the DB schema!")
         db.drop_all()
         db.create_all()
+
+    from .events import outbox_relay
+
+    outbox_relay.start()
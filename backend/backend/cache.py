@@ -0,0 +1,115 @@
+from collections import OrderedDict
+import threading
+import time
+from typing import Any, Callable, Hashable, Optional, TypeVar
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+
+from . import db
+
+T = TypeVar("T")
+
+# all caches by name, for the metrics endpoint
+caches: dict[str, "TTLCache"] = {}
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache with a time-to-live for every entry.
+
+    Holds at most `maxsize` entries, the least recently used one is evicted first.
+    Entries older than `ttl_sec` are treated as missing.
+    """
+
+    def __init__(self, name: str, maxsize: int, ttl_sec: float) -> None:
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl_sec = ttl_sec
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        caches[name] = self
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[key]
+                self._expirations += 1
+                entry = None
+            if entry is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_sec, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / lookups, 4) if lookups else 0,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+            }
+
+
+def detached_copy(entity: T) -> T:
+    """
+    Returns a copy of the ORM entity that is not bound to any session, with all the
+    column attributes loaded, so that it can be shared between requests.
+
+    Take the copy before committing, afterwards the attributes of the entity are
+    expired and reading them queries the DB again.
+    """
+    mapper = inspect(entity).mapper
+    values = {attr.key: getattr(entity, attr.key) for attr in mapper.column_attrs}
+    copy = mapper.class_(**values)
+    make_transient_to_detached(copy)
+    return copy
+
+
+class EntityCache(TTLCache):
+    """
+    Read-through cache of ORM entities by primary key.
+
+    Stores detached copies and merges them into the current session on a hit without
+    querying the DB, so callers get a regular session-bound entity either way.
+    """
+
+    def find(self, key: Hashable, load: Callable[[], Optional[T]]) -> Optional[T]:
+        cached = self.get(key)
+        if cached is not None:
+            return db.session.merge(cached, load=False)
+        entity = load()
+        if entity is not None:
+            self.put(key, detached_copy(entity))
+        return entity
+
+
+def cache_stats() -> dict:
+    return {name: cache.stats() for name, cache in caches.items()}
@@ -4,6 +4,9 @@ from flask import Blueprint, abort, jsonify, request, g
 
 from .storage import CountryNotFound, add_country, change_country, get_countries
 from .. import log
+from ..cache import cache_stats
+from ..events import event_stats
+from ..user.passwords import hasher
 from ..utils import validate_request
 
 
@@ -38,3 +41,13 @@ def enable_country(country_code: str):
     except CountryNotFound as e:
         log.exception(f"Country not found by code {country_code}.")
         abort(404, f"Country {country_code} not found.")
+
+
+@common.route("/metrics", methods=["GET"])
+def get_metrics():
+    stats = {
+        "events": event_stats(),
+        "cache": cache_stats(),
+        "passwords": hasher.stats(),
+    }
+    return jsonify(stats), 200
@@ -2,13 +2,21 @@ from dataclasses import dataclass
 from datetime import datetime
 from typing import Optional
 
-from .. import db, log
-from ..events import send_event
+from .. import app, db, log
+from ..cache import EntityCache, detached_copy
+from ..events import add_event
 from ..events.models import CountryEnabled
 from ..utils import commit_db
 from .models import Country
 
 
+country_cache = EntityCache(
+    "country",
+    maxsize=app.config["CATALOG_CACHE_SIZE"],
+    ttl_sec=app.config["CATALOG_CACHE_TTL_SEC"],
+)
+
+
 @dataclass
 class CountryNotEnabled(Exception):
     country_code: str
@@ -23,7 +31,7 @@ def find_country(code: str) -> Optional[Country]:
     """
     Returns a country by the given code, or `None` if not found.
     """
-    country = Country.query.get(code)
+    country = country_cache.find(code, lambda: Country.query.get(code))
     if country:
         log.debug(f"Found country {country} by code={code}.")
     else:
@@ -38,7 +46,10 @@ def add_country(country_data) -> None:
     country = Country(**country_data)
     log.info(f"Adding a country: {country_data}")
     db.session.add(country)
+    db.session.flush()
+    cached = detached_copy(country)
     commit_db(country, "Country", is_update=False)
+    country_cache.put(country.code, cached)
 
 
 def change_country(code: str, data: dict, now: datetime) -> None:
@@ -48,7 +59,8 @@ def change_country(code: str, data: dict, now: datetime) -> None:
     Raises:
         CountryNotFound: In case no country found by the given code.
     """
-    country = find_country(code)
+    # bypass the cache, the country is going to be modified
+    country = Country.query.get(code)
     if country:
         log.info(f"Changing country {code} with the following data: {data}.")
         for k, v in data.items():
@@ -56,10 +68,14 @@ def change_country(code: str, data: dict, now: datetime) -> None:
                 setattr(country, k, v)
                 # send a DWH event in case of the `enabled` field being set to True
                 if k == "enabled_at" and v:
-                    send_event(CountryEnabled(country_code=code, event_time=now))
+                    add_event(
+                        CountryEnabled(country_code=code, event_time=now),
+                        aggregate_id=code,
+                    )
             else:
                 log.warn(f"Could not update {k} arrtibute: does not exist.")
         commit_db(country, "Country", is_update=True)
+        country_cache.invalidate(code)
     else:
         raise CountryNotFound(country_code=code)
 
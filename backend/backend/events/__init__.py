@@ -1,41 +1,100 @@
-import dataclasses
-from datetime import date, datetime
-import json
-from uuid import UUID
+import atexit
+from typing import Any, Optional
 
+from eventcodec import serialize
 from kafka import KafkaProducer
 
 from .. import app, log
 from .models import DwhEvent
+from .outbox import OutboxRelay, add_outbox_event, add_outbox_events
+from .publisher import EventPublisher
 
 kafka_servers = app.config["KAFKA_BOOTSTRAP_SERVERS"]
 dwh_topic = app.config["KAFKA_DWH_TOPIC"]
+event_encoding = app.config["KAFKA_EVENT_ENCODING"]
 
-producer = KafkaProducer(bootstrap_servers=kafka_servers)
+producer = KafkaProducer(
+    bootstrap_servers=kafka_servers,
+    compression_type=app.config["KAFKA_COMPRESSION_TYPE"],
+    linger_ms=app.config["KAFKA_LINGER_MS"],
+    max_in_flight_requests_per_connection=app.config["KAFKA_MAX_IN_FLIGHT"],
+)
 
 
-class EnhancedJSONEncoder(json.JSONEncoder):
-    def default(self, o):
-        if dataclasses.is_dataclass(o):
-            return dataclasses.asdict(o)
-        if isinstance(o, UUID):
-            return o.hex
-        if isinstance(o, (date, datetime)):
-            return o.isoformat()
-        return super().default(o)
+def serialize_event(event: DwhEvent) -> bytes:
+    return serialize(event.__class__.__name__, event, encoding=event_encoding)
 
 
-def serialize_event(event: DwhEvent) -> bytes:
-    obj = json.dumps(
-        {"type": event.__class__.__name__, "data": event}, cls=EnhancedJSONEncoder
+publisher: Optional[EventPublisher] = None
+if app.config["KAFKA_SEND_MODE"] == "async":
+    publisher = EventPublisher(
+        producer,
+        dwh_topic,
+        serialize_event,
+        buffer_size=app.config["KAFKA_BUFFER_SIZE"],
+        overflow_policy=app.config["KAFKA_BUFFER_OVERFLOW_POLICY"],
+        batch_max_events=app.config["KAFKA_BATCH_MAX_EVENTS"],
+        linger_ms=app.config["KAFKA_LINGER_MS"],
     )
-    return bytes(obj, encoding="utf-8")
+    atexit.register(publisher.close)
 
 
 def send_event(event: DwhEvent) -> None:
+    if publisher is not None:
+        log.debug(f"Buffering event for {dwh_topic}: {event}")
+        publisher.publish(event)
+        return
     log.info(f"Sending event to {dwh_topic}: {event}")
     try:
         future = producer.send(dwh_topic, value=serialize_event(event))
         future.get(timeout=5)
     except Exception:
         log.exception(f"Failed sending event to {dwh_topic}: {event}")
+
+
+def add_event(event: DwhEvent, aggregate_id: Any) -> None:
+    """
+    Writes the event to the outbox as part of the current DB transaction.
+
+    Use it for events describing an entity change, before committing the change:
+    the event is stored only if the commit succeeds, and is published to Kafka by
+    the outbox relay afterwards.
+    """
+    log.debug(f"Adding event to the outbox: {event}")
+    add_outbox_event(event, aggregate_id, serialize_event)
+
+
+def add_events(events: list[tuple[DwhEvent, Any]]) -> None:
+    """
+    Same as `add_event` for a batch of `(event, aggregate id)` pairs, written to the
+    outbox with one insert.
+    """
+    log.debug(f"Adding {len(events)} events to the outbox.")
+    add_outbox_events(events, serialize_event)
+
+
+outbox_relay = OutboxRelay(
+    KafkaProducer(
+        bootstrap_servers=kafka_servers,
+        compression_type=app.config["KAFKA_COMPRESSION_TYPE"],
+        linger_ms=app.config["KAFKA_LINGER_MS"],
+        # a single in-flight request keeps the per-partition order on retries
+        max_in_flight_requests_per_connection=1,
+    ),
+    dwh_topic,
+    batch_size=app.config["OUTBOX_BATCH_SIZE"],
+    poll_interval_ms=app.config["OUTBOX_POLL_INTERVAL_MS"],
+)
+atexit.register(outbox_relay.stop)
+
+
+def event_stats() -> dict:
+    """
+    Returns the DWH event publishing metrics.
+    """
+    if publisher is None:
+        stats = {"mode": "sync"}
+    else:
+        stats = {"mode": "async", **publisher.stats()}
+    stats["outbox"] = outbox_relay.stats()
+    return stats
@@ -0,0 +1,202 @@
+from datetime import datetime
+import threading
+import time
+from typing import Any, Callable
+
+from kafka import KafkaProducer
+from sqlalchemy import insert
+from sqlalchemy.sql import text
+
+from .. import app, db, log
+from ..utils import TimedModel
+from .models import DwhEvent
+
+# any constant works, it only has to be the same for all backend processes
+OUTBOX_LOCK_KEY = 7_204_611
+
+# Kafka header with the outbox row id, the stage derives the event id from it so
+# that an event relayed twice is stored once
+OUTBOX_ID_HEADER = "outbox_id"
+
+
+class OutboxEvent(TimedModel):
+    """
+    A serialized DWH event written in the same transaction as the entity it describes.
+
+    Rows are never deleted: `published_dtm` is set once the relay has sent the event,
+    so the table doubles as a replayable event history.
+    """
+
+    __tablename__ = "event_outbox"
+
+    id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
+    aggregate_id = db.Column(db.String, nullable=False)
+    event_type = db.Column(db.String, nullable=False)
+    payload = db.Column(db.LargeBinary, nullable=False)
+    published_dtm = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index(
+            "ix_event_outbox_unpublished",
+            "id",
+            postgresql_where=published_dtm.is_(None),
+        ),
+    )
+
+    def __repr__(self):
+        return f"<OutboxEvent {self.id}: {self.event_type} ({self.aggregate_id})>"
+
+
+def add_outbox_event(
+    event: DwhEvent, aggregate_id: Any, serialize: Callable[[DwhEvent], bytes]
+) -> None:
+    """
+    Adds the event to the current DB session, it is stored on the next commit.
+    """
+    row = OutboxEvent(
+        aggregate_id=str(aggregate_id),
+        event_type=event.__class__.__name__,
+        payload=serialize(event),
+    )
+    db.session.add(row)
+
+
+def add_outbox_events(
+    events: list[tuple[DwhEvent, Any]], serialize: Callable[[DwhEvent], bytes]
+) -> None:
+    """
+    Writes `(event, aggregate id)` pairs to the outbox with a single multi-row insert
+    in the current DB transaction, keeping the order of the list.
+    """
+    if not events:
+        return
+    rows = [
+        {
+            "aggregate_id": str(aggregate_id),
+            "event_type": event.__class__.__name__,
+            "payload": serialize(event),
+        }
+        for event, aggregate_id in events
+    ]
+    db.session.execute(insert(OutboxEvent), rows)
+
+
+class OutboxRelay:
+    """
+    Tails the outbox table and publishes new events to Kafka in bulk.
+
+    Events are sent in outbox order with the aggregate id as the message key, so all
+    events of one aggregate land in the same partition in the order they were
+    committed. A Postgres advisory lock makes sure only one relay sends at a time.
+
+    The events up to the first failed one are marked as published, that one and all
+    the later ones are sent again with the next batch, so no event overtakes an
+    earlier event of its aggregate. Each message carries its outbox row id, so an
+    event sent again, after a failure or a crash between the send and the commit, is
+    not duplicated in the stage.
+    """
+
+    def __init__(
+        self,
+        producer: KafkaProducer,
+        topic: str,
+        batch_size: int,
+        poll_interval_ms: int,
+    ) -> None:
+        self.producer = producer
+        self.topic = topic
+        self.batch_size = batch_size
+        self.poll_interval_sec = poll_interval_ms / 1000
+
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="dwh-outbox-relay", daemon=True
+        )
+        self._lock = threading.Lock()
+        self._relayed = 0
+        self._failed = 0
+        self._batches = 0
+        self._last_batch_ms = 0.0
+
+    def start(self) -> None:
+        log.info(f"Starting the outbox relay to {self.topic}.")
+        self._thread.start()
+
+    def stop(self, timeout: float = 30) -> None:
+        self._stopped.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def relay_batch(self) -> int:
+        """
+        Publishes the next batch of unpublished events, returns the number of events sent.
+        """
+        locked = db.session.execute(
+            text("select pg_try_advisory_xact_lock(:key)"), {"key": OUTBOX_LOCK_KEY}
+        ).scalar()
+        if not locked:
+            db.session.rollback()
+            return 0
+        rows = (
+            OutboxEvent.query.filter(OutboxEvent.published_dtm.is_(None))
+            .order_by(OutboxEvent.id)
+            .limit(self.batch_size)
+            .all()
+        )
+        if not rows:
+            db.session.rollback()
+            return 0
+        started = time.monotonic()
+        futures = [
+            self.producer.send(
+                self.topic,
+                key=row.aggregate_id.encode("utf-8"),
+                value=row.payload,
+                headers=[(OUTBOX_ID_HEADER, str(row.id).encode("ascii"))],
+            )
+            for row in rows
+        ]
+        self.producer.flush()
+        # the events after a failure are sent again after it, keeping their order;
+        # the stage drops the ones already sent by their outbox id
+        published_ids = []
+        failed = 0
+        for row, future in zip(rows, futures):
+            if future.failed():
+                failed += 1
+                log.error(f"Failed relaying {row} to {self.topic}: {future.exception}")
+            elif not failed:
+                published_ids.append(row.id)
+        if published_ids:
+            OutboxEvent.query.filter(OutboxEvent.id.in_(published_ids)).update(
+                {"published_dtm": datetime.utcnow()}, synchronize_session=False
+            )
+        db.session.commit()
+        batch_ms = (time.monotonic() - started) * 1000
+        with self._lock:
+            self._relayed += len(published_ids)
+            self._failed += failed
+            self._batches += 1
+            self._last_batch_ms = batch_ms
+        log.debug(f"Relayed {len(published_ids)} outbox events in {batch_ms:.1f}ms.")
+        return len(published_ids)
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                with app.app_context():
+                    sent = self.relay_batch()
+            except Exception:
+                log.exception("Failed relaying outbox events.")
+                sent = 0
+            if sent < self.batch_size:
+                self._stopped.wait(self.poll_interval_sec)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "relayed": self._relayed,
+                "failed": self._failed,
+                "batches": self._batches,
+                "last_batch_ms": round(self._last_batch_ms, 3),
+            }
@@ -0,0 +1,188 @@
+from collections import deque
+import threading
+import time
+from typing import Callable
+
+from kafka import KafkaProducer
+
+from .. import log
+from .models import DwhEvent
+
+
+OVERFLOW_POLICIES = ("drop_newest", "drop_oldest", "block")
+
+
+class EventPublisher:
+    """
+    Buffers DWH events in memory and sends them to Kafka from a background thread.
+
+    A batch is flushed once it has `batch_max_events` events or `linger_ms` after
+    its first event was buffered, whichever comes first. When the buffer is full,
+    `overflow_policy` decides whether the new event is dropped (`drop_newest`),
+    the oldest buffered event is dropped (`drop_oldest`), or the caller waits for
+    free space (`block`).
+    """
+
+    def __init__(
+        self,
+        producer: KafkaProducer,
+        topic: str,
+        serialize: Callable[[DwhEvent], bytes],
+        buffer_size: int,
+        overflow_policy: str,
+        batch_max_events: int,
+        linger_ms: int,
+    ) -> None:
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown buffer overflow policy: {overflow_policy}.")
+        self.producer = producer
+        self.topic = topic
+        self.serialize = serialize
+        self.buffer_size = buffer_size
+        self.overflow_policy = overflow_policy
+        self.batch_max_events = batch_max_events
+        self.linger_sec = linger_ms / 1000
+
+        self._buffer: deque[DwhEvent] = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+
+        self._published = 0
+        self._dropped = 0
+        self._sent = 0
+        self._failed = 0
+        self._batches = 0
+        self._last_flush_ms = 0.0
+        self._max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+
+        self._thread = threading.Thread(
+            target=self._run, name="dwh-event-publisher", daemon=True
+        )
+        self._thread.start()
+
+    def publish(self, event: DwhEvent) -> bool:
+        """
+        Puts the event into the buffer without waiting for Kafka.
+
+        Returns `False` if the event was dropped because the buffer is full or the
+        publisher is closed.
+        """
+        with self._cond:
+            if self._closed:
+                log.error(f"Event publisher is closed, dropping event: {event}")
+                self._dropped += 1
+                return False
+            if len(self._buffer) >= self.buffer_size:
+                match self.overflow_policy:
+                    case "drop_newest":
+                        log.warning(f"Event buffer is full, dropping event: {event}")
+                        self._dropped += 1
+                        return False
+                    case "drop_oldest":
+                        dropped = self._buffer.popleft()
+                        log.warning(f"Event buffer is full, dropping event: {dropped}")
+                        self._dropped += 1
+                    case "block":
+                        self._cond.wait_for(
+                            lambda: len(self._buffer) < self.buffer_size or self._closed
+                        )
+                        if self._closed:
+                            log.warning(
+                                f"Event publisher closed while waiting for free "
+                                f"space, dropping event: {event}"
+                            )
+                            self._dropped += 1
+                            return False
+            self._buffer.append(event)
+            self._published += 1
+            self._cond.notify_all()
+            return True
+
+    def _next_batch(self) -> list[DwhEvent]:
+        with self._cond:
+            self._cond.wait_for(lambda: self._buffer or self._closed)
+            if not self._buffer:
+                return []
+            # linger so that the batch can fill up, unless we are shutting down
+            deadline = time.monotonic() + self.linger_sec
+            while len(self._buffer) < self.batch_max_events and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            size = min(len(self._buffer), self.batch_max_events)
+            batch = [self._buffer.popleft() for _ in range(size)]
+            self._cond.notify_all()
+            return batch
+
+    def _on_send_success(self, _) -> None:
+        with self._cond:
+            self._sent += 1
+
+    def _on_send_error(self, e: Exception) -> None:
+        with self._cond:
+            self._failed += 1
+        log.error(f"Failed sending event to {self.topic}: {e}")
+
+    def _send_batch(self, batch: list[DwhEvent]) -> None:
+        started = time.monotonic()
+        for event in batch:
+            try:
+                future = self.producer.send(self.topic, value=self.serialize(event))
+                future.add_callback(self._on_send_success)
+                future.add_errback(self._on_send_error)
+            except Exception:
+                log.exception(f"Failed sending event to {self.topic}: {event}")
+                with self._cond:
+                    self._failed += 1
+        try:
+            self.producer.flush()
+        except Exception:
+            log.exception(f"Failed flushing {len(batch)} events to {self.topic}.")
+        flush_ms = (time.monotonic() - started) * 1000
+        with self._cond:
+            self._batches += 1
+            self._last_flush_ms = flush_ms
+            self._max_flush_ms = max(self._max_flush_ms, flush_ms)
+            self._total_flush_ms += flush_ms
+        log.debug(f"Flushed {len(batch)} events to {self.topic} in {flush_ms:.1f}ms.")
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                break
+            self._send_batch(batch)
+
+    def close(self, timeout: float = 30) -> None:
+        """
+        Stops accepting new events, flushes the buffer and waits for Kafka.
+        """
+        with self._cond:
+            if self._closed:
+                return
+            log.info(f"Closing event publisher, {len(self._buffer)} events buffered.")
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        self.producer.flush(timeout)
+
+    def stats(self) -> dict:
+        with self._cond:
+            avg_flush_ms = self._total_flush_ms / self._batches if self._batches else 0
+            return {
+                "buffer_depth": len(self._buffer),
+                "buffer_size": self.buffer_size,
+                "overflow_policy": self.overflow_policy,
+                "published": self._published,
+                "dropped": self._dropped,
+                "sent": self._sent,
+                "failed": self._failed,
+                "batches": self._batches,
+                "flush_latency_ms": {
+                    "last": round(self._last_flush_ms, 3),
+                    "avg": round(avg_flush_ms, 3),
+                    "max": round(self._max_flush_ms, 3),
+                },
+            }
@@ -8,13 +8,14 @@ from .storage import (
     GenreNotFound,
     create_artist,
     create_collection,
+    create_collections,
     create_genre,
     find_artist,
     find_collection,
-    find_collections_by_artist,
     find_genre,
     find_song,
     find_songs_from_collection,
+    get_collections_with_songs,
     get_genres,
     get_random_artist,
     get_random_song,
@@ -64,13 +65,8 @@ def get_artist(id):
 @music.route("/artist/<id>/collections", methods=["GET"])
 def get_collections_by_artist(id):
     try:
-        collections = find_collections_by_artist(id)
-        resp = []
-        for col in collections:
-            songs = find_songs_from_collection(col.id)
-            elem = col.to_dict(songs=songs)
-            resp.append(elem)
-        return resp, 200
+        collections = get_collections_with_songs(UUID(id))
+        return jsonify(collections), 200
     except ArtistNotFound as e:
         abort(404, f"No artist by id {e.artist_id}.")
 
@@ -85,8 +81,30 @@ def post_collection():
     for song in data["songs"]:
         validate_request(song, ["name", "duration_sec"])
     try:
-        collection = create_collection(data, now=now)
-        response = jsonify({"id": collection.id.hex})
+        collection_id = create_collection(data, now=now)
+        response = jsonify({"id": collection_id.hex})
+        return response, 201
+    except ArtistNotFound as e:
+        abort(400, f"Artist id={e.artist_id} not found")
+    except GenreNotFound as e:
+        abort(400, f"Genre id={e.genre_id} not found")
+
+
+@music.route("/collections", methods=["POST"])
+def post_collections():
+    now = g.request_time
+    data = request.get_json()
+    validate_request(data, ["collections"])
+    for collection in data["collections"]:
+        validate_request(
+            collection,
+            ["artist_id", "name", "type", "genre_id", "released_dt", "songs"],
+        )
+        for song in collection["songs"]:
+            validate_request(song, ["name", "duration_sec"])
+    try:
+        collection_ids = create_collections(data["collections"], now=now)
+        response = jsonify({"ids": [id.hex for id in collection_ids]})
         return response, 201
     except ArtistNotFound as e:
         abort(400, f"Artist id={e.artist_id} not found")
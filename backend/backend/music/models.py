@@ -65,7 +65,7 @@ class Collection(BaseModel):
     collection_type = db.Column(db.String, nullable=False)
     genre_id = db.Column(UUID(), db.ForeignKey(Genre.id), nullable=False)
     released_dt = db.Column(db.Date, nullable=False, default=datetime.today)
-    artist_id = db.Column(UUID(), db.ForeignKey(Artist.id), nullable=False)
+    artist_id = db.Column(UUID(), db.ForeignKey(Artist.id), nullable=False, index=True)
 
     def __repr__(self):
         return f"<Collection {self.id}: {self.name}, type: {self.collection_type}>"
@@ -89,7 +89,7 @@ class Song(BaseModel):
 
     name = db.Column(db.String, nullable=False)
     duration_sec = db.Column(db.Integer, nullable=False)
-    collection_id = db.Column(UUID(), db.ForeignKey(Collection.id))
+    collection_id = db.Column(UUID(), db.ForeignKey(Collection.id), index=True)
     artist_id = db.Column(UUID(), db.ForeignKey(Artist.id))
     genre_id = db.Column(UUID(), db.ForeignKey(Genre.id))
 
@@ -0,0 +1,118 @@
+import random
+import threading
+import time
+from typing import Callable, Hashable, Iterable, Optional
+from uuid import UUID
+
+from .. import log
+
+# a group key, e.g. `None` for all ids or `("country", "NL")`
+GroupKey = Optional[tuple]
+
+
+class RandomIdIndex:
+    """
+    In-memory index of entity ids grouped by filter values, used to pick a uniformly
+    random id of a group in O(1) instead of sorting the table by `random()`.
+
+    The index is loaded lazily with `load`, which yields `(id, group keys)` pairs, and
+    fully reloaded every `refresh_sec` to pick up rows created by other processes.
+    Rows created by this process are added right after their commit.
+
+    A reload runs in the one caller that found the index stale, outside the lock: the
+    other callers keep sampling from the previous groups until the new ones are
+    swapped in. Only the very first load makes the other callers wait; if it fails,
+    they fail with it.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        load: Callable[[], Iterable[tuple[Hashable, list[GroupKey]]]],
+        refresh_sec: float,
+    ) -> None:
+        self.name = name
+        self.load = load
+        self.refresh_sec = refresh_sec
+        self._groups: dict[GroupKey, list] = {}
+        self._loaded_at: Optional[float] = None
+        self._reloading = False
+        # ids added while a reload is running, the load may have missed them
+        self._pending: list[tuple[Hashable, list[GroupKey]]] = []
+        self._ready = False
+        self._error: Optional[Exception] = None
+        self._lock = threading.Lock()
+        # notified when a reload is done or has failed
+        self._reloaded = threading.Condition(self._lock)
+
+    def _reload(self) -> None:
+        started = time.monotonic()
+        groups: dict[GroupKey, list] = {}
+        loaded = set()
+        try:
+            for id, keys in self.load():
+                loaded.add(id)
+                for key in keys:
+                    groups.setdefault(key, []).append(id)
+        except Exception as e:
+            with self._lock:
+                self._reloading = False
+                self._pending = []
+                self._error = e
+                self._reloaded.notify_all()
+            raise
+        with self._lock:
+            for id, keys in self._pending:
+                if id not in loaded:
+                    for key in keys:
+                        groups.setdefault(key, []).append(id)
+            self._pending = []
+            self._groups = groups
+            self._loaded_at = time.monotonic()
+            self._reloading = False
+            self._ready = True
+            self._reloaded.notify_all()
+        log.info(
+            f"Loaded {self.name} random index: {len(loaded)} ids, "
+            f"{len(groups)} groups in {(self._loaded_at - started) * 1000:.1f}ms."
+        )
+
+    def _is_stale(self) -> bool:
+        return (
+            self._loaded_at is None
+            or time.monotonic() - self._loaded_at > self.refresh_sec
+        )
+
+    def add(self, id: Hashable, keys: list[GroupKey]) -> None:
+        with self._lock:
+            if self._reloading:
+                self._pending.append((id, keys))
+            if self._ready:
+                for key in keys:
+                    self._groups.setdefault(key, []).append(id)
+
+    def sample(self, key: GroupKey = None) -> Optional[Hashable]:
+        with self._lock:
+            reload = self._is_stale() and not self._reloading
+            if reload:
+                self._reloading = True
+            else:
+                while self._reloading and not self._ready:
+                    self._reloaded.wait()
+                if not self._ready:
+                    raise RuntimeError(
+                        f"Loading the {self.name} random index failed."
+                    ) from self._error
+        if reload:
+            self._reload()
+        with self._lock:
+            ids = self._groups.get(key)
+            return random.choice(ids) if ids else None
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._loaded_at = None
+
+
+def as_uuid(v) -> UUID:
+    return v if isinstance(v, UUID) else UUID(str(v))
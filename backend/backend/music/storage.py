@@ -1,15 +1,19 @@
 from dataclasses import dataclass
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
 from typing import Optional
-from uuid import UUID
-from sqlalchemy.sql.expression import func
+from uuid import UUID, uuid4
 
-from .. import db, log
+from sqlalchemy import insert, select
+from sqlalchemy.orm import make_transient_to_detached
+
+from .. import app, db, log
+from ..cache import EntityCache, detached_copy
 from ..common.storage import CountryNotFound, find_country
-from ..events import send_event
+from ..events import add_event, add_events
 from ..events.models import ArtistCreated, CollectionCreated, GenreCreated, SongCreated
 from ..utils import commit_db
 from .models import Artist, Collection, Genre, Song
+from .sampling import RandomIdIndex, as_uuid
 
 
 @dataclass
@@ -31,8 +35,54 @@ class PlaybackError(Exception):
     pass
 
 
+def _song_index_keys(country_code: Optional[str]) -> list:
+    return [None] if country_code is None else [None, ("country", country_code)]
+
+
+def _artist_index_keys(country_code: str, genre_id) -> list:
+    genre_id = as_uuid(genre_id)
+    return [
+        None,
+        ("country", country_code),
+        ("genre", genre_id),
+        ("country_genre", country_code, genre_id),
+    ]
+
+
+def _load_song_index():
+    rows = db.session.query(Song.id, Artist.country_code).outerjoin(
+        Artist, Artist.id == Song.artist_id
+    )
+    for id, country_code in rows.yield_per(10000):
+        yield id, _song_index_keys(country_code)
+
+
+def _load_artist_index():
+    rows = db.session.query(Artist.id, Artist.country_code, Artist.genre_id)
+    for id, country_code, genre_id in rows.yield_per(10000):
+        yield id, _artist_index_keys(country_code, genre_id)
+
+
+song_index = RandomIdIndex(
+    "song", _load_song_index, refresh_sec=app.config["RANDOM_INDEX_REFRESH_SEC"]
+)
+artist_index = RandomIdIndex(
+    "artist", _load_artist_index, refresh_sec=app.config["RANDOM_INDEX_REFRESH_SEC"]
+)
+
+# catalog entities are not changed after creation, the TTL only bounds staleness
+# in case they are changed by another process
+_cache_config = dict(
+    maxsize=app.config["CATALOG_CACHE_SIZE"],
+    ttl_sec=app.config["CATALOG_CACHE_TTL_SEC"],
+)
+genre_cache = EntityCache("genre", **_cache_config)
+artist_cache = EntityCache("artist", **_cache_config)
+song_cache = EntityCache("song", **_cache_config)
+
+
 def find_artist(id: UUID) -> Optional[Artist]:
-    artist = Artist.query.get(id)
+    artist = artist_cache.find(as_uuid(id), lambda: Artist.query.get(id))
     if artist:
         log.debug(f"Found artist {artist} by id={id}.")
     else:
@@ -58,19 +108,68 @@ def find_songs_from_collection(id: UUID) -> list[Song]:
     return songs
 
 
-def find_collections_by_artist(id: UUID) -> list[Collection]:
-    if not find_artist(id):
-        raise ArtistNotFound(artist_id=id)
-    collections = Collection.query.filter_by(artist_id=id).all()
+def get_collections_with_songs(artist_id: UUID) -> list[dict]:
+    """
+    Returns all collections of the artist with their songs, in the format of
+    `Collection.to_dict`, fetched with a single query.
+
+    Raises:
+        ArtistNotFound: if no artist found by the given id.
+    """
+    q = (
+        select(
+            Collection.id.label("col_id"),
+            Collection.name.label("col_name"),
+            Collection.collection_type,
+            Collection.genre_id.label("col_genre_id"),
+            Collection.released_dt,
+            Collection.artist_id.label("col_artist_id"),
+            Song.id.label("song_id"),
+            Song.name.label("song_name"),
+            Song.duration_sec,
+            Song.artist_id.label("song_artist_id"),
+            Song.genre_id.label("song_genre_id"),
+        )
+        .outerjoin(Song, Song.collection_id == Collection.id)
+        .where(Collection.artist_id == artist_id)
+        .order_by(Collection.created_dtm, Collection.id, Song.created_dtm)
+    )
+    collections: dict[UUID, dict] = {}
+    for row in db.session.execute(q):
+        col = collections.get(row.col_id)
+        if col is None:
+            col = collections[row.col_id] = {
+                "id": str(row.col_id),
+                "name": row.col_name,
+                "collection_type": row.collection_type,
+                "genre_id": str(row.col_genre_id),
+                "released_dt": row.released_dt.isoformat(),
+                "artist_id": str(row.col_artist_id),
+                "songs": [],
+            }
+        if row.song_id is not None:
+            col["songs"].append(
+                {
+                    "id": str(row.song_id),
+                    "name": row.song_name,
+                    "duration_sec": row.duration_sec,
+                    "collection_id": col["id"],
+                    "artist_id": str(row.song_artist_id),
+                    "genre_id": str(row.song_genre_id),
+                }
+            )
     if collections:
-        log.debug(f"Found {len(collections)} collection by artist id={id}.")
+        log.debug(f"Found {len(collections)} collections by artist id={artist_id}.")
+    elif not find_artist(artist_id):
+        # only check the artist when there is nothing to return
+        raise ArtistNotFound(artist_id=artist_id)
     else:
-        log.debug(f"No collections found by artist id={id}.")
-    return collections
+        log.debug(f"No collections found by artist id={artist_id}.")
+    return list(collections.values())
 
 
 def find_song(id: UUID) -> Optional[Song]:
-    song = Song.query.get(id)
+    song = song_cache.find(as_uuid(id), lambda: Song.query.get(id))
     if song:
         log.debug(f"Found song {song} by id={id}.")
     else:
@@ -79,16 +178,19 @@ def find_song(id: UUID) -> Optional[Song]:
 
 
 def get_random_song(country_code: Optional[str] = None) -> Optional[Song]:
-    q = Song.query
-    if country_code:
-        country = find_country(country_code)
-        if country:
-            q = q.join(Artist, Artist.id == Song.artist_id).filter(
-                Artist.country_code == country.code
-            )
-        else:
-            raise CountryNotFound(country_code=country_code)
-    song = q.order_by(func.random()).first()
+    """
+    Returns a uniformly random song, optionally of an artist from the given country.
+
+    Raises:
+        CountryNotFound: if no country found by the given code.
+    """
+    song_id = song_index.sample(("country", country_code) if country_code else None)
+    if song_id is None and country_code and not find_country(country_code):
+        raise CountryNotFound(country_code=country_code)
+    song = Song.query.get(song_id) if song_id is not None else None
+    if song_id is not None and song is None:
+        # deleted by someone else, the next call will see a fresh index
+        song_index.invalidate()
     if song:
         log.debug(f"Randomly found song {song} (country {country_code}).")
     else:
@@ -99,32 +201,40 @@ def get_random_song(country_code: Optional[str] = None) -> Optional[Song]:
 def get_random_artist(
     country_code: Optional[str] = None, genre_id: Optional[UUID] = None
 ) -> Optional[UUID]:
-    q = Artist.query
-    if country_code:
-        country = find_country(country_code)
-        if country:
-            q = q.filter(Artist.country_code == country.code)
-        else:
+    """
+    Returns the id of a uniformly random artist, optionally filtered by country and genre.
+
+    Raises:
+        CountryNotFound: if no country found by the given code.
+        GenreNotFound: if no genre found by the given id.
+    """
+    if country_code and genre_id:
+        key = ("country_genre", country_code, as_uuid(genre_id))
+    elif country_code:
+        key = ("country", country_code)
+    elif genre_id:
+        key = ("genre", as_uuid(genre_id))
+    else:
+        key = None
+    artist_id = artist_index.sample(key)
+    if artist_id is None:
+        # an empty group might mean a wrong filter
+        if country_code and not find_country(country_code):
             raise CountryNotFound(country_code=country_code)
-    if genre_id:
-        genre = find_genre(genre_id)
-        if genre:
-            q = q.filter(Artist.genre_id == genre_id)
-        else:
+        if genre_id and not find_genre(genre_id):
             raise GenreNotFound(genre_id=genre_id)
-    artist = q.order_by(func.random()).first()
     country_msg = f" from country {country_code}" if country_code else ""
     genre_msg = f" of genre {genre_id}" if genre_id else ""
-    if artist:
-        log.debug(f"Randomly found artist {artist}{country_msg}{genre_msg}.")
-        return artist.id
+    if artist_id:
+        log.debug(f"Randomly found artist {artist_id}{country_msg}{genre_msg}.")
+        return artist_id
     else:
         log.debug(f"No random artist{country_msg}{genre_msg} in the library.")
         return None
 
 
 def find_genre(id: UUID) -> Optional[Genre]:
-    genre = Genre.query.get(id)
+    genre = genre_cache.find(as_uuid(id), lambda: Genre.query.get(id))
     if genre:
         log.debug(f"Found genre {genre} by id={id}.")
     else:
@@ -139,8 +249,9 @@ def create_genre(genre_data, now: datetime) -> Genre:
     genre = Genre(**genre_data)
     log.info(f"Creating a genre: {genre_data}")
     db.session.add(genre)
-    commit_db(genre, "Genre", is_update=False)
-    # send a dwh event
+    # flush so that the generated fields are set for the event
+    db.session.flush()
+    # write a dwh event in the same transaction
     event = GenreCreated(
         id=genre.id,
         name=genre.name,
@@ -149,7 +260,10 @@ def create_genre(genre_data, now: datetime) -> Genre:
         country_code=genre.country_code,
         event_time=now,
     )
-    send_event(event)
+    add_event(event, aggregate_id=genre.id)
+    cached = detached_copy(genre)
+    commit_db(genre, "Genre", is_update=False)
+    genre_cache.put(event.id, cached)
     return genre
 
 
@@ -163,8 +277,9 @@ def create_artist(artist_data, now: datetime) -> Artist:
     artist = Artist(**artist_data)
     log.info(f"Creating an artist: {artist_data}")
     db.session.add(artist)
-    commit_db(artist, "Artist", is_update=False)
-    # send a dwh event
+    # flush so that the generated fields are set for the event
+    db.session.flush()
+    # write a dwh event in the same transaction
     event = ArtistCreated(
         id=artist.id,
         name=artist.name,
@@ -173,70 +288,101 @@ def create_artist(artist_data, now: datetime) -> Artist:
         genre_id=artist.genre_id,
         event_time=now,
     )
-    send_event(event)
+    add_event(event, aggregate_id=artist.id)
+    cached = detached_copy(artist)
+    commit_db(artist, "Artist", is_update=False)
+    artist_cache.put(event.id, cached)
+    artist_index.add(event.id, _artist_index_keys(event.country_code, event.genre_id))
     return artist
 
 
-def _create_song(now: datetime, **data) -> Song:
-    song = Song(**data)
-    db.session.add(song)
-    commit_db(song, "Song", is_update=False)
-    song_event = SongCreated(
-        id=song.id,
-        collection_id=song.collection_id,
-        artist_id=song.artist_id,
-        genre_id=song.genre_id,
-        name=song.name,
-        duration_sec=song.duration_sec,
-        event_time=now,
-    )
-    send_event(song_event)
-    return song
+def _load_by_ids(model, ids: set) -> dict:
+    return {row.id: row for row in model.query.filter(model.id.in_(ids))}
+
+
+def create_collections(collections_data: list[dict], now: datetime) -> list[UUID]:
+    """
+    Creates the collections with all their songs in a single transaction, using one
+    multi-row insert for the collections and one for the songs, and writes all the
+    dwh events to the outbox as one batch.
 
+    Returns the ids of the created collections, in the order of the input.
 
-def create_collection(data: dict, now: datetime) -> Collection:
-    # TODO do it transactionally
-    # check artist_id
-    artist = find_artist(data["artist_id"])
-    if not artist:
-        raise ArtistNotFound(artist_id=data["artist_id"])
-    # check genre_id
-    genre = find_genre(data["genre_id"])
-    if not genre:
-        raise GenreNotFound(genre_id=data["genre_id"])
-    # create collection
-    released_dt = date.fromisoformat(
-        data["released_dt"]
-    )  # ISO 8601 date example: '2022-31-12'
-    collection = Collection(
-        artist_id=artist.id,
-        name=data["name"],
-        collection_type=data["type"],
-        genre_id=genre.id,
-        released_dt=released_dt,
+    Raises:
+        ArtistNotFound: if no artist found by one of the artist ids.
+        GenreNotFound: if no genre found by one of the genre ids.
+    """
+    if not collections_data:
+        return []
+    artists = _load_by_ids(
+        Artist, {UUID(str(d["artist_id"])) for d in collections_data}
     )
-    db.session.add(collection)
-    # flush so that we can get the id of the collection
-    commit_db(collection, "Collection", is_update=False)
-    # send dwh event
-    collection_event = CollectionCreated(
-        id=collection.id,
-        name=collection.name,
-        collection_type=collection.collection_type,
-        artist_id=collection.artist_id,
-        genre_id=collection.genre_id,
-        released_dt=collection.released_dt,
-        event_time=now,
+    genres = _load_by_ids(Genre, {UUID(str(d["genre_id"])) for d in collections_data})
+    collection_rows, song_rows = [], []
+    events, new_songs = [], []
+    for data in collections_data:
+        artist = artists.get(UUID(str(data["artist_id"])))
+        if not artist:
+            raise ArtistNotFound(artist_id=data["artist_id"])
+        genre = genres.get(UUID(str(data["genre_id"])))
+        if not genre:
+            raise GenreNotFound(genre_id=data["genre_id"])
+        # ids are generated here so that the events can be built before the insert
+        collection_id = uuid4()
+        collection_row = dict(
+            id=collection_id,
+            artist_id=artist.id,
+            name=data["name"],
+            collection_type=data["type"],
+            genre_id=genre.id,
+            # ISO 8601 date example: '2022-31-12'
+            released_dt=date.fromisoformat(data["released_dt"]),
+        )
+        collection_rows.append(collection_row)
+        collection_event = CollectionCreated(event_time=now, **collection_row)
+        events.append((collection_event, collection_id))
+        for song_data in data["songs"]:
+            song_row = dict(
+                id=uuid4(),
+                name=song_data["name"],
+                duration_sec=song_data["duration_sec"],
+                collection_id=collection_id,
+                artist_id=artist.id,
+                genre_id=genre.id,
+            )
+            song_rows.append(song_row)
+            events.append((SongCreated(event_time=now, **song_row), song_row["id"]))
+            new_songs.append((song_row, artist.country_code))
+    log.info(
+        f"Creating {len(collection_rows)} collections with {len(song_rows)} songs."
     )
-    send_event(collection_event)
-    # create each song and send a dwh event for each
-    songs = data["songs"]
-    for song_data in songs:
-        song_data["collection_id"] = collection.id
-        song_data["artist_id"] = artist.id
-        song_data["genre_id"] = genre.id
-        song = _create_song(now=now, **song_data)
-    return collection
+    # collections and their songs are listed by creation time, one microsecond apart
+    # keeps them in the order of the input
+    created_dtm = datetime.utcnow()
+    for rows in (collection_rows, song_rows):
+        for i, row in enumerate(rows):
+            row["created_dtm"] = row["modified_dtm"] = created_dtm + timedelta(
+                microseconds=i
+            )
+    db.session.execute(insert(Collection), collection_rows)
+    if song_rows:
+        db.session.execute(insert(Song), song_rows)
+    # write the dwh events in the same transaction
+    add_events(events)
+    commit_db(None, f"{len(collection_rows)} collections", is_update=False)
+    for song_row, country_code in new_songs:
+        song = Song(**song_row)
+        make_transient_to_detached(song)
+        song_cache.put(song.id, song)
+        song_index.add(song.id, _song_index_keys(country_code))
+    return [row["id"] for row in collection_rows]
+
+
+def create_collection(data: dict, now: datetime) -> UUID:
+    """
+    Creates a collection with its songs, see `create_collections`.
+    """
+    return create_collections([data], now)[0]
 
 
 def get_genres(country: Optional[str] = None) -> list[Genre]:
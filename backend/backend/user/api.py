@@ -15,6 +15,7 @@ from ..user.storage import (
     like_song,
     subscribe_user,
 )
+from .auth import current_user_id
 
 api = Blueprint("api", __name__, url_prefix="/api")
 
@@ -22,6 +23,7 @@ api = Blueprint("api", __name__, url_prefix="/api")
 @api.route("/play", methods=["POST"])
 @jwt_required()
 def post_play():
+    user_id = current_user_id()
     now = g.request_time
     session_id = UUID(get_jwt()["session_id"])
     data = request.get_json()
@@ -30,7 +32,7 @@ def post_play():
         song_id = UUID(data["song_id"])
         start_time = data["start_time"]
         play_song(
-            user_id=current_user.id,
+            user_id=user_id,
             session_id=session_id,
             song_id=song_id,
             start_time=start_time,
@@ -39,12 +41,12 @@ def post_play():
         return "OK", 200
     except SongNotFound as e:
         log.error(
-            f"Could not play song: song not found. Req: {data}, user_id={current_user.id}."
+            f"Could not play song: song not found. Req: {data}, user_id={user_id}."
         )
         abort(404, "Song not found.")
     except PlaybackError as e:
         log.error(
-            f"Could not play song: invalid start time. Req: {data}, user_id={current_user.id}."
+            f"Could not play song: invalid start time. Req: {data}, user_id={user_id}."
         )
         abort(400, "Invalid start time.")
 
@@ -52,6 +54,7 @@ def post_play():
 @api.route("/stop", methods=["POST"])
 @jwt_required()
 def post_stop():
+    user_id = current_user_id()
     now = g.request_time
     session_id = UUID(get_jwt()["session_id"])
     data = request.get_json()
@@ -60,7 +63,7 @@ def post_stop():
         song_id = UUID(data["song_id"])
         stop_time = data["stop_time"]
         stop_song(
-            user_id=current_user.id,
+            user_id=user_id,
             session_id=session_id,
             song_id=song_id,
             stop_time=stop_time,
@@ -69,12 +72,12 @@ def post_stop():
         return "OK", 200
     except SongNotFound as e:
         log.error(
-            f"Could not stop song: song not found. Req: {data}, user_id={current_user.id}."
+            f"Could not stop song: song not found. Req: {data}, user_id={user_id}."
         )
         abort(404, "Song not found.")
     except PlaybackError as e:
         log.error(
-            f"Could not stop song: invalid stop time. Req: {data}, user_id={current_user.id}."
+            f"Could not stop song: invalid stop time. Req: {data}, user_id={user_id}."
         )
         abort(400, "Invalid stop time.")
 
@@ -82,13 +85,14 @@ def post_stop():
 @api.route("/like/song", methods=["POST"])
 @jwt_required()
 def post_like_song():
+    user_id = current_user_id()
     now = g.request_time
     session_id = UUID(get_jwt()["session_id"])
     data = request.get_json()
     try:
         validate_request(data, ["song_id"])
         like_song(
-            user_id=current_user.id,
+            user_id=user_id,
             session_id=session_id,
             song_id=UUID(data["song_id"]),
             now=now,
@@ -96,7 +100,7 @@ def post_like_song():
         return "OK", 200
     except SongNotFound as e:
         log.error(
-            f"Could not like song: song not found. Req: {data}, user_id={current_user.id}."
+            f"Could not like song: song not found. Req: {data}, user_id={user_id}."
         )
         abort(404, "Song not found.")
 
@@ -104,21 +108,23 @@ def post_like_song():
 @api.route("/like/songs", methods=["GET"])
 @jwt_required()
 def get_liked_songs():
+    user_id = current_user_id()
     by_artist = request.args.get("artist_id", default=None, type=UUID)
-    songs = all_liked_songs(user_id=current_user.id, artist_id=by_artist)
+    songs = all_liked_songs(user_id=user_id, artist_id=by_artist)
     return jsonify(songs), 200
 
 
 @api.route("/follow/artist", methods=["POST"])
 @jwt_required()
 def post_follow_artist():
+    user_id = current_user_id()
     now = g.request_time
     session_id = UUID(get_jwt()["session_id"])
     data = request.get_json()
     try:
         validate_request(data, ["artist_id"])
         follow_artist(
-            user_id=current_user.id,
+            user_id=user_id,
             session_id=session_id,
             artist_id=UUID(data["artist_id"]),
             now=now,
@@ -126,7 +132,7 @@ def post_follow_artist():
         return "OK", 200
     except ArtistNotFound as e:
         log.error(
-            f"Could not follow artist: artist not found. Req: {data}, user_id={current_user.id}."
+            f"Could not follow artist: artist not found. Req: {data}, user_id={user_id}."
         )
         abort(404, "Artist not found.")
 
@@ -134,7 +140,8 @@ def post_follow_artist():
 @api.route("/follow/artists", methods=["GET"])
 @jwt_required()
 def get_followed_artists():
-    artists = all_followed_artists(user_id=current_user.id)
+    user_id = current_user_id()
+    artists = all_followed_artists(user_id=user_id)
     return jsonify(artists), 200
 
 
@@ -1,6 +1,12 @@
 from uuid import UUID, uuid4
 from flask import Blueprint, abort, jsonify, request, g
-from flask_jwt_extended import create_access_token, current_user, get_jwt, jwt_required
+from flask_jwt_extended import (
+    create_access_token,
+    current_user,
+    get_jwt,
+    get_jwt_identity,
+    jwt_required,
+)
 
 from .. import jwt, log
 from ..events import send_event
@@ -13,6 +19,7 @@ from .storage import (
     UserAlreadyExists,
     UserNotFound,
     create_user,
+    find_user_by_id,
     validate_password,
 )
 
@@ -27,7 +34,15 @@ def user_identity_lookup(user: User):
 @jwt.user_lookup_loader
 def user_lookup_callback(_jwt_header, jwt_data):
     identity = jwt_data["sub"]
-    return User.query.filter_by(id=identity).one_or_none()
+    return find_user_by_id(UUID(identity))
+
+
+def current_user_id() -> UUID:
+    """
+    Returns the id of the authenticated user from the JWT, without touching the
+    user entity.
+    """
+    return UUID(get_jwt_identity())
 
 
 @auth.route("/sign_up", methods=["POST"])
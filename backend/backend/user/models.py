@@ -1,20 +1,13 @@
-import bcrypt
 from sqlalchemy.dialects import postgresql as psql
 
 from .. import db
 from ..common.models import Country
 from ..utils import BaseModel, TimedModel
+from .passwords import hasher
 
 # todo user permissions: admin, creator (with artist id), user
 
 
-def hash_password(password: str) -> bytes:
-    b_password = bytes(password, "utf-8")
-    salt = bcrypt.gensalt()
-    hash = bcrypt.hashpw(b_password, salt)
-    return hash
-
-
 class User(BaseModel):
     __tablename__ = "users"
 
@@ -28,8 +21,7 @@ class User(BaseModel):
     birth_date = db.Column(db.Date, nullable=True)
 
     def set_password(self, password: str) -> None:
-        new_hash = hash_password(password)
-        self.password_hash = new_hash.decode(encoding="utf-8")
+        self.password_hash = hasher.hash(password)
 
     def __repr__(self):
         return f"<User {self.id}: {self.email}>"
@@ -0,0 +1,101 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+from typing import Callable, TypeVar
+
+import bcrypt
+from werkzeug.exceptions import TooManyRequests
+
+from .. import app, log
+
+T = TypeVar("T")
+
+
+class PasswordHasher:
+    """
+    Runs bcrypt on a dedicated thread pool, so that request threads only wait for it.
+
+    bcrypt releases the GIL while hashing, so the pool size is the number of cores
+    spent on passwords. At most `max_queue` calls wait for a free worker, further
+    calls are rejected with HTTP 429 instead of piling up.
+    """
+
+    def __init__(self, rounds: int, workers: int, max_queue: int) -> None:
+        self.rounds = rounds
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="bcrypt"
+        )
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._lock = threading.Lock()
+        self._calls = 0
+        self._rejected = 0
+        self._total_wait_ms = 0.0
+        self._max_wait_ms = 0.0
+        self._total_hash_ms = 0.0
+        self._max_hash_ms = 0.0
+
+    def _run(self, fn: Callable[..., T], *args) -> T:
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            log.warning("Password hashing queue is full, rejecting the request.")
+            raise TooManyRequests("Too many sign in requests, try again later.")
+        try:
+            submitted = time.monotonic()
+            return self._executor.submit(self._timed, submitted, fn, *args).result()
+        finally:
+            self._slots.release()
+
+    def _timed(self, submitted: float, fn: Callable[..., T], *args) -> T:
+        started = time.monotonic()
+        try:
+            return fn(*args)
+        finally:
+            wait_ms = (started - submitted) * 1000
+            hash_ms = (time.monotonic() - started) * 1000
+            with self._lock:
+                self._calls += 1
+                self._total_wait_ms += wait_ms
+                self._max_wait_ms = max(self._max_wait_ms, wait_ms)
+                self._total_hash_ms += hash_ms
+                self._max_hash_ms = max(self._max_hash_ms, hash_ms)
+
+    def hash(self, password: str) -> str:
+        b_password = password.encode(encoding="utf-8")
+        salt = bcrypt.gensalt(rounds=self.rounds)
+        return self._run(bcrypt.hashpw, b_password, salt).decode(encoding="utf-8")
+
+    def check(self, password: str, password_hash: str) -> bool:
+        return self._run(
+            bcrypt.checkpw,
+            password.encode(encoding="utf-8"),
+            password_hash.encode(encoding="utf-8"),
+        )
+
+    def stats(self) -> dict:
+        with self._lock:
+            calls = self._calls
+            return {
+                "rounds": self.rounds,
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "calls": calls,
+                "rejected": self._rejected,
+                "queue_wait_ms": {
+                    "avg": round(self._total_wait_ms / calls, 3) if calls else 0,
+                    "max": round(self._max_wait_ms, 3),
+                },
+                "hash_ms": {
+                    "avg": round(self._total_hash_ms / calls, 3) if calls else 0,
+                    "max": round(self._max_hash_ms, 3),
+                },
+            }
+
+
+hasher = PasswordHasher(
+    rounds=app.config["BCRYPT_ROUNDS"],
+    workers=app.config["PASSWORD_HASH_WORKERS"],
+    max_queue=app.config["PASSWORD_HASH_MAX_QUEUE"],
+)
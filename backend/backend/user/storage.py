@@ -3,13 +3,13 @@ from datetime import date, datetime
 from typing import Optional
 from uuid import UUID
 
-import bcrypt
 from flask import abort
 
 
-from .. import db, log
+from .. import app, db, log
+from ..cache import EntityCache
 from ..common.storage import find_country
-from ..events import send_event
+from ..events import add_event, send_event
 from ..events.models import (
     ArtistFollowedEvent,
     SignUpEvent,
@@ -28,6 +28,14 @@ from ..music.storage import (
 )
 from ..utils import commit_db
 from .models import ArtistFollow, SongLike, User
+from .passwords import hasher
+
+
+user_cache = EntityCache(
+    "user",
+    maxsize=app.config["USER_CACHE_SIZE"],
+    ttl_sec=app.config["USER_CACHE_TTL_SEC"],
+)
 
 
 @dataclass
@@ -57,6 +65,18 @@ def find_user(email: str) -> Optional[User]:
     return user
 
 
+def find_user_by_id(id: UUID) -> Optional[User]:
+    """
+    Returns a user by id, served from the user cache when possible.
+    """
+    user = user_cache.find(id, lambda: User.query.get(id))
+    if user:
+        log.debug(f"Found user {user} by id {id}.")
+    else:
+        log.debug(f"No user found by id {id}.")
+    return user
+
+
 def create_user(data: NewUserData, now: datetime) -> User:
     """
     Raises:
@@ -86,7 +106,7 @@ def create_user(data: NewUserData, now: datetime) -> User:
     user.set_password(data.password)
     log.info(f"Creating new user: {user}.")
     db.session.add(user)
-    commit_db(user, "User", is_update=False)
+    db.session.flush()
     event = SignUpEvent(
         user_id=user.id,
         email=user.email,
@@ -96,7 +116,8 @@ def create_user(data: NewUserData, now: datetime) -> User:
         birth_date=user.birth_date,
         event_time=now,
     )
-    send_event(event)
+    add_event(event, aggregate_id=user.id)
+    commit_db(user, "User", is_update=False)
     return user
 
 
@@ -115,13 +136,12 @@ def validate_password(email: str, password: str) -> User:
     Raises:
         UserNotFound: if no user found by this email.
         InvalidPassword: if the given password and the user's password don't match.
+        TooManyRequests: if too many passwords are being checked at the moment.
     """
     user = find_user(email)
     if not user:
         raise UserNotFound(email=email)
-    valid = bcrypt.checkpw(
-        password.encode(encoding="utf-8"), user.password_hash.encode(encoding="utf-8")
-    )
+    valid = hasher.check(password, user.password_hash)
     if valid:
         log.info(f"Successful sign in for user {user}")
         return user
@@ -135,13 +155,14 @@ def like_song(user_id: UUID, session_id: UUID, song_id: UUID, now: datetime) ->
         raise SongNotFound(song_id=song_id)
     like = SongLike(user_id=user_id, song_id=song.id)
     db.session.add(like)
-    commit_db(like, "SongLike", is_update=False)
-    log.info(f"User {user_id} liked song id={song.id}.")
-    send_event(
+    add_event(
         SongLikedEvent(
             user_id=user_id, session_id=session_id, song_id=song.id, event_time=now
-        )
+        ),
+        aggregate_id=user_id,
     )
+    commit_db(like, "SongLike", is_update=False)
+    log.info(f"User {user_id} liked song id={song_id}.")
 
 
 def all_liked_songs(user_id: UUID, artist_id: Optional[UUID] = None) -> list[str]:
@@ -169,13 +190,14 @@ def follow_artist(
         raise ArtistNotFound(artist_id=artist_id)
     follow = ArtistFollow(user_id=user_id, artist_id=artist.id)
     db.session.add(follow)
-    commit_db(follow, "ArtistFollow", is_update=False)
-    log.info(f"User {user_id} followed artist id={artist.id}.")
-    send_event(
+    add_event(
         ArtistFollowedEvent(
             user_id=user_id, session_id=session_id, artist_id=artist.id, event_time=now
-        )
+        ),
+        aggregate_id=user_id,
     )
+    commit_db(follow, "ArtistFollow", is_update=False)
+    log.info(f"User {user_id} followed artist id={artist_id}.")
 
 
 def all_followed_artists(user_id: UUID) -> list[str]:
@@ -250,8 +272,10 @@ def subscribe_user(user: User, session_id: UUID, now: datetime) -> None:
         raise UserAlreadySubscribed(user.email)
     user.is_premium = True
     db.session.add(user)
-    commit_db(user, "User")
-    send_event(
-        UserSubscriptionEvent(user_id=user.id, session_id=session_id, event_time=now)
+    add_event(
+        UserSubscriptionEvent(user_id=user.id, session_id=session_id, event_time=now),
+        aggregate_id=user.id,
     )
+    commit_db(user, "User")
+    user_cache.invalidate(user.id)
     log.info(f"User {user} bought a premium subscription.")
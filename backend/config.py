@@ -13,6 +13,39 @@ class Config:
 
     KAFKA_BOOTSTRAP_SERVERS = ["localhost:9092"]
     KAFKA_DWH_TOPIC = "dwh_events"
+    # wire format of the DWH events: "binary" (see eventcodec) or "json"
+    KAFKA_EVENT_ENCODING = "binary"
+    # "sync" waits for the broker on every event, "async" buffers events in memory
+    # and sends them in batches from a background thread
+    KAFKA_SEND_MODE = "async"
+    KAFKA_BUFFER_SIZE = 10000
+    # "drop_newest", "drop_oldest" or "block" when the buffer is full; the drop
+    # policies lose DWH events under load, every drop is logged and counted
+    KAFKA_BUFFER_OVERFLOW_POLICY = "block"
+    KAFKA_BATCH_MAX_EVENTS = 500
+    KAFKA_LINGER_MS = 50
+    KAFKA_COMPRESSION_TYPE = "gzip"
+    KAFKA_MAX_IN_FLIGHT = 5
+
+    # Transactional outbox relay for entity events
+    OUTBOX_BATCH_SIZE = 500
+    OUTBOX_POLL_INTERVAL_MS = 200
+
+    # how often the in-memory indexes for random songs/artists are reloaded from the DB
+    RANDOM_INDEX_REFRESH_SEC = 300
+
+    # in-process cache of catalog entities (countries, genres, artists, songs)
+    CATALOG_CACHE_SIZE = 100000
+    CATALOG_CACHE_TTL_SEC = 3600
+    # cache of users loaded for authenticated requests
+    USER_CACHE_SIZE = 100000
+    USER_CACHE_TTL_SEC = 300
+
+    # bcrypt work factor and the thread pool running it, password checks beyond
+    # the queue size are rejected with HTTP 429
+    BCRYPT_ROUNDS = 12
+    PASSWORD_HASH_WORKERS = 4
+    PASSWORD_HASH_MAX_QUEUE = 64
 
     DROP_DB_ON_START = True
 
@@ -12,8 +12,30 @@ class Config:
 
     KAFKA_BOOTSTRAP_SERVERS = ["localhost:9092"]
     KAFKA_DWH_TOPIC = "dwh_events"
+    KAFKA_STAGE_GROUP_ID = "dwh_stage"
+
+    # max events written to stage in one transaction
+    STAGE_BATCH_MAX_RECORDS = 5000
+    STAGE_REPORT_INTERVAL_SEC = 10
+    # consumer processes loading the stage in parallel, at most one per partition
+    # does any work
+    STAGE_WORKERS = 4
+    STAGE_SUPERVISE_INTERVAL_SEC = 1
+    STAGE_SHUTDOWN_TIMEOUT_SEC = 30
     
+    # stage rows written up to this long before a watermark are read again by the
+    # next Data Vault load, to cover transactions committed out of order
+    DV_WATERMARK_LAG_SEC = 60
+    # max Data Vault processes loading at the same time, each holds a DB connection
+    DV_PARALLELISM = 4
+
     EXECUTION_DATE_MART = '2023-05-26'
+    # similar songs and artists kept per item
+    RECOMMENDATION_TOP_K = 20
+    # a like counts as this many completed listenings
+    RECOMMENDATION_LIKE_WEIGHT = 3
+    # items whose similarities are computed together, bounds the memory used
+    RECOMMENDATION_CHUNK_SIZE = 2000
 
 
 
@@ -1,48 +1,25 @@
-import yaml
+import argparse
+import logging
 
-from .models import meta, engine
-from .load_to_data_vault_operator import (
-    Metadata,
-    load_to_hub,
-    load_to_link,
-    load_to_lsat,
-    load_to_sat,
-    load_to_ref,
-)
+from ..config import Config
+from .models import meta, engine, upgrade_existing_tables
+from .scheduler import build_dag, read_metadata, run_dag
 
 
 meta.create_all(engine)
-
-
-with open("dwh/data_vault/metadata/hub.yaml", "r") as file:
-    process_metadata = yaml.safe_load(file)
-    for process in process_metadata:
-        metadata = Metadata(process)
-        load_to_hub(metadata)
-
-with open("dwh/data_vault/metadata/sat.yaml", "r") as file:
-    process_metadata = yaml.safe_load(file)
-    for process in process_metadata:
-        metadata = Metadata(process)
-        load_to_sat(metadata)
-
-with open("dwh/data_vault/metadata/link.yaml", "r") as file:
-    process_metadata = yaml.safe_load(file)
-    for process in process_metadata:
-        metadata = Metadata(process)
-        load_to_link(metadata)
-
-with open("dwh/data_vault/metadata/lsat.yaml", "r") as file:
-    process_metadata = yaml.safe_load(file)
-    for process in process_metadata:
-        metadata = Metadata(process)
-        load_to_lsat(metadata)
-
-with open("dwh/data_vault/metadata/ref.yaml", "r") as file:
-    process_metadata = yaml.safe_load(file)
-    for process in process_metadata:
-        metadata = Metadata(process)
-        load_to_ref(metadata)
-
-
-
+upgrade_existing_tables()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Loads the stage to the Data Vault.")
+    parser.add_argument(
+        "--parallelism",
+        type=int,
+        default=Config.DV_PARALLELISM,
+        help="max number of processes loading at the same time",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s %(threadName)s %(name)s: %(message)s",
+    )
+    run_dag(build_dag(read_metadata()), parallelism=args.parallelism)
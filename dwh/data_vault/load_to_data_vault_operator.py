@@ -1,16 +1,26 @@
-from sqlalchemy.sql import text
-from sqlalchemy import select
+from dataclasses import dataclass
+import re
+from typing import Optional
 
-from datetime import datetime
+from sqlalchemy.sql import func, text
+from sqlalchemy import exists, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.engine import Connection
+
+from datetime import datetime, timedelta
 from random import uniform
+from ..config import Config
+from ..hashing import hash_key_name
 from ..stage.models import KafkaCountryEnabled
 
 from .. import engine
+from .models import load_watermark, ref_country_subscription_cost
 
 
 class Metadata:
     def __init__(self, metadata: dict) -> None:
         self.process_name = metadata["process_name"]
+        self.process_type = metadata["process_type"]
         self.target_schema = metadata["target"]["schema"]
         self.target_table = metadata["target"]["table"]
         self.target_key = metadata["target"]["key"]
@@ -26,75 +36,182 @@ class Metadata:
 
 
 def generate_hash_key(source_key: str, source_name: str) -> str:
-    return f"""encode(digest(concat_ws('#', {source_key}) || '#' 
-                || '{source_name}', 'sha256'),'base64') 
+    """
+    SQL expression of the hash of the given expressions, only used for row hashes:
+    the hash keys are computed at stage ingest (see `dwh.hashing.hash_key`).
+    """
+    return f"""digest(concat_ws('#', {source_key}) || '#' 
+                || '{source_name}', 'sha256')
                 """
 
 
-def load_to_hub(metadata: Metadata) -> None:
+@dataclass
+class WatermarkRange:
+    """
+    Stage rows with `low < load_dtm <= high` are loaded by the current run.
+    """
+
+    low: datetime
+    high: datetime
+
+    @property
+    def params(self) -> dict:
+        return {"low_watermark": self.low, "high_watermark": self.high}
+
+
+def get_watermark_range(
+    conn: Connection, metadata: Metadata
+) -> Optional[WatermarkRange]:
+    """
+    Returns the range of stage rows to load, or `None` if the source table is empty.
+
+    The range starts `DV_WATERMARK_LAG_SEC` before the stored watermark, since a
+    row of a transaction that committed late can have an older `load_dtm` than rows
+    already loaded. All the loads are idempotent, so reading a row again is safe.
+    """
+    watermark = conn.execute(
+        select(load_watermark.c.watermark_dtm).where(
+            load_watermark.c.process_name == metadata.process_name
+        )
+    ).scalar()
+    high = conn.execute(
+        text(
+            f"select max(load_dtm) from {metadata.source_schema}.{metadata.source_table}"
+        )
+    ).scalar()
+    if high is None:
+        return None
+    if watermark is None:
+        return WatermarkRange(low=datetime.min, high=high)
+    low = watermark - timedelta(seconds=Config.DV_WATERMARK_LAG_SEC)
+    return WatermarkRange(low=low, high=max(high, watermark))
+
+
+def advance_watermark(
+    conn: Connection, metadata: Metadata, watermarks: WatermarkRange
+) -> None:
+    """
+    Stores the new watermark, in the same transaction as the load itself.
+    """
+    stmt = insert(load_watermark).values(
+        process_name=metadata.process_name,
+        source_table=f"{metadata.source_schema}.{metadata.source_table}",
+        watermark_dtm=watermarks.high,
+    )
+    conn.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["process_name"],
+            set_={
+                "watermark_dtm": stmt.excluded.watermark_dtm,
+                "updated_dtm": func.now(),
+            },
+        )
+    )
+
+
+def incremental_source(metadata: Metadata) -> str:
+    """
+    Returns the source table restricted to the rows of the current watermark range.
+    """
+    table = f"{metadata.source_schema}.{metadata.source_table}"
+    return f"""(select * from {table}
+                where load_dtm > :low_watermark
+                  and load_dtm <= :high_watermark) {metadata.source_table}"""
+
+
+def incremental_query(metadata: Metadata) -> str:
+    """
+    Returns the custom query of the process reading only the current watermark range.
+
+    Raises:
+        ValueError: if the custom query does not read the source table.
+    """
+    table = f"{metadata.source_schema}.{metadata.source_table}"
+    # whole words only, `stage.kafka_song` must not match `stage.kafka_song_like`
+    pattern = re.compile(rf"\b{re.escape(table)}\b")
+    if not pattern.search(metadata.custom_query):
+        raise ValueError(
+            f"Custom query of {metadata.process_name} does not read {table}."
+        )
+    return pattern.sub(lambda _: incremental_source(metadata), metadata.custom_query)
+
+
+def load_to_hub(metadata: Metadata) -> int:
     with engine.connect() as conn:
+        watermarks = get_watermark_range(conn, metadata)
+        if watermarks is None:
+            return 0
         query = text(
             f"""insert into {metadata.target_schema}.{metadata.target_table} ({metadata.target_key}, original_id, source)
-                select {generate_hash_key(metadata.source_key, metadata.source_name)}
-                                as {metadata.target_key},
+                select {hash_key_name(metadata.source_key)} as {metadata.target_key},
                     {metadata.source_key} as original_id,
                     '{metadata.source_name}' as source
-                from {metadata.source_schema}.{metadata.source_table}
-                where {metadata.source_key} not in 
-                    (select original_id from {metadata.target_schema}.{metadata.target_table});"""
+                from {incremental_source(metadata)}
+                on conflict ({metadata.target_key}) do nothing;"""
         )
         print(query)
-        conn.execute(query)
+        result = conn.execute(query, watermarks.params)
+        advance_watermark(conn, metadata, watermarks)
         conn.commit()
+        return result.rowcount
 
 
-def load_to_link(metadata: Metadata) -> None:
+def load_to_link(metadata: Metadata) -> int:
     with engine.connect() as conn:
+        watermarks = get_watermark_range(conn, metadata)
+        if watermarks is None:
+            return 0
         separated_target_fields = metadata.target_fields.split(",")
         separated_source_fields = metadata.source_fields.split(",")
         hashed_fields = ""
         for i in range(len(separated_source_fields)):
-            hashed_fields += f"""{generate_hash_key(separated_source_fields[i], metadata.source_name)}
+            hashed_fields += f"""{hash_key_name(separated_source_fields[i])}
                                 as {separated_target_fields[i]},"""
         hashed_fields = hashed_fields[:-1]
-        hashed_key = generate_hash_key(metadata.source_fields, metadata.source_name)
+        hashed_key = hash_key_name(metadata.source_fields)
 
         query = text(
             f"""insert into {metadata.target_schema}.{metadata.target_table}
             ({metadata.target_key}, {metadata.target_fields})
                 select {hashed_key} as {metadata.target_key},
                         {hashed_fields}
-                from ({metadata.custom_query}) t
-                where {hashed_key}
-                    not in (select {metadata.target_key} from {metadata.target_schema}.{metadata.target_table})"""
+                from ({incremental_query(metadata)}) t
+                on conflict ({metadata.target_key}) do nothing"""
         )
-        conn.execute(query)
+        result = conn.execute(query, watermarks.params)
+        advance_watermark(conn, metadata, watermarks)
         conn.commit()
+        return result.rowcount
 
 
-def load_to_lsat(metadata: Metadata) -> None:
+def load_to_lsat(metadata: Metadata) -> int:
     with engine.connect() as conn:
-        hashed_key = generate_hash_key(metadata.source_key, metadata.source_name)
+        watermarks = get_watermark_range(conn, metadata)
+        if watermarks is None:
+            return 0
+        hashed_key = hash_key_name(metadata.source_key)
         query = text(
             f"""insert into {metadata.target_schema}.{metadata.target_table}
                     ({metadata.target_key}, {metadata.target_fields}, source)
-                    with source_data as({metadata.custom_query})
+                    with source_data as({incremental_query(metadata)})
                     select {hashed_key} as {metadata.target_key},
                         {metadata.target_fields},
                         '{metadata.source_name}' as source
                     from source_data
-                    where {hashed_key} || actual_dtm::varchar not in (select {metadata.target_key} || actual_dtm::varchar
-                                            from {metadata.target_schema}.{metadata.target_table})"""
+                    on conflict ({metadata.target_key}, actual_dtm) do nothing"""
         )
-        conn.execute(query)
+        result = conn.execute(query, watermarks.params)
+        advance_watermark(conn, metadata, watermarks)
         conn.commit()
+        return result.rowcount
 
 
-def load_to_sat(metadata: Metadata):
+def load_to_sat(metadata: Metadata) -> int:
     with engine.connect() as conn:
-        hashed_key = generate_hash_key(
-            "sd." + metadata.target_key, metadata.source_name
-        )
+        watermarks = get_watermark_range(conn, metadata)
+        if watermarks is None:
+            return 0
+        hashed_key = "sd." + hash_key_name(metadata.source_key)
 
         target_fields = metadata.target_fields.split(",")
         coalesce_target_fields_as = ""
@@ -112,11 +229,15 @@ def load_to_sat(metadata: Metadata):
         query = text(
             f"""insert into {metadata.target_schema}.{metadata.target_table}
         ({metadata.target_key}, {metadata.target_fields}, row_hash, source)
-        with source_data as ({metadata.custom_query}),
+        with source_data as ({incremental_query(metadata)}),
 
-        previous_data as (select *,
-                        row_number() over (partition by {metadata.target_key} order by actual_dtm desc) as rnum
-                        from {metadata.target_schema}.{metadata.target_table}),
+        -- latest version of the keys in the batch only, read from the
+        -- (key, actual_dtm) primary key scanned backwards
+        previous_data as (select distinct on ({metadata.target_key}) *
+                          from {metadata.target_schema}.{metadata.target_table}
+                          where {metadata.target_key} in (select {hashed_key}
+                                                          from source_data sd)
+                          order by {metadata.target_key}, actual_dtm desc),
         
         hashed as (select {hashed_key} as {metadata.target_key},
                           {coalesce_target_fields_as},
@@ -124,21 +245,27 @@ def load_to_sat(metadata: Metadata):
                           '{metadata.source_name}' as source
                    from source_data sd
                     left join previous_data pd 
-				  	       on sd.{metadata.target_key} = pd.{metadata.target_key}
-					      and pd.rnum = 1)
+				  	       on {hashed_key} = pd.{metadata.target_key})
            
-        select * from hashed where row_hash not in (select row_hash 
-            from {metadata.target_schema}.{metadata.target_table})"""
+        select * from hashed h
+        where not exists (select 1
+                          from {metadata.target_schema}.{metadata.target_table} t
+                          where t.{metadata.target_key} = h.{metadata.target_key}
+                            and t.row_hash = h.row_hash)
+        on conflict ({metadata.target_key}, actual_dtm) do nothing"""
         )
-        conn.execute(query)
+        result = conn.execute(query, watermarks.params)
+        advance_watermark(conn, metadata, watermarks)
         conn.commit()
+        return result.rowcount
 
 
-def load_to_ref(metadata: Metadata):
+def load_to_ref(metadata: Metadata) -> int:
     if metadata.process_name == 'ref_country_subscription_cost':
-        load_countries(metadata)
+        return load_countries(metadata)
     elif metadata.process_name == 'ref_genre':
-        load_genres(metadata)
+        return load_genres(metadata)
+    return 0
 
 
 
@@ -167,28 +294,54 @@ def generate_values_ref_country():
     premium_royalty = round(royalty * cost_range["premium_royalty_multiplier"], 2)
     return basic_subscription, premium_subscription, royalty, premium_royalty
 
-def load_countries(metadata: Metadata):
-    stmt = select(KafkaCountryEnabled.country_code, KafkaCountryEnabled.event_time)
+def load_countries(metadata: Metadata) -> int:
+    """
+    Adds the subscription costs of the countries enabled since the last run, with
+    one multi-row insert. Returns the number of rows inserted.
+    """
+    ref = ref_country_subscription_cost
+    new_countries = (
+        select(
+            KafkaCountryEnabled.country_code,
+            func.min(KafkaCountryEnabled.event_time),
+        )
+        .where(
+            ~exists().where(ref.c.country_code == KafkaCountryEnabled.country_code)
+        )
+        .group_by(KafkaCountryEnabled.country_code)
+    )
     with engine.connect() as conn:
-        results = conn.execute(stmt).fetchall()
-    for country in results:
-        country_code = country[0]
-        enabled_dt = country[1]
-        basic_subscription, premium_subscription, royalty, premium_royalty = generate_values_ref_country()
-        with engine.connect() as conn:
-            query = text(f"""insert into {metadata.target_schema}.{metadata.target_table}
-        ({metadata.target_key}, {metadata.target_fields}, source) VALUES
-        ('{country_code}', '{enabled_dt}', 'Basic', {basic_subscription}, {royalty}, '{metadata.source_name}'),
-        ('{country_code}', '{enabled_dt}', 'Premium', {premium_subscription}, {premium_royalty}, '{metadata.source_name}')""")
-            conn.execute(query)
-            conn.commit()
-            
-def load_genres(metadata: Metadata):
+        rows = []
+        for country_code, enabled_dt in conn.execute(new_countries):
+            basic_subscription, premium_subscription, royalty, premium_royalty = generate_values_ref_country()
+            for subscription_type, subscription_cost, subscription_royalty in (
+                ("Basic", basic_subscription, royalty),
+                ("Premium", premium_subscription, premium_royalty),
+            ):
+                rows.append(
+                    {
+                        "country_code": country_code,
+                        "enabled_dt": enabled_dt,
+                        "subscription_type": subscription_type,
+                        "subscription_cost": subscription_cost,
+                        "royalty": subscription_royalty,
+                        "source": metadata.source_name,
+                    }
+                )
+        if not rows:
+            return 0
+        # a concurrent run may have added some of the countries in the meantime
+        result = conn.execute(insert(ref).values(rows).on_conflict_do_nothing())
+        conn.commit()
+        return result.rowcount
+
+def load_genres(metadata: Metadata) -> int:
     with engine.connect() as conn:
             query = text(f"""insert into {metadata.target_schema}.{metadata.target_table}
         ({metadata.target_fields})
         {metadata.custom_query}
         """)
-            conn.execute(query)
+            result = conn.execute(query)
             conn.commit()
+            return result.rowcount
 
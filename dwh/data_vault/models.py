@@ -7,13 +7,20 @@ from sqlalchemy import (
     DateTime,
     DECIMAL,
     Boolean,
+    LargeBinary,
+    Index,
+    inspect,
+    text,
 )
 from sqlalchemy.schema import CreateSchema
 from sqlalchemy.sql import func
 from datetime import datetime
+import logging
 
 from .. import engine
 
+log = logging.getLogger(__name__)
+
 meta = MetaData()
 
 schema_name = "dv"
@@ -28,7 +35,7 @@ meta = MetaData(schema=schema_name)
 hub_user = Table(
     "hub_user",
     meta,
-    Column("user_id", String(50), nullable=False),
+    Column("user_id", LargeBinary, primary_key=True),
     Column("original_id", String, nullable=False),
     Column("source", String, nullable=False),
     Column("insert_dtm", DateTime, nullable=False, server_default=func.now()),
@@ -37,8 +44,8 @@ hub_user = Table(
 sat_user = Table(
     "sat_user",
     meta,
-    Column("user_id", String(50), nullable=False),
-    Column("actual_dtm", DateTime, nullable=False),
+    Column("user_id", LargeBinary, primary_key=True),
+    Column("actual_dtm", DateTime, primary_key=True),
     Column("email", String, nullable=False),
     Column("first_name", String, nullable=False),
     Column("last_name", String, nullable=False),
@@ -46,36 +53,36 @@ sat_user = Table(
     Column("registration_dtm", DateTime, nullable=False),
     Column("country_code", String(2), nullable=False),
     Column("source", String, nullable=False),
-    Column("row_hash", String(50), nullable=False),
+    Column("row_hash", LargeBinary, nullable=False),
     Column("insert_dtm", DateTime, nullable=False, server_default=func.now()),
 )
 
 sat_user_subscription = Table(
     "sat_user_subscription",
     meta,
-    Column("user_id", String(50), nullable=False),
-    Column("actual_dtm", DateTime, nullable=False),
+    Column("user_id", LargeBinary, primary_key=True),
+    Column("actual_dtm", DateTime, primary_key=True),
     Column("is_premium", Boolean, nullable=False),
     Column("source", String, nullable=False),
-    Column("row_hash", String(50), nullable=False),
+    Column("row_hash", LargeBinary, nullable=False),
     Column("insert_dtm", DateTime, nullable=False, server_default=func.now()),
 )
 
 link_session_song_user_like = Table(
     "link_session_song_user_like",
     meta,
-    Column("session_song_user_like_id", String(50), nullable=False),
-    Column("session_id", String(50), nullable=False),
-    Column("song_id", String(50), nullable=False),
-    Column("user_id", String(50), nullable=False),
+    Column("session_song_user_like_id", LargeBinary, primary_key=True),
+    Column("session_id", LargeBinary, nullable=False),
+    Column("song_id", LargeBinary, nullable=False),
+    Column("user_id", LargeBinary, nullable=False),
     Column("insert_dtm", DateTime, nullable=False, server_default=func.now()),
 )
 
 lsat_session_song_user_like = Table(
     "lsat_session_song_user_like",
     meta,
-    Column("session_song_user_like_id", String(50), nullable=False),
-    Column("actual_dtm", DateTime, nullable=False),
+    Column("session_song_user_like_id", LargeBinary, primary_key=True),
+    Column("actual_dtm", DateTime, primary_key=True),
     Column("source", String, nullable=False),
     Column("insert_dtm", DateTime, nullable=False, server_default=func.now()),
 )
@@ -83,7 +90,7 @@ lsat_session_song_user_like = Table(
 hub_song = Table(
     "hub_song",
     meta,
-    Column("song_id", String(50), nullable=False),
+    Column("song_id", LargeBinary, primary_key=True),
     Column("original_id", String, nullable=False),
     Column("source", String, nullable=False),
     Column("insert_dtm", DateTime, nullable=False, server_default=func.now()),
@@ -92,31 +99,31 @@ hub_song = Table(
 sat_song = Table(
     "sat_song",
     meta,
-    Column("song_id", String(50), nullable=False),
-    Column("actual_dtm", DateTime, nullable=False),
+    Column("song_id", LargeBinary, primary_key=True),
+    Column("actual_dtm", DateTime, primary_key=True),
     Column("name", String, nullable=False),
     Column("original_genre_id", String, nullable=False),
     Column("duration_sec", Integer, nullable=False),
     Column("source", String, nullable=False),
-    Column("row_hash", String(50), nullable=False),
+    Column("row_hash", LargeBinary, nullable=False),
     Column("insert_dtm", DateTime, nullable=False, server_default=func.now()),
 )
 
 link_session_song_user_listen = Table(
     "link_session_song_user_listen",
     meta,
-    Column("session_song_user_listen_id", String(50), nullable=False),
-    Column("session_id", String(50), nullable=False),
-    Column("song_id", String(50), nullable=False),
-    Column("user_id", String(50), nullable=False),
+    Column("session_song_user_listen_id", LargeBinary, primary_key=True),
+    Column("session_id", LargeBinary, nullable=False),
+    Column("song_id", LargeBinary, nullable=False),
+    Column("user_id", LargeBinary, nullable=False),
     Column("insert_dtm", DateTime, nullable=False, server_default=func.now()),
 )
 
 lsat_session_song_user_listen = Table(
     "lsat_session_song_user_listen",
     meta,
-    Column("session_song_user_listen_id", String(50), nullable=False),
-    Column("actual_dtm", DateTime, nullable=False),
+    Column("session_song_user_listen_id", LargeBinary, primary_key=True),
+    Column("actual_dtm", DateTime, primary_key=True),
     Column("action_type", String, nullable=False),
     Column("at_time_sec", Integer, nullable=False),
     Column("source", String, nullable=False),
@@ -126,7 +133,7 @@ lsat_session_song_user_listen = Table(
 hub_collection = Table(
     "hub_collection",
     meta,
-    Column("collection_id", String(50), nullable=False),
+    Column("collection_id", LargeBinary, primary_key=True),
     Column("original_id", String, nullable=False),
     Column("source", String, nullable=False),
     Column("insert_dtm", DateTime, nullable=False, server_default=func.now()),
@@ -135,30 +142,30 @@ hub_collection = Table(
 sat_collection = Table(
     "sat_collection",
     meta,
-    Column("collection_id", String(50), nullable=False),
-    Column("actual_dtm", DateTime, nullable=False),
+    Column("collection_id", LargeBinary, primary_key=True),
+    Column("actual_dtm", DateTime, primary_key=True),
     Column("name", String, nullable=False),
     Column("original_genre_id", String, nullable=False),
     Column("release_dt", String, nullable=False),
     Column("collection_type", String, nullable=False),
     Column("source", String, nullable=False),
-    Column("row_hash", String(50), nullable=False),
+    Column("row_hash", LargeBinary, nullable=False),
     Column("insert_dtm", DateTime, nullable=False, server_default=func.now()),
 )
 
 link_collection_song = Table(
     "link_collection_song",
     meta,
-    Column("collection_song_id", String(50), nullable=False),
-    Column("collection_id", String(50), nullable=False),
-    Column("song_id", String(50), nullable=False),
+    Column("collection_song_id", LargeBinary, primary_key=True),
+    Column("collection_id", LargeBinary, nullable=False),
+    Column("song_id", LargeBinary, nullable=False),
     Column("insert_dtm", DateTime, nullable=False, server_default=func.now()),
 )
 
 hub_artist = Table(
     "hub_artist",
     meta,
-    Column("artist_id", String(50), nullable=False),
+    Column("artist_id", LargeBinary, primary_key=True),
     Column("original_id", String, nullable=False),
     Column("source", String, nullable=False),
     Column("insert_dtm", DateTime, nullable=False, server_default=func.now()),
@@ -167,29 +174,29 @@ hub_artist = Table(
 sat_artist = Table(
     "sat_artist",
     meta,
-    Column("artist_id", String(50), nullable=False),
-    Column("actual_dtm", DateTime, nullable=False),
+    Column("artist_id", LargeBinary, primary_key=True),
+    Column("actual_dtm", DateTime, primary_key=True),
     Column("name", String, nullable=False),
     Column("country_code", String(2), nullable=False),
     Column("founded_year", Integer, nullable=False),
     Column("source", String, nullable=False),
-    Column("row_hash", String(50), nullable=False),
+    Column("row_hash", LargeBinary, nullable=False),
     Column("insert_dtm", DateTime, nullable=False, server_default=func.now()),
 )
 
 link_artist_collection = Table(
     "link_artist_collection",
     meta,
-    Column("artist_collection_id", String(50), nullable=False),
-    Column("artist_id", String(50), nullable=False),
-    Column("collection_id", String(50), nullable=False),
+    Column("artist_collection_id", LargeBinary, primary_key=True),
+    Column("artist_id", LargeBinary, nullable=False),
+    Column("collection_id", LargeBinary, nullable=False),
     Column("insert_dtm", DateTime, nullable=False, server_default=func.now()),
 )
 
 hub_session = Table(
     "hub_session",
     meta,
-    Column("session_id", String(50), nullable=False),
+    Column("session_id", LargeBinary, primary_key=True),
     Column("original_id", String, nullable=False),
     Column("source", String, nullable=False),
     Column("insert_dtm", DateTime, nullable=False, server_default=func.now()),
@@ -198,36 +205,36 @@ hub_session = Table(
 sat_session = Table(
     "sat_session",
     meta,
-    Column("session_id", String(50), nullable=False),
-    Column("actual_dtm", DateTime, nullable=False),
+    Column("session_id", LargeBinary, primary_key=True),
+    Column("actual_dtm", DateTime, primary_key=True),
     Column("source", String, nullable=False),
-    Column("row_hash", String(50), nullable=False),
+    Column("row_hash", LargeBinary, nullable=False),
     Column("insert_dtm", DateTime, nullable=False, server_default=func.now()),
 )
 
 link_session_artist_user_follow = Table(
     "link_session_artist_user_follow",
     meta,
-    Column("session_artist_user_follow_id", String(50), nullable=False),
-    Column("session_id", String(50), nullable=False),
-    Column("artist_id", String(50), nullable=False),
-    Column("user_id", String(50), nullable=False),
+    Column("session_artist_user_follow_id", LargeBinary, primary_key=True),
+    Column("session_id", LargeBinary, nullable=False),
+    Column("artist_id", LargeBinary, nullable=False),
+    Column("user_id", LargeBinary, nullable=False),
     Column("insert_dtm", DateTime, nullable=False, server_default=func.now()),
 )
 
 
 lsat_session_artist_user_follow = Table('lsat_session_artist_user_follow',
                             meta,
-                            Column('session_artist_user_follow_id', String(50), nullable=False),
-                            Column('actual_dtm', DateTime, nullable=False),
+                            Column('session_artist_user_follow_id', LargeBinary, primary_key=True),
+                            Column('actual_dtm', DateTime, primary_key=True),
                             Column('source', String, nullable=False),
                             Column('insert_dtm', DateTime, nullable=False, server_default=func.now()))
    
 ref_country_subscription_cost = Table('ref_country_subscription_cost',
                                      meta,
-                                     Column('country_code', String(2), nullable=False),
+                                     Column('country_code', String(2), primary_key=True),
                                      Column('enabled_dt', DateTime, nullable=False),
-                                     Column('subscription_type', String, nullable=False),
+                                     Column('subscription_type', String, primary_key=True),
                                      Column('subscription_cost', DECIMAL(5, 2), nullable=False),
                                      Column('royalty', DECIMAL(5, 2), nullable=False),
                                      Column('source', String, nullable=False),
@@ -244,3 +251,94 @@ ref_genre = Table("ref_genre",
     Column("source", String, nullable=False),
     Column("insert_dtm", DateTime, nullable=False, server_default=func.now()),
 )
+
+# control table of the incremental loads: every process only reads the stage rows
+# written after its watermark
+load_watermark = Table(
+    "load_watermark",
+    meta,
+    Column("process_name", String, primary_key=True),
+    Column("source_table", String, nullable=False),
+    Column("watermark_dtm", DateTime, nullable=False),
+    Column("updated_dtm", DateTime, nullable=False, server_default=func.now()),
+)
+
+# the mart reads the listenings and likes of one day at a time
+Index(
+    "ix_lsat_session_song_user_listen_actual_dtm",
+    lsat_session_song_user_listen.c.actual_dtm,
+)
+Index(
+    "ix_lsat_session_song_user_like_actual_dtm",
+    lsat_session_song_user_like.c.actual_dtm,
+)
+
+# timings and row counts of every process of every Data Vault run
+load_log = Table(
+    "load_log",
+    meta,
+    Column("run_id", String, nullable=False, index=True),
+    Column("process_name", String, nullable=False),
+    Column("process_type", String, nullable=False),
+    Column("status", String, nullable=False),
+    Column("started_dtm", DateTime, nullable=True),
+    Column("duration_ms", DECIMAL(12, 1), nullable=True),
+    Column("row_count", Integer, nullable=True),
+    Column("error", String, nullable=True),
+    Column("insert_dtm", DateTime, nullable=False, server_default=func.now()),
+)
+
+
+def upgrade_existing_tables():
+    """
+    create_all doesn't change existing tables, so the tables created by an older
+    version get here what they lack: the hash keys and row hashes, once base64 text
+    of the same digests, become raw bytes, the primary keys are added after dropping
+    the duplicate rows the old loads let in, and missing indexes are created.
+    """
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        for table in meta.sorted_tables:
+            name = f"{schema_name}.{table.name}"
+            existing = {
+                column["name"]: column["type"]
+                for column in inspector.get_columns(table.name, schema=schema_name)
+            }
+            for column in table.columns:
+                if isinstance(column.type, LargeBinary) and not isinstance(
+                    existing[column.name], LargeBinary
+                ):
+                    log.info(f"Converting {name}.{column.name} to bytea.")
+                    conn.execute(
+                        text(
+                            f"ALTER TABLE {name} ALTER COLUMN {column.name} "
+                            f"TYPE bytea USING decode({column.name}, 'base64')"
+                        )
+                    )
+            key = [column.name for column in table.primary_key.columns]
+            pk = inspector.get_pk_constraint(table.name, schema=schema_name)
+            if key and not pk["constrained_columns"]:
+                log.info(f"Adding the primary key ({', '.join(key)}) to {name}.")
+                conn.execute(
+                    text(
+                        f"""
+                        DELETE FROM {name} a
+                        USING {name} b
+                        WHERE {" AND ".join(f"a.{c} = b.{c}" for c in key)}
+                          AND a.ctid > b.ctid
+                        """
+                    )
+                )
+                conn.execute(
+                    text(f"ALTER TABLE {name} ADD PRIMARY KEY ({', '.join(key)})")
+                )
+            indexes = {
+                index["name"]
+                for index in inspector.get_indexes(table.name, schema=schema_name)
+            }
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(conn)
+            # the (key, actual_dtm desc) indexes duplicated the satellite primary keys
+            if f"ix_{table.name}_latest" in indexes:
+                conn.execute(text(f"DROP INDEX {schema_name}.ix_{table.name}_latest"))
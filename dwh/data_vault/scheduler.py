@@ -0,0 +1,175 @@
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from datetime import datetime
+import logging
+import time
+from typing import Callable, Optional
+from uuid import uuid4
+
+import yaml
+from sqlalchemy import insert
+
+from .. import engine
+from .load_to_data_vault_operator import (
+    Metadata,
+    load_to_hub,
+    load_to_link,
+    load_to_lsat,
+    load_to_ref,
+    load_to_sat,
+)
+from .models import load_log
+
+log = logging.getLogger(__name__)
+
+METADATA_FILES = [
+    "dwh/data_vault/metadata/hub.yaml",
+    "dwh/data_vault/metadata/sat.yaml",
+    "dwh/data_vault/metadata/link.yaml",
+    "dwh/data_vault/metadata/lsat.yaml",
+    "dwh/data_vault/metadata/ref.yaml",
+]
+
+loaders: dict[str, Callable[[Metadata], int]] = {
+    "HUB": load_to_hub,
+    "SAT": load_to_sat,
+    "LINK": load_to_link,
+    "LSAT": load_to_lsat,
+    "REF": load_to_ref,
+}
+
+
+@dataclass
+class Process:
+    metadata: Metadata
+    depends_on: set[str] = field(default_factory=set)
+    status: str = "pending"
+    started_dtm: Optional[datetime] = None
+    duration_ms: Optional[float] = None
+    row_count: Optional[int] = None
+    error: Optional[str] = None
+
+    @property
+    def name(self) -> str:
+        return self.metadata.process_name
+
+
+def read_metadata(files: list[str] = METADATA_FILES) -> list[Metadata]:
+    processes = []
+    for path in files:
+        with open(path, "r") as file:
+            for process in yaml.safe_load(file):
+                processes.append(Metadata(process))
+    return processes
+
+
+def _target_keys(metadata: Metadata) -> set[str]:
+    fields = metadata.target_fields.split(",") if metadata.target_fields else []
+    return {metadata.target_key} | {f.strip() for f in fields}
+
+
+def build_dag(processes: list[Metadata]) -> dict[str, Process]:
+    """
+    Builds the dependencies between the processes from their metadata:
+
+    - a satellite is loaded after the hub with its key,
+    - a link is loaded after the hubs of all the keys it links,
+    - a link satellite is loaded after the link with its key,
+    - reference tables don't depend on anything.
+    """
+    dag = {metadata.process_name: Process(metadata) for metadata in processes}
+    hubs = {m.target_key: m.process_name for m in processes if m.process_type == "HUB"}
+    links = {
+        m.target_key: m.process_name for m in processes if m.process_type == "LINK"
+    }
+    for metadata in processes:
+        process = dag[metadata.process_name]
+        if metadata.process_type == "SAT" and metadata.target_key in hubs:
+            process.depends_on.add(hubs[metadata.target_key])
+        elif metadata.process_type == "LINK":
+            process.depends_on.update(
+                hubs[key] for key in _target_keys(metadata) if key in hubs
+            )
+        elif metadata.process_type == "LSAT" and metadata.target_key in links:
+            process.depends_on.add(links[metadata.target_key])
+    return dag
+
+
+def _run_process(process: Process) -> int:
+    loader = loaders[process.metadata.process_type]
+    return loader(process.metadata)
+
+
+def run_dag(dag: dict[str, Process], parallelism: int) -> None:
+    """
+    Runs the processes with at most `parallelism` of them at a time, each as soon
+    as all the processes it depends on have succeeded. Processes depending on a
+    failed one are skipped.
+    """
+    run_id = uuid4()
+    started = time.monotonic()
+    running: dict[Future, Process] = {}
+    with ThreadPoolExecutor(max_workers=parallelism) as executor:
+        while True:
+            for process in dag.values():
+                if process.status != "pending":
+                    continue
+                deps = [dag[name].status for name in process.depends_on]
+                if any(status in ("failed", "skipped") for status in deps):
+                    process.status = "skipped"
+                    log.warning(f"Skipping {process.name}: a dependency failed.")
+                elif all(status == "done" for status in deps):
+                    process.status = "running"
+                    process.started_dtm = datetime.utcnow()
+                    running[executor.submit(_timed, process)] = process
+            if not running:
+                break
+            completed, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in completed:
+                process = running.pop(future)
+                try:
+                    process.row_count = future.result()
+                    process.status = "done"
+                    log.info(
+                        f"Loaded {process.name}: {process.row_count} rows "
+                        f"in {process.duration_ms:.0f}ms."
+                    )
+                except Exception as e:
+                    process.status = "failed"
+                    process.error = repr(e)
+                    log.exception(f"Failed loading {process.name}.")
+    total_ms = (time.monotonic() - started) * 1000
+    _save_log(run_id, dag)
+    failed = [p.name for p in dag.values() if p.status != "done"]
+    log.info(
+        f"Data Vault run {run_id} finished in {total_ms:.0f}ms, "
+        f"{len(dag) - len(failed)} of {len(dag)} processes succeeded."
+    )
+    if failed:
+        raise RuntimeError(f"Data Vault processes not loaded: {', '.join(failed)}.")
+
+
+def _timed(process: Process) -> int:
+    started = time.monotonic()
+    try:
+        return _run_process(process)
+    finally:
+        process.duration_ms = (time.monotonic() - started) * 1000
+
+
+def _save_log(run_id, dag: dict[str, Process]) -> None:
+    rows = [
+        {
+            "run_id": str(run_id),
+            "process_name": process.name,
+            "process_type": process.metadata.process_type,
+            "status": process.status,
+            "started_dtm": process.started_dtm,
+            "duration_ms": process.duration_ms,
+            "row_count": process.row_count,
+            "error": process.error,
+        }
+        for process in dag.values()
+    ]
+    with engine.begin() as conn:
+        conn.execute(insert(load_log), rows)
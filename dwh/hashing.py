@@ -0,0 +1,21 @@
+from hashlib import sha256
+from typing import Iterable, Optional, Union
+
+
+def hash_key_name(fields: Union[str, Iterable[str]]) -> str:
+    """
+    Returns the name of the stage column holding the hash key of the given fields,
+    e.g. `hk_session_id_song_id_user_id` for `"session_id, song_id, user_id"`.
+    """
+    if isinstance(fields, str):
+        fields = fields.split(",")
+    return "hk_" + "_".join(field.strip() for field in fields)
+
+
+def hash_key(values: Iterable[Optional[object]], source: str) -> bytes:
+    """
+    Data Vault hash key: sha256 of the non-null values and the source name joined
+    by "#", i.e. `digest(concat_ws('#', values) || '#' || source, 'sha256')`.
+    """
+    key = "#".join(str(v) for v in values if v is not None) + "#" + source
+    return sha256(key.encode("utf-8")).digest()
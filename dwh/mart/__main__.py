@@ -0,0 +1,40 @@
+import argparse
+from datetime import date, timedelta
+import logging
+
+from ..config import Config
+from .load_to_mart_operator import load_to_mart
+from .mart_recommendations import load_recommendations
+from .models import meta, engine
+
+
+meta.create_all(engine)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Loads the mart facts of a day.")
+    parser.add_argument(
+        "--date",
+        type=date.fromisoformat,
+        default=date.fromisoformat(Config.EXECUTION_DATE_MART),
+        help="execution date, YYYY-MM-DD",
+    )
+    parser.add_argument(
+        "--days",
+        type=int,
+        default=1,
+        help="number of days to load, ending with the execution date",
+    )
+    parser.add_argument(
+        "--full-recommendations",
+        action="store_true",
+        help="recompute the recommendations of all songs and artists",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+    )
+    for offset in range(args.days - 1, -1, -1):
+        day = args.date - timedelta(days=offset)
+        load_to_mart(day)
+        load_recommendations(day, full=args.full_recommendations)
@@ -0,0 +1,182 @@
+from calendar import monthrange
+from datetime import date, timedelta
+import logging
+
+from sqlalchemy import delete
+from sqlalchemy.engine import Connection
+from sqlalchemy.sql import text
+
+from .. import engine
+from .models import fact_daily_listening, fact_daily_revenue
+
+log = logging.getLogger(__name__)
+
+# only the listenings of the day are read, every dimension is the latest version as
+# of the end of the day for the keys listened to that day
+DAILY_LISTENING_QUERY = """
+insert into mart.fact_daily_listening
+    (listen_dt, song_id, artist_id, listener_country, subscription_type,
+     song_name, artist_name, artist_country, genre_name,
+     starts, completes, listeners, royalty)
+with listening as (select l.song_id,
+                          l.user_id,
+                          s.action_type
+                   from dv.lsat_session_song_user_listen s
+                   join dv.link_session_song_user_listen l
+                     on l.session_song_user_listen_id = s.session_song_user_listen_id
+                   where s.actual_dtm >= :day and s.actual_dtm < :next_day
+                     and s.action_type in ('Start', 'Complete')),
+
+users as (select distinct on (user_id) user_id, country_code
+          from dv.sat_user
+          where user_id in (select user_id from listening)
+            and actual_dtm < :next_day
+          order by user_id, actual_dtm desc),
+
+subscriptions as (select distinct on (user_id) user_id, is_premium
+                  from dv.sat_user_subscription
+                  where user_id in (select user_id from listening)
+                    and actual_dtm < :next_day
+                  order by user_id, actual_dtm desc),
+
+songs as (select distinct on (song_id) song_id, name, original_genre_id
+          from dv.sat_song
+          where song_id in (select song_id from listening)
+            and actual_dtm < :next_day
+          order by song_id, actual_dtm desc),
+
+song_artists as (select distinct lcs.song_id, lac.artist_id
+                 from dv.link_collection_song lcs
+                 join dv.link_artist_collection lac
+                   on lac.collection_id = lcs.collection_id
+                 where lcs.song_id in (select song_id from listening)),
+
+artists as (select distinct on (artist_id) artist_id, name, country_code
+            from dv.sat_artist
+            where artist_id in (select artist_id from song_artists)
+              and actual_dtm < :next_day
+            order by artist_id, actual_dtm desc),
+
+genres as (select distinct on (original_genre_id) original_genre_id, genre_name
+           from dv.ref_genre
+           order by original_genre_id, creation_dtm desc),
+
+listening_users as (select li.song_id,
+                           li.user_id,
+                           li.action_type,
+                           u.country_code,
+                           case when sub.is_premium then 'Premium' else 'Basic'
+                           end as subscription_type
+                    from listening li
+                    join users u on u.user_id = li.user_id
+                    left join subscriptions sub on sub.user_id = li.user_id)
+
+select :day,
+       lu.song_id,
+       sa.artist_id,
+       lu.country_code,
+       lu.subscription_type,
+       s.name,
+       a.name,
+       a.country_code,
+       g.genre_name,
+       count(*) filter (where lu.action_type = 'Start'),
+       count(*) filter (where lu.action_type = 'Complete'),
+       count(distinct lu.user_id),
+       coalesce(sum(r.royalty) filter (where lu.action_type = 'Complete'), 0)
+from listening_users lu
+join songs s on s.song_id = lu.song_id
+join song_artists sa on sa.song_id = lu.song_id
+join artists a on a.artist_id = sa.artist_id
+left join genres g on g.original_genre_id = s.original_genre_id
+left join dv.ref_country_subscription_cost r
+       on r.country_code = lu.country_code
+      and r.subscription_type = lu.subscription_type
+group by lu.song_id, sa.artist_id, lu.country_code, lu.subscription_type,
+         s.name, a.name, a.country_code, g.genre_name
+"""
+
+# the royalties are summed up from the listening facts of the same day, so they
+# have to be loaded first
+DAILY_REVENUE_QUERY = """
+insert into mart.fact_daily_revenue
+    (revenue_dt, country_code, subscription_type,
+     subscribers, subscription_revenue, completes, royalty)
+with users as (select distinct on (user_id) user_id, country_code
+               from dv.sat_user
+               where actual_dtm < :next_day
+               order by user_id, actual_dtm desc),
+
+subscriptions as (select distinct on (user_id) user_id, is_premium
+                  from dv.sat_user_subscription
+                  where actual_dtm < :next_day
+                  order by user_id, actual_dtm desc),
+
+subscribers as (select u.country_code,
+                       case when sub.is_premium then 'Premium' else 'Basic'
+                       end as subscription_type,
+                       count(*) as subscribers
+                from users u
+                left join subscriptions sub on sub.user_id = u.user_id
+                group by 1, 2),
+
+royalties as (select listener_country as country_code,
+                     subscription_type,
+                     sum(completes) as completes,
+                     sum(royalty) as royalty
+              from mart.fact_daily_listening
+              where listen_dt = :day
+              group by 1, 2)
+
+select :day,
+       r.country_code,
+       r.subscription_type,
+       coalesce(sb.subscribers, 0),
+       coalesce(sb.subscribers, 0) * r.subscription_cost / :days_in_month,
+       coalesce(ro.completes, 0),
+       coalesce(ro.royalty, 0)
+from dv.ref_country_subscription_cost r
+left join subscribers sb
+       on sb.country_code = r.country_code
+      and sb.subscription_type = r.subscription_type
+left join royalties ro
+       on ro.country_code = r.country_code
+      and ro.subscription_type = r.subscription_type
+where r.enabled_dt < :next_day
+"""
+
+
+def load_daily_listening(conn: Connection, day: date) -> int:
+    conn.execute(
+        delete(fact_daily_listening).where(fact_daily_listening.c.listen_dt == day)
+    )
+    params = {"day": day, "next_day": day + timedelta(days=1)}
+    return conn.execute(text(DAILY_LISTENING_QUERY), params).rowcount
+
+
+def load_daily_revenue(conn: Connection, day: date) -> int:
+    conn.execute(
+        delete(fact_daily_revenue).where(fact_daily_revenue.c.revenue_dt == day)
+    )
+    params = {
+        "day": day,
+        "next_day": day + timedelta(days=1),
+        # monthly subscription costs are spread evenly over the days of the month
+        "days_in_month": monthrange(day.year, day.month)[1],
+    }
+    return conn.execute(text(DAILY_REVENUE_QUERY), params).rowcount
+
+
+def load_to_mart(day: date) -> None:
+    """
+    Rebuilds the facts of one day in one transaction: the rows of the day are
+    replaced and the rest of the history is left as it is, so loading a day again
+    or backfilling past days only costs the days loaded.
+    """
+    with engine.begin() as conn:
+        listening_rows = load_daily_listening(conn, day)
+        revenue_rows = load_daily_revenue(conn, day)
+    log.info(
+        f"Loaded the mart for {day}: {listening_rows} listening rows, "
+        f"{revenue_rows} revenue rows."
+    )
@@ -1,2 +1,276 @@
-from sqlalchemy.sql import text
-from sqlalchemy import select
\ No newline at end of file
+from datetime import date, timedelta
+import logging
+from typing import Iterator
+
+import numpy as np
+from scipy import sparse
+from sqlalchemy import Table, delete, insert, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.engine import Connection
+
+from .. import engine
+from ..config import Config
+from ..data_vault.models import (
+    hub_artist,
+    hub_song,
+    link_artist_collection,
+    link_collection_song,
+)
+from .models import (
+    artist_recommendation,
+    recommendation_load,
+    song_recommendation,
+    user_song_interaction,
+)
+
+log = logging.getLogger(__name__)
+
+# completed listenings and likes of a day by user and song
+DAILY_INTERACTIONS_QUERY = """
+with listens as (select l.user_id, l.song_id, count(*) as weight
+                 from dv.lsat_session_song_user_listen s
+                 join dv.link_session_song_user_listen l
+                   on l.session_song_user_listen_id = s.session_song_user_listen_id
+                 where s.actual_dtm >= :day and s.actual_dtm < :next_day
+                   and s.action_type = 'Complete'
+                 group by l.user_id, l.song_id),
+
+likes as (select l.user_id, l.song_id, count(*) * :like_weight as weight
+          from dv.lsat_session_song_user_like s
+          join dv.link_session_song_user_like l
+            on l.session_song_user_like_id = s.session_song_user_like_id
+          where s.actual_dtm >= :day and s.actual_dtm < :next_day
+          group by l.user_id, l.song_id)
+
+select user_id, song_id, sum(weight) as weight
+from (select * from listens union all select * from likes) interactions
+group by user_id, song_id
+"""
+
+
+def add_daily_interactions(conn: Connection, day: date) -> set[bytes]:
+    """
+    Adds the interactions of the day to the totals by user and song, returns the
+    songs interacted with.
+    """
+    params = {
+        "day": day,
+        "next_day": day + timedelta(days=1),
+        "like_weight": Config.RECOMMENDATION_LIKE_WEIGHT,
+    }
+    rows = [
+        {"user_id": user_id, "song_id": song_id, "weight": weight, "last_dt": day}
+        for user_id, song_id, weight in conn.execute(
+            text(DAILY_INTERACTIONS_QUERY), params
+        )
+    ]
+    if rows:
+        upsert = pg_insert(user_song_interaction)
+        conn.execute(
+            upsert.on_conflict_do_update(
+                index_elements=["user_id", "song_id"],
+                set_={
+                    "weight": user_song_interaction.c.weight + upsert.excluded.weight,
+                    "last_dt": upsert.excluded.last_dt,
+                },
+            ),
+            rows,
+        )
+    # untyped text queries return bytea as memoryview
+    return {bytes(row["song_id"]) for row in rows}
+
+
+def interaction_matrix(conn: Connection) -> tuple[sparse.csr_matrix, list[bytes]]:
+    """
+    Returns the users x songs matrix of the interactions, dampened with log1p so
+    that a few heavy listeners don't dominate the similarities, and the song keys of
+    its columns.
+    """
+    users: dict[bytes, int] = {}
+    songs: dict[bytes, int] = {}
+    rows, cols, weights = [], [], []
+    q = select(
+        user_song_interaction.c.user_id,
+        user_song_interaction.c.song_id,
+        user_song_interaction.c.weight,
+    )
+    for user_id, song_id, weight in conn.execute(q):
+        rows.append(users.setdefault(user_id, len(users)))
+        cols.append(songs.setdefault(song_id, len(songs)))
+        weights.append(weight)
+    matrix = sparse.csr_matrix(
+        (np.log1p(np.array(weights, dtype=np.float64)), (rows, cols)),
+        shape=(len(users), len(songs)),
+    )
+    return matrix, list(songs)
+
+
+def song_artist_matrix(
+    conn: Connection, song_keys: list[bytes]
+) -> tuple[sparse.csr_matrix, list[bytes]]:
+    """
+    Returns the songs x artists matrix of who performs every song, and the artist
+    keys of its columns.
+    """
+    song_index = {key: i for i, key in enumerate(song_keys)}
+    artists: dict[bytes, int] = {}
+    rows, cols = [], []
+    q = (
+        select(link_collection_song.c.song_id, link_artist_collection.c.artist_id)
+        .join(
+            link_artist_collection,
+            link_artist_collection.c.collection_id
+            == link_collection_song.c.collection_id,
+        )
+        .distinct()
+    )
+    for song_id, artist_id in conn.execute(q):
+        if song_id in song_index:
+            rows.append(song_index[song_id])
+            cols.append(artists.setdefault(artist_id, len(artists)))
+    matrix = sparse.csr_matrix(
+        (np.ones(len(rows)), (rows, cols)), shape=(len(song_keys), len(artists))
+    )
+    return matrix, list(artists)
+
+
+def affected_items(matrix: sparse.csc_matrix, touched: np.ndarray) -> np.ndarray:
+    """
+    Items whose similarities change when the given items get new interactions: the
+    items themselves and every item sharing a user with them.
+    """
+    users = np.unique(matrix[:, touched].indices)
+    co_items = matrix[users].nonzero()[1]
+    return np.union1d(touched, co_items)
+
+
+def top_k_similar(
+    matrix: sparse.csc_matrix, items: np.ndarray, k: int, chunk_size: int
+) -> Iterator[tuple[int, np.ndarray, np.ndarray]]:
+    """
+    Yields the `k` items with the highest cosine similarity to every given item, as
+    (item, neighbors, scores) sorted by score. The co-occurrences are computed
+    `chunk_size` items at a time as a sparse product, so only the pairs of items
+    sharing at least one user are ever materialized.
+    """
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0)).ravel())
+    transposed = matrix.T.tocsr()
+    for start in range(0, len(items), chunk_size):
+        chunk = items[start : start + chunk_size]
+        co_occurrence = (transposed @ matrix[:, chunk]).tocsc()
+        for j, item in enumerate(chunk):
+            begin, end = co_occurrence.indptr[j], co_occurrence.indptr[j + 1]
+            neighbors = co_occurrence.indices[begin:end]
+            scores = co_occurrence.data[begin:end] / (norms[neighbors] * norms[item])
+            others = neighbors != item
+            neighbors, scores = neighbors[others], scores[others]
+            if len(neighbors) > k:
+                best = np.argpartition(-scores, k)[:k]
+                neighbors, scores = neighbors[best], scores[best]
+            order = np.argsort(-scores, kind="stable")
+            yield item, neighbors[order], scores[order]
+
+
+def original_ids(conn: Connection, hub: Table, key_column: str) -> dict[bytes, str]:
+    key = hub.c[key_column]
+    return dict(conn.execute(select(key, hub.c.original_id)).all())
+
+
+def save_recommendations(
+    conn: Connection,
+    table: Table,
+    matrix: sparse.csc_matrix,
+    items: np.ndarray,
+    keys: list[bytes],
+    ids: dict[bytes, str],
+) -> int:
+    """
+    Replaces the recommendations of the given items, returns the number of items.
+    """
+    key_column = table.primary_key.columns.values()[0].name
+    similar_column = f"similar_{key_column}s"
+    rows = []
+    for item, neighbors, scores in top_k_similar(
+        matrix, items, Config.RECOMMENDATION_TOP_K, Config.RECOMMENDATION_CHUNK_SIZE
+    ):
+        if keys[item] not in ids:
+            continue
+        similar = [
+            (ids[keys[n]], float(score))
+            for n, score in zip(neighbors, scores)
+            if keys[n] in ids
+        ]
+        rows.append(
+            {
+                key_column: ids[keys[item]],
+                similar_column: [similar_id for similar_id, _ in similar],
+                "scores": [score for _, score in similar],
+            }
+        )
+    if rows:
+        conn.execute(
+            delete(table).where(
+                table.c[key_column].in_([row[key_column] for row in rows])
+            )
+        )
+        conn.execute(insert(table), rows)
+    return len(rows)
+
+
+def _is_loaded(conn: Connection, day: date) -> bool:
+    q = select(recommendation_load.c.load_dt).where(
+        recommendation_load.c.load_dt == day
+    )
+    return conn.execute(q).first() is not None
+
+
+def load_recommendations(day: date, full: bool = False) -> None:
+    """
+    Adds the interactions of the day and recomputes the recommendations of the
+    songs and artists whose similarities they change, or of all of them if `full`.
+
+    The interactions of a day are added once: loading a day that is already loaded
+    only recomputes the recommendations, with `full`, or does nothing.
+    """
+    with engine.begin() as conn:
+        touched: set[bytes] = set()
+        if not _is_loaded(conn, day):
+            touched = add_daily_interactions(conn, day)
+            conn.execute(insert(recommendation_load).values(load_dt=day))
+        elif not full:
+            log.info(f"Recommendations already loaded for {day}, skipping.")
+            return
+        songs, song_keys = interaction_matrix(conn)
+        performers, artist_keys = song_artist_matrix(conn, song_keys)
+        songs = songs.tocsc()
+        artists = (songs @ performers).tocsc()
+        if full:
+            song_items = np.arange(len(song_keys))
+            artist_items = np.arange(len(artist_keys))
+        else:
+            touched_songs = np.array(
+                [i for i, key in enumerate(song_keys) if key in touched], dtype=int
+            )
+            song_items = affected_items(songs, touched_songs)
+            touched_artists = np.unique(performers[touched_songs].indices)
+            artist_items = affected_items(artists, touched_artists)
+        song_rows = save_recommendations(
+            conn,
+            song_recommendation,
+            songs,
+            song_items,
+            song_keys,
+            original_ids(conn, hub_song, "song_id"),
+        )
+        artist_rows = save_recommendations(
+            conn,
+            artist_recommendation,
+            artists,
+            artist_items,
+            artist_keys,
+            original_ids(conn, hub_artist, "artist_id"),
+        )
+    log.info(
+        f"Loaded the recommendations for {day}: {len(touched)} songs with new "
+        f"interactions, {song_rows} songs and {artist_rows} artists updated."
+    )
@@ -0,0 +1,102 @@
+from sqlalchemy import (
+    MetaData,
+    Table,
+    Column,
+    Integer,
+    String,
+    Date,
+    DateTime,
+    DECIMAL,
+    Float,
+    LargeBinary,
+    REAL,
+)
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.schema import CreateSchema
+from sqlalchemy.sql import func
+
+from .. import engine
+
+schema_name = "mart"
+
+conn = engine.connect()
+if not conn.dialect.has_schema(conn, schema_name):
+    conn.execute(CreateSchema(schema_name))
+    conn.commit()
+
+meta = MetaData(schema=schema_name)
+
+# listenings of a day by song, artist and listener country and subscription, with
+# the song and artist attributes as of that day; rebuilt one day at a time
+fact_daily_listening = Table(
+    "fact_daily_listening",
+    meta,
+    Column("listen_dt", Date, primary_key=True),
+    Column("song_id", LargeBinary, primary_key=True),
+    Column("artist_id", LargeBinary, primary_key=True),
+    Column("listener_country", String(2), primary_key=True),
+    Column("subscription_type", String, primary_key=True),
+    Column("song_name", String, nullable=False),
+    Column("artist_name", String, nullable=False),
+    Column("artist_country", String(2), nullable=False),
+    Column("genre_name", String, nullable=True),
+    Column("starts", Integer, nullable=False),
+    Column("completes", Integer, nullable=False),
+    Column("listeners", Integer, nullable=False),
+    Column("royalty", DECIMAL(14, 2), nullable=False),
+    Column("insert_dtm", DateTime, nullable=False, server_default=func.now()),
+)
+
+# subscription revenue and royalties of a day by country and subscription type
+fact_daily_revenue = Table(
+    "fact_daily_revenue",
+    meta,
+    Column("revenue_dt", Date, primary_key=True),
+    Column("country_code", String(2), primary_key=True),
+    Column("subscription_type", String, primary_key=True),
+    Column("subscribers", Integer, nullable=False),
+    Column("subscription_revenue", DECIMAL(14, 2), nullable=False),
+    Column("completes", Integer, nullable=False),
+    Column("royalty", DECIMAL(14, 2), nullable=False),
+    Column("insert_dtm", DateTime, nullable=False, server_default=func.now()),
+)
+
+# how much every user listened to and liked every song, updated with the
+# interactions of every day loaded to the recommendations
+user_song_interaction = Table(
+    "user_song_interaction",
+    meta,
+    Column("user_id", LargeBinary, primary_key=True),
+    Column("song_id", LargeBinary, primary_key=True),
+    Column("weight", Float, nullable=False),
+    Column("last_dt", Date, nullable=False),
+)
+
+# days whose interactions are added to user_song_interaction, so that each day is
+# added once whatever order the days are loaded in
+recommendation_load = Table(
+    "recommendation_load",
+    meta,
+    Column("load_dt", Date, primary_key=True),
+    Column("insert_dtm", DateTime, nullable=False, server_default=func.now()),
+)
+
+# most similar songs of every song by original id, best first, as served to users
+song_recommendation = Table(
+    "song_recommendation",
+    meta,
+    Column("song_id", String, primary_key=True),
+    Column("similar_song_ids", ARRAY(String), nullable=False),
+    Column("scores", ARRAY(REAL), nullable=False),
+    Column("updated_dtm", DateTime, nullable=False, server_default=func.now()),
+)
+
+# most similar artists of every artist by original id, best first
+artist_recommendation = Table(
+    "artist_recommendation",
+    meta,
+    Column("artist_id", String, primary_key=True),
+    Column("similar_artist_ids", ARRAY(String), nullable=False),
+    Column("scores", ARRAY(REAL), nullable=False),
+    Column("updated_dtm", DateTime, nullable=False, server_default=func.now()),
+)
@@ -1,4 +1,24 @@
-from .load_to_stage_operator import load_to_stage
+import argparse
+import logging
+
+from ..config import Config
+from .load_to_stage_operator import run_stage_workers
+from .models import add_missing_columns
+
+
+add_missing_columns()
 
 if __name__ == "__main__":
-    load_to_stage()
+    parser = argparse.ArgumentParser(description="Loads the DWH events to stage.")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=Config.STAGE_WORKERS,
+        help="number of consumer processes",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s %(processName)s %(name)s: %(message)s",
+    )
+    run_stage_workers(args.workers)
@@ -1,9 +1,22 @@
-import json
-from kafka import KafkaConsumer
-from sqlalchemy.orm import Session
+import logging
+import multiprocessing
+import signal
+import threading
+import time
+from typing import Callable
+from uuid import UUID, uuid5
 
+from eventcodec import CodecError, decode_event
+from kafka import ConsumerRebalanceListener, KafkaConsumer, TopicPartition
+from kafka.consumer.fetcher import ConsumerRecord
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+
+from ..config import Config
+from ..hashing import hash_key
 from . import models
 
+log = logging.getLogger(__name__)
 
 # event_name: (table_name, instance)
 event_to_table = {
@@ -18,60 +31,275 @@ event_to_table = {
     "SongCreated": models.KafkaSongCreated,
     "GenreCreated": models.KafkaGenreCreated,
     "CountryEnabled": models.KafkaCountryEnabled,
-    "UserSubscriptionEvent": models.KafkaSubscriptionEvent
+    "UserSubscriptionEvent": models.KafkaSubscriptionEvent,
+}
+
+# namespace of the stage event ids, never change it or reloaded events get new ids
+EVENT_ID_NAMESPACE = UUID("6f1c3c9e-2a64-4c1f-9a3e-5d0a4e1b7c21")
+
+# set by the backend's outbox relay to the id of the outbox row of the event
+OUTBOX_ID_HEADER = "outbox_id"
+
+# column names of every stage table, filled by the payload fields of the same name
+table_columns = {
+    table_model: [
+        column.name
+        for column in table_model.__table__.columns
+        if column.server_default is None
+    ]
+    for table_model in set(event_to_table.values())
+}
+
+# hash key columns of every stage table with the payload fields they are built from
+table_hash_keys = {
+    table_model: [
+        (column.name, column.info["hash_key_fields"])
+        for column in table_model.__table__.columns
+        if "hash_key_fields" in column.info
+    ]
+    for table_model in set(event_to_table.values())
 }
 
 
-def parser(event_type: str, payload_data: dict):
+def event_id(record: ConsumerRecord) -> UUID:
+    """
+    Deterministic id of the event stored in the given Kafka record: by its outbox
+    row if it came through the outbox, so that an event relayed twice gets one id,
+    else by its position in the topic.
+    """
+    for key, value in record.headers or []:
+        if key == OUTBOX_ID_HEADER:
+            return uuid5(EVENT_ID_NAMESPACE, f"outbox:{value.decode('ascii')}")
+    return uuid5(
+        EVENT_ID_NAMESPACE, f"{record.topic}:{record.partition}:{record.offset}"
+    )
+
+
+def parser(event_type: str, payload_data: dict, record: ConsumerRecord) -> dict:
+    """
+    Maps the event payload to a row of its stage table, with all the columns set so
+    that rows of one table can be inserted together.
+    """
     table_model = event_to_table[event_type]
-    object = table_model()
-    for key, value in payload_data.items():
-        if hasattr(table_model, key):
-            setattr(object, key, value)
-    print(object)
-    return object
-
-
-def load_to_table(event: dict) -> None:
-    data = event["data"]
-    data["event_type"] = event["type"]
-    print(data)
-    row_instance = parser(event["type"], data)
-    with Session(models.engine) as session:
-        session.add(row_instance)
-        session.commit()
-
-
-def load_to_stage():
-    topic = "dwh_events"
+    row = {column: payload_data.get(column) for column in table_columns[table_model]}
+    row["event_id"] = event_id(record)
+    row["kafka_partition"] = record.partition
+    row["kafka_offset"] = record.offset
+    row["event_type"] = event_type
+    return row
+
+
+def add_hash_keys(table_model: type, rows: list[dict]) -> None:
+    """
+    Computes the Data Vault hash keys of the stage rows of one table, so that the
+    Data Vault loads read them instead of hashing every row in SQL on every run.
+    """
+    for name, fields in table_hash_keys[table_model]:
+        for row in rows:
+            row[name] = hash_key(
+                [row[field] for field in fields], models.HASH_KEY_SOURCE
+            )
+
+
+def load_batch(records: dict[TopicPartition, list[ConsumerRecord]]) -> int:
+    """
+    Writes the records of one poll to their stage tables in one transaction, with a
+    multi-row insert per table, and moves the offset checkpoints of their partitions
+    in the same transaction. Returns the number of events in the batch.
+
+    Records that are already in stage are skipped, so a batch can be loaded again
+    after a crash between the DB commit and the Kafka offset commit. Records that
+    can't be decoded go to the dead letter table, and the checkpoint moves past them
+    like past any other record.
+    """
+    rows_by_table: dict[type, list[dict]] = {}
+    dead_letters = []
+    events_count = 0
+    for consumer_records in records.values():
+        for record in consumer_records:
+            try:
+                event = decode_event(record.value)
+            except CodecError as e:
+                log.error(
+                    f"Skipping undecodable record {record.topic}/{record.partition}"
+                    f" at offset {record.offset}: {e}"
+                )
+                dead_letters.append(
+                    {
+                        "topic": record.topic,
+                        "partition": record.partition,
+                        "offset": record.offset,
+                        "payload": record.value,
+                        "error": str(e),
+                    }
+                )
+                continue
+            events_count += 1
+            if event["type"] not in event_to_table:
+                continue
+            row = parser(event["type"], event["data"], record)
+            rows_by_table.setdefault(event_to_table[event["type"]], []).append(row)
+    checkpoints = [
+        {
+            "consumer_group": Config.KAFKA_STAGE_GROUP_ID,
+            "topic": tp.topic,
+            "partition": tp.partition,
+            "next_offset": consumer_records[-1].offset + 1,
+        }
+        for tp, consumer_records in records.items()
+        if consumer_records
+    ]
+    for table_model, rows in rows_by_table.items():
+        add_hash_keys(table_model, rows)
+    with models.engine.begin() as conn:
+        for table_model, rows in rows_by_table.items():
+            conn.execute(insert(table_model).on_conflict_do_nothing(), rows)
+        if dead_letters:
+            conn.execute(
+                insert(models.KafkaDeadLetter).on_conflict_do_nothing(), dead_letters
+            )
+        if checkpoints:
+            upsert = insert(models.KafkaOffsetCheckpoint)
+            conn.execute(
+                upsert.on_conflict_do_update(
+                    index_elements=["consumer_group", "topic", "partition"],
+                    set_={
+                        "next_offset": upsert.excluded.next_offset,
+                        "updated_dtm": upsert.excluded.updated_dtm,
+                    },
+                    # never move a checkpoint back
+                    where=models.KafkaOffsetCheckpoint.next_offset
+                    < upsert.excluded.next_offset,
+                ),
+                checkpoints,
+            )
+    return events_count
+
+
+class CheckpointRebalanceListener(ConsumerRebalanceListener):
+    """
+    Seeks newly assigned partitions to their checkpoint, so that the consumer
+    resumes after the last batch written to the DB.
+    """
+
+    def __init__(self, consumer: KafkaConsumer) -> None:
+        self.consumer = consumer
+
+    def on_partitions_revoked(self, revoked) -> None:
+        # every batch is written and checkpointed before the next poll
+        pass
+
+    def on_partitions_assigned(self, assigned) -> None:
+        if not assigned:
+            return
+        checkpoint = models.KafkaOffsetCheckpoint
+        q = select(
+            checkpoint.topic, checkpoint.partition, checkpoint.next_offset
+        ).where(checkpoint.consumer_group == Config.KAFKA_STAGE_GROUP_ID)
+        with models.engine.connect() as conn:
+            offsets = {
+                TopicPartition(topic, partition): next_offset
+                for topic, partition, next_offset in conn.execute(q)
+            }
+        for tp in assigned:
+            if tp in offsets:
+                log.info(f"Resuming {tp.topic}/{tp.partition} at {offsets[tp]}.")
+                self.consumer.seek(tp, offsets[tp])
+            else:
+                log.info(f"No checkpoint for {tp.topic}/{tp.partition}.")
+
+
+def load_to_stage(should_stop: Callable[[], bool] = lambda: False) -> None:
+    """
+    Consumes the DWH topic as a member of the stage consumer group until
+    `should_stop` returns `True`. Kafka assigns the partitions among all members of
+    the group, and reassigns them whenever a member joins or leaves.
+    """
+    topic = Config.KAFKA_DWH_TOPIC
     consumer = KafkaConsumer(
-        topic,
-        group_id=None,
-        bootstrap_servers=["localhost:9092"],
+        group_id=Config.KAFKA_STAGE_GROUP_ID,
+        bootstrap_servers=Config.KAFKA_BOOTSTRAP_SERVERS,
         auto_offset_reset="earliest",
-        enable_auto_commit=True,
-        auto_commit_interval_ms=1000,
+        # offsets are committed once the batch is in the DB
+        enable_auto_commit=False,
+        max_poll_records=Config.STAGE_BATCH_MAX_RECORDS,
     )
+    consumer.subscribe([topic], listener=CheckpointRebalanceListener(consumer))
+    log.info(f"Loading {topic} to stage as group {Config.KAFKA_STAGE_GROUP_ID}.")
+    try:
+        _consume(consumer, should_stop)
+    finally:
+        # leave the group right away so that the partitions are reassigned
+        consumer.close()
 
-    consumer.partitions_for_topic(topic)
-    consumer.seek_to_beginning()
-    existing_tables = [
-        "SignInSuccessEvent",
-        "SongPlayEvent",
-        "SongStopEvent",
-        "SongLikedEvent",
-        "ArtistFollowedEvent",
-    ]
 
-    while True:
-        records = consumer.poll(timeout_ms=1000) 
-        for _, consumer_records in records.items():
-            for consumer_record in consumer_records:
-                event = json.loads(consumer_record.value.decode("utf-8"))
-                if event["type"] in event_to_table.keys():
-                    load_to_table(event)
-            continue
-        
-        
-        
+def _consume(consumer: KafkaConsumer, should_stop: Callable[[], bool]) -> None:
+    events_count, batches, max_batch_ms = 0, 0, 0.0
+    last_report = time.monotonic()
+    while not should_stop():
+        records = consumer.poll(timeout_ms=1000)
+        if records:
+            started = time.monotonic()
+            loaded = load_batch(records)
+            # the DB checkpoint is what the loader resumes from, the group offsets
+            # are kept in sync for monitoring of the consumer lag
+            consumer.commit()
+            batch_ms = (time.monotonic() - started) * 1000
+            log.debug(f"Loaded {loaded} events in {batch_ms:.1f}ms.")
+            events_count += loaded
+            batches += 1
+            max_batch_ms = max(max_batch_ms, batch_ms)
+        elapsed = time.monotonic() - last_report
+        if elapsed >= Config.STAGE_REPORT_INTERVAL_SEC:
+            if batches:
+                log.info(
+                    f"Loaded {events_count} events in {batches} batches: "
+                    f"{events_count / elapsed:.0f} events/sec, "
+                    f"max batch latency {max_batch_ms:.1f}ms."
+                )
+            events_count, batches, max_batch_ms = 0, 0, 0.0
+            last_report = time.monotonic()
+
+
+def _stage_worker() -> None:
+    # the forked child must not reuse the DB connections of the parent
+    models.engine.dispose(close=False)
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    signal.signal(signal.SIGINT, lambda *_: stopping.set())
+    load_to_stage(should_stop=stopping.is_set)
+
+
+def _start_worker(worker_id: int) -> multiprocessing.Process:
+    process = multiprocessing.Process(
+        target=_stage_worker, name=f"stage-worker-{worker_id}"
+    )
+    process.start()
+    log.info(f"Started {process.name} (pid {process.pid}).")
+    return process
+
 
+def run_stage_workers(workers: int) -> None:
+    """
+    Runs `workers` stage consumer processes in the same consumer group, so that each
+    of them loads its own subset of the partitions, and restarts the ones that die.
+    """
+    if workers <= 1:
+        load_to_stage()
+        return
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    signal.signal(signal.SIGINT, lambda *_: stopping.set())
+    processes = [_start_worker(i) for i in range(workers)]
+    while not stopping.wait(Config.STAGE_SUPERVISE_INTERVAL_SEC):
+        for i, process in enumerate(processes):
+            if not process.is_alive():
+                log.warning(
+                    f"{process.name} exited with code {process.exitcode}, restarting."
+                )
+                processes[i] = _start_worker(i)
+    log.info(f"Stopping {workers} stage workers.")
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.join(Config.STAGE_SHUTDOWN_TIMEOUT_SEC)
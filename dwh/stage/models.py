@@ -1,12 +1,28 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Date, DECIMAL
+import logging
+
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    Integer,
+    String,
+    Boolean,
+    DateTime,
+    Date,
+    DECIMAL,
+    LargeBinary,
+    inspect,
+    text,
+)
 from sqlalchemy.schema import CreateSchema
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.dialects.postgresql import UUID
-
-from uuid import uuid4
+from sqlalchemy.sql import func
 
 
 from .. import engine
+from ..hashing import hash_key_name
+
+log = logging.getLogger(__name__)
 
 schema_name = "stage"
 Base = declarative_base()
@@ -17,11 +33,36 @@ if not conn.dialect.has_schema(conn, schema_name):
     conn.commit()
 
 
+class KafkaRecord:
+    """
+    Position of the event in the DWH topic. The `event_id` of every stage row is
+    derived from it, or from the outbox row id for events relayed from the backend's
+    outbox, so loading the same event twice yields the same row.
+    """
+
+    kafka_partition = Column(Integer, nullable=False)
+    kafka_offset = Column(BigInteger, nullable=False)
+    # when the row was written, the Data Vault loads pick up rows by this watermark
+    load_dtm = Column(DateTime, nullable=False, server_default=func.now(), index=True)
+
+
+# all stage rows come from the DWH topic
+HASH_KEY_SOURCE = "kafka"
+
+
+def hash_key_column(*fields: str) -> Column:
+    """
+    Data Vault hash key of the given fields, computed by the stage loader. The
+    attribute must be named `hash_key_name(fields)`, which the loads refer to.
+    """
+    return Column(LargeBinary, info={"hash_key_fields": fields})
+
+
 # SignUpEvent
-class KafkaUserHistory(Base):
+class KafkaUserHistory(KafkaRecord, Base):
     __tablename__ = "kafka_user_history"
     __table_args__ = {"schema": schema_name}
-    event_id = Column(UUID(), nullable=False, primary_key=True, default=uuid4)
+    event_id = Column(UUID(), nullable=False, primary_key=True)
     user_id = Column(String, nullable=False)
     email = Column(String)
     country_code = Column(String)
@@ -30,23 +71,24 @@ class KafkaUserHistory(Base):
     birth_date = Column(Date, nullable=False)
     event_type = Column(String, nullable=False)
     event_time = Column(DateTime, nullable=False)
+    hk_user_id = hash_key_column("user_id")
 
 
 # CountryEnabled
-class KafkaCountryEnabled(Base):
+class KafkaCountryEnabled(KafkaRecord, Base):
     __tablename__ = "kafka_country_enabled"
     __table_args__ = {"schema": schema_name}
-    event_id = Column(UUID(), nullable=False, primary_key=True, default=uuid4)
+    event_id = Column(UUID(), nullable=False, primary_key=True)
     country_code = Column(String)
     event_type = Column(String, nullable=False)
     event_time = Column(DateTime, nullable=False)
 
 
 # GenreCreated
-class KafkaGenreCreated(Base):
+class KafkaGenreCreated(KafkaRecord, Base):
     __tablename__ = "kafka_genre"
     __table_args__ = {"schema": schema_name}
-    event_id = Column(UUID(), nullable=False, primary_key=True, default=uuid4)
+    event_id = Column(UUID(), nullable=False, primary_key=True)
     id = Column(String, nullable=False)
     name = Column(String)
     happiness_index = Column(Integer)
@@ -57,23 +99,24 @@ class KafkaGenreCreated(Base):
 
 
 # ArtistCreated
-class KafkaArtistCreated(Base):
+class KafkaArtistCreated(KafkaRecord, Base):
     __tablename__ = "kafka_artist"
     __table_args__ = {"schema": schema_name}
-    event_id = Column(UUID(), nullable=False, primary_key=True, default=uuid4)
+    event_id = Column(UUID(), nullable=False, primary_key=True)
     id = Column(String, nullable=False)
     name = Column(String)
     founded_year = Column(Integer)
     country_code = Column(String)
     event_type = Column(String, nullable=False)
     event_time = Column(DateTime, nullable=False)
+    hk_id = hash_key_column("id")
 
 
 # CollectionCreated
-class KafkaCollectionCreated(Base):
+class KafkaCollectionCreated(KafkaRecord, Base):
     __tablename__ = "kafka_collection"
     __table_args__ = {"schema": schema_name}
-    event_id = Column(UUID(), nullable=False, primary_key=True, default=uuid4)
+    event_id = Column(UUID(), nullable=False, primary_key=True)
     id = Column(String, nullable=False)
     name = Column(String)
     collection_type = Column(String)
@@ -82,13 +125,16 @@ class KafkaCollectionCreated(Base):
     released_dt = Column(String)
     event_type = Column(String, nullable=False)
     event_time = Column(DateTime, nullable=False)
+    hk_id = hash_key_column("id")
+    hk_artist_id = hash_key_column("artist_id")
+    hk_id_artist_id = hash_key_column("id", "artist_id")
 
 
 # SongCreated
-class KafkaSongCreated(Base):
+class KafkaSongCreated(KafkaRecord, Base):
     __tablename__ = "kafka_song"
     __table_args__ = {"schema": schema_name}
-    event_id = Column(UUID(), nullable=False, primary_key=True, default=uuid4)
+    event_id = Column(UUID(), nullable=False, primary_key=True)
     id = Column(String, nullable=False)
     name = Column(String)
     duration_sec = Column(Integer)
@@ -97,25 +143,29 @@ class KafkaSongCreated(Base):
     collection_id = Column(String)
     event_type = Column(String, nullable=False)
     event_time = Column(DateTime, nullable=False)
+    hk_id = hash_key_column("id")
+    hk_collection_id = hash_key_column("collection_id")
+    hk_collection_id_id = hash_key_column("collection_id", "id")
 
 
 # SignInSuccessEvent
-class KafkaUserAuthorization(Base):
+class KafkaUserAuthorization(KafkaRecord, Base):
     __tablename__ = "kafka_user_authorization"
     __table_args__ = {"schema": schema_name}
-    event_id = Column(UUID(), nullable=False, primary_key=True, default=uuid4)
+    event_id = Column(UUID(), nullable=False, primary_key=True)
     user_id = Column(String, nullable=False)
     session_id = Column(String, nullable=False)
     event_type = Column(String, nullable=False)
     event_time = Column(DateTime, nullable=False)
+    hk_session_id = hash_key_column("session_id")
 
 
 # SongPlayEvent
 # SongStopEvent
-class KafkaPlayback(Base):
+class KafkaPlayback(KafkaRecord, Base):
     __tablename__ = "kafka_playback"
     __table_args__ = {"schema": schema_name}
-    event_id = Column(UUID(), nullable=False, primary_key=True, default=uuid4)
+    event_id = Column(UUID(), nullable=False, primary_key=True)
     user_id = Column(String, nullable=False)
     session_id = Column(String, nullable=False)
     song_id = Column(String, nullable=False)
@@ -123,39 +173,140 @@ class KafkaPlayback(Base):
     finished = Column(Boolean)
     event_type = Column(String, nullable=False)
     event_time = Column(DateTime, nullable=False)
+    hk_session_id = hash_key_column("session_id")
+    hk_song_id = hash_key_column("song_id")
+    hk_user_id = hash_key_column("user_id")
+    hk_session_id_song_id_user_id = hash_key_column("session_id", "song_id", "user_id")
 
 
 # SongLikedEvent
-class KafkaSongLike(Base):
+class KafkaSongLike(KafkaRecord, Base):
     __tablename__ = "kafka_song_like"
     __table_args__ = {"schema": schema_name}
-    event_id = Column(UUID(), nullable=False, primary_key=True, default=uuid4)
+    event_id = Column(UUID(), nullable=False, primary_key=True)
     user_id = Column(String, nullable=False)
     session_id = Column(String, nullable=False)
     song_id = Column(String, nullable=False)
     event_type = Column(String, nullable=False)
     event_time = Column(DateTime, nullable=False)
+    hk_session_id = hash_key_column("session_id")
+    hk_song_id = hash_key_column("song_id")
+    hk_user_id = hash_key_column("user_id")
+    hk_session_id_song_id_user_id = hash_key_column("session_id", "song_id", "user_id")
 
 
 # ArtistFollowedEvent
-class KafkaArtistFollowed(Base):
+class KafkaArtistFollowed(KafkaRecord, Base):
     __tablename__ = "kafka_artist_follow"
     __table_args__ = {"schema": schema_name}
-    event_id = Column(UUID(), nullable=False, primary_key=True, default=uuid4)
+    event_id = Column(UUID(), nullable=False, primary_key=True)
     user_id = Column(String, nullable=False)
     session_id = Column(String, nullable=False)
     artist_id = Column(String, nullable=False)
     event_type = Column(String, nullable=False)
     event_time = Column(DateTime, nullable=False)
-    
-class KafkaSubscriptionEvent(Base):
+    hk_session_id = hash_key_column("session_id")
+    hk_artist_id = hash_key_column("artist_id")
+    hk_user_id = hash_key_column("user_id")
+    hk_session_id_artist_id_user_id = hash_key_column(
+        "session_id", "artist_id", "user_id"
+    )
+
+
+class KafkaSubscriptionEvent(KafkaRecord, Base):
     __tablename__ = "kafka_user_subscription"
     __table_args__ = {"schema": schema_name}
-    event_id = Column(UUID(), nullable=False, primary_key=True, default=uuid4)
+    event_id = Column(UUID(), nullable=False, primary_key=True)
     user_id = Column(String, nullable=False)
     session_id = Column(String, nullable=False)
     event_type = Column(String, nullable=False)
     event_time = Column(DateTime, nullable=False)
+    hk_user_id = hash_key_column("user_id")
+
+
+class KafkaDeadLetter(Base):
+    """
+    Records of the DWH topic that could not be decoded, kept as they were so that
+    they can be inspected and replayed; the loader skips them.
+    """
+
+    __tablename__ = "kafka_dead_letter"
+    __table_args__ = {"schema": schema_name}
+    topic = Column(String, primary_key=True)
+    partition = Column(Integer, primary_key=True)
+    offset = Column(BigInteger, primary_key=True)
+    payload = Column(LargeBinary, nullable=True)
+    error = Column(String, nullable=False)
+    load_dtm = Column(DateTime, nullable=False, server_default=func.now())
+
+
+class KafkaOffsetCheckpoint(Base):
+    """
+    Next offset to load per partition, written in the same transaction as the
+    stage rows of the batch.
+    """
+
+    __tablename__ = "kafka_offset_checkpoint"
+    __table_args__ = {"schema": schema_name}
+    consumer_group = Column(String, primary_key=True)
+    topic = Column(String, primary_key=True)
+    partition = Column(Integer, primary_key=True)
+    next_offset = Column(BigInteger, nullable=False)
+    updated_dtm = Column(DateTime, nullable=False, server_default=func.now())
+
+
+for table in Base.metadata.tables.values():
+    for column in table.columns:
+        fields = column.info.get("hash_key_fields")
+        if fields and column.name != hash_key_name(fields):
+            raise ValueError(
+                f"Hash key {table.name}.{column.name} must be named {hash_key_name(fields)}."
+            )
 
 
 Base.metadata.create_all(engine)
+
+
+def add_missing_columns() -> None:
+    """
+    create_all doesn't change existing tables, so the columns a stage table created
+    by an older version lacks are added here. The rows already there get no Kafka
+    position, the time of the upgrade as `load_dtm`, so that the Data Vault loads
+    them once more (its inserts skip what it has), and hash keys computed in SQL the
+    same way as `hash_key`.
+    """
+    with engine.begin() as conn:
+        inspector = inspect(conn)
+        for table in Base.metadata.sorted_tables:
+            name = f"{schema_name}.{table.name}"
+            existing = {
+                column["name"]
+                for column in inspector.get_columns(table.name, schema=schema_name)
+            }
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                log.info(f"Adding column {column.name} to {name}.")
+                column_type = column.type.compile(dialect=conn.dialect)
+                default = " NOT NULL DEFAULT now()" if column.name == "load_dtm" else ""
+                conn.execute(
+                    text(
+                        f"ALTER TABLE {name} ADD COLUMN {column.name} {column_type}{default}"
+                    )
+                )
+                fields = column.info.get("hash_key_fields")
+                if fields:
+                    conn.execute(
+                        text(
+                            f"UPDATE {name} SET {column.name} = digest(concat_ws('#', "
+                            f"{', '.join(fields)}) || '#' || :source, 'sha256')"
+                        ),
+                        {"source": HASH_KEY_SOURCE},
+                    )
+            indexes = {
+                index["name"]
+                for index in inspector.get_indexes(table.name, schema=schema_name)
+            }
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(conn)
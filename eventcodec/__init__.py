@@ -0,0 +1,37 @@
+import struct
+from typing import Any
+
+from .binary import MAGIC, CodecError, decode_binary_event, encode_event
+from .jsoncodec import EnhancedJSONEncoder, decode_json_event, encode_json_event
+from .schema import SCHEMAS, SCHEMAS_BY_NAME, EventSchema, FieldType
+
+ENCODINGS = ("binary", "json")
+
+
+def serialize(event_type: str, event: Any, encoding: str = "binary") -> bytes:
+    """
+    Serializes an event (a dataclass or a dict) with the given wire encoding.
+    """
+    if encoding == "binary":
+        return encode_event(event_type, event)
+    elif encoding == "json":
+        return encode_json_event(event_type, event)
+    raise CodecError(f"Unknown event encoding {encoding}.")
+
+
+def decode_event(payload: bytes) -> dict:
+    """
+    Decodes a binary or a JSON event into `{"type": ..., "data": {...}}`.
+
+    Raises:
+        CodecError: if the payload is not a valid event in either encoding.
+    """
+    try:
+        if payload and payload[0] == MAGIC:
+            return decode_binary_event(payload)
+        event = decode_json_event(payload)
+    except (ValueError, struct.error, IndexError, KeyError) as e:
+        raise CodecError(f"Malformed event: {e!r}") from e
+    if not isinstance(event, dict) or "type" not in event or "data" not in event:
+        raise CodecError("Malformed event: no type or data.")
+    return event
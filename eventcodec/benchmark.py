@@ -0,0 +1,88 @@
+"""
+Compares the binary event encoding with the JSON one on a typical traffic mix.
+
+    python -m eventcodec.benchmark [-n NUM_EVENTS]
+"""
+import argparse
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+import gzip
+import random
+import time
+from uuid import UUID, uuid4
+
+from . import decode_binary_event, decode_json_event, encode_event, encode_json_event
+
+
+# mirrors of the backend playback events, which are the bulk of the traffic
+@dataclass(kw_only=True)
+class SongPlayEvent:
+    event_time: datetime
+    user_id: UUID
+    session_id: UUID
+    song_id: UUID
+    at_time_sec: int
+
+
+@dataclass(kw_only=True)
+class SongStopEvent(SongPlayEvent):
+    finished: bool
+
+
+def generate_events(n: int, seed: int = 42) -> list:
+    rnd = random.Random(seed)
+    songs = [uuid4() for _ in range(1000)]
+    sessions = [(uuid4(), uuid4()) for _ in range(200)]
+    t = datetime(2023, 5, 26)
+    events = []
+    for i in range(n):
+        user_id, session_id = rnd.choice(sessions)
+        t += timedelta(seconds=rnd.randint(1, 30))
+        kwargs = dict(
+            event_time=t,
+            user_id=user_id,
+            session_id=session_id,
+            song_id=rnd.choice(songs),
+            at_time_sec=rnd.randint(0, 300),
+        )
+        if i % 2:
+            events.append(SongStopEvent(finished=rnd.random() < 0.5, **kwargs))
+        else:
+            events.append(SongPlayEvent(**kwargs))
+    return events
+
+
+def _timed(fn, items) -> tuple[list, float]:
+    started = time.perf_counter()
+    out = [fn(x) for x in items]
+    return out, time.perf_counter() - started
+
+
+def run(n: int) -> None:
+    events = generate_events(n)
+    results = {}
+    for name, encode, decode in (
+        ("json", encode_json_event, decode_json_event),
+        ("binary", encode_event, decode_binary_event),
+    ):
+        payloads, encode_sec = _timed(lambda e: encode(e.__class__.__name__, e), events)
+        _, decode_sec = _timed(decode, payloads)
+        size = sum(len(p) for p in payloads)
+        gzip_size = len(gzip.compress(b"".join(payloads)))
+        results[name] = (size, gzip_size, n / encode_sec, n / decode_sec)
+
+    print(f"{n} playback events")
+    print(
+        f"{'':8}{'bytes/event':>14}{'gzip bytes/ev':>16}{'encode ev/s':>14}{'decode ev/s':>14}"
+    )
+    for name, (size, gzip_size, enc, dec) in results.items():
+        print(f"{name:8}{size / n:14.1f}{gzip_size / n:16.1f}{enc:14.0f}{dec:14.0f}")
+    json_size, binary_size = results["json"][0], results["binary"][0]
+    print(f"binary/json size ratio: {binary_size / json_size:.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", type=int, default=100_000, help="number of events")
+    args = parser.parse_args()
+    run(args.n)
@@ -0,0 +1,249 @@
+from datetime import date, datetime, timedelta, timezone
+import struct
+from typing import Any, Callable
+from uuid import UUID
+
+from .schema import SCHEMAS_BY_ID, SCHEMAS_BY_NAME, EventSchema, FieldType
+
+# first byte of every binary event, JSON events always start with "{"
+MAGIC = 0xD7
+FORMAT_VERSION = 1
+
+_HEADER = struct.Struct("<BBBB")  # magic, format version, type id, schema version
+_INT64 = struct.Struct("<q")
+_INT32 = struct.Struct("<i")
+
+_EPOCH = datetime(1970, 1, 1)
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+class CodecError(Exception):
+    pass
+
+
+def _get_field(obj: Any, name: str) -> Any:
+    if isinstance(obj, dict):
+        return obj.get(name)
+    return getattr(obj, name)
+
+
+def _pack_uuid(out: bytearray, v) -> None:
+    out += (v if isinstance(v, UUID) else UUID(str(v))).bytes
+
+
+def _pack_datetime(out: bytearray, v: datetime) -> None:
+    out += _INT64.pack(_datetime_to_micros(v))
+
+
+def _pack_date(out: bytearray, v: date) -> None:
+    out += _INT32.pack(_date_to_days(v))
+
+
+def _pack_int(out: bytearray, v) -> None:
+    out += _INT32.pack(int(v))
+
+
+def _pack_bool(out: bytearray, v) -> None:
+    out.append(1 if v else 0)
+
+
+def _pack_str(out: bytearray, v) -> None:
+    data = str(v).encode("utf-8")
+    n = len(data)
+    # unsigned LEB128 length
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+    out += data
+
+
+def _unpack_uuid(buf: bytes, pos: int) -> tuple[str, int]:
+    # same representation as the JSON events (hex without dashes)
+    return buf[pos : pos + 16].hex(), pos + 16
+
+
+def _unpack_datetime(buf: bytes, pos: int) -> tuple[datetime, int]:
+    (micros,) = _INT64.unpack_from(buf, pos)
+    return _EPOCH + timedelta(microseconds=micros), pos + 8
+
+
+def _unpack_date(buf: bytes, pos: int) -> tuple[date, int]:
+    (days,) = _INT32.unpack_from(buf, pos)
+    return date.fromordinal(days + _EPOCH_ORDINAL), pos + 4
+
+
+def _unpack_int(buf: bytes, pos: int) -> tuple[int, int]:
+    return _INT32.unpack_from(buf, pos)[0], pos + 4
+
+
+def _unpack_bool(buf: bytes, pos: int) -> tuple[bool, int]:
+    return buf[pos] != 0, pos + 1
+
+
+def _unpack_str(buf: bytes, pos: int) -> tuple[str, int]:
+    n, shift = 0, 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        n |= (b & 0x7F) << shift
+        if b < 0x80:
+            break
+        shift += 7
+    return buf[pos : pos + n].decode("utf-8"), pos + n
+
+
+_PACKERS: dict[FieldType, Callable[[bytearray, Any], None]] = {
+    FieldType.UUID: _pack_uuid,
+    FieldType.DATETIME: _pack_datetime,
+    FieldType.DATE: _pack_date,
+    FieldType.INT: _pack_int,
+    FieldType.BOOL: _pack_bool,
+    FieldType.STR: _pack_str,
+}
+
+_UNPACKERS: dict[FieldType, Callable[[bytes, int], tuple[Any, int]]] = {
+    FieldType.UUID: _unpack_uuid,
+    FieldType.DATETIME: _unpack_datetime,
+    FieldType.DATE: _unpack_date,
+    FieldType.INT: _unpack_int,
+    FieldType.BOOL: _unpack_bool,
+    FieldType.STR: _unpack_str,
+}
+
+
+_FIXED_FORMATS = {
+    FieldType.UUID: "16s",
+    FieldType.DATETIME: "q",
+    FieldType.DATE: "i",
+    FieldType.INT: "i",
+    FieldType.BOOL: "?",
+}
+
+_TO_WIRE = {
+    FieldType.UUID: lambda v: (v if isinstance(v, UUID) else UUID(str(v))).bytes,
+    FieldType.DATETIME: lambda v: _datetime_to_micros(v),
+    FieldType.DATE: lambda v: _date_to_days(v),
+    FieldType.INT: int,
+    FieldType.BOOL: bool,
+}
+
+_FROM_WIRE = {
+    FieldType.UUID: bytes.hex,
+    FieldType.DATETIME: lambda v: _EPOCH + timedelta(microseconds=v),
+    FieldType.DATE: lambda v: date.fromordinal(v + _EPOCH_ORDINAL),
+    FieldType.INT: None,
+    FieldType.BOOL: None,
+}
+
+
+class _Layout:
+    """
+    Pre-compiled struct for a schema version without string fields, used when
+    none of the fields are null (i.e. for practically all playback events).
+    """
+
+    def __init__(self, fields) -> None:
+        self.names = [name for name, _ in fields]
+        self.struct = struct.Struct(
+            "<" + "".join(_FIXED_FORMATS[field_type] for _, field_type in fields)
+        )
+        self.to_wire = [_TO_WIRE[field_type] for _, field_type in fields]
+        self.from_wire = [_FROM_WIRE[field_type] for _, field_type in fields]
+
+
+_LAYOUTS: dict[tuple[int, int], _Layout] = {
+    (schema.type_id, version): _Layout(fields)
+    for schema in SCHEMAS_BY_ID.values()
+    for version, fields in schema.versions.items()
+    if all(field_type in _FIXED_FORMATS for _, field_type in fields)
+}
+
+
+def _datetime_to_micros(v) -> int:
+    if isinstance(v, str):
+        v = datetime.fromisoformat(v)
+    if v.tzinfo is not None:
+        v = v.astimezone(timezone.utc).replace(tzinfo=None)
+    return (v - _EPOCH) // timedelta(microseconds=1)
+
+
+def _date_to_days(v) -> int:
+    if isinstance(v, str):
+        v = date.fromisoformat(v)
+    return v.toordinal() - _EPOCH_ORDINAL
+
+
+def encode_event(event_type: str, event: Any) -> bytes:
+    """
+    Encodes an event (a dataclass or a dict) with the latest layout of its schema.
+
+    Layout: header (magic, format version, type id, schema version), a null bitmap
+    with one bit per field, then the non-null fields in schema order.
+
+    Raises:
+        CodecError: if there is no schema for the event type.
+    """
+    schema = SCHEMAS_BY_NAME.get(event_type)
+    if schema is None:
+        raise CodecError(f"No binary schema for event type {event_type}.")
+    version = schema.latest_version
+    fields = schema.versions[version]
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, schema.type_id, version)
+    values = [_get_field(event, name) for name, _ in fields]
+    layout = _LAYOUTS.get((schema.type_id, version))
+    if layout is not None and None not in values:
+        wire = [conv(v) for conv, v in zip(layout.to_wire, values)]
+        return header + bytes(_bitmap_size(fields)) + layout.struct.pack(*wire)
+    out = bytearray(header)
+    bitmap = 0
+    for i, v in enumerate(values):
+        if v is None:
+            bitmap |= 1 << i
+    out += bitmap.to_bytes(_bitmap_size(fields), "little")
+    for (_, field_type), v in zip(fields, values):
+        if v is not None:
+            _PACKERS[field_type](out, v)
+    return bytes(out)
+
+
+def decode_binary_event(payload: bytes) -> dict:
+    """
+    Decodes a binary event into the same `{"type": ..., "data": {...}}` shape as
+    the JSON events; UUIDs are returned as hex strings.
+
+    Raises:
+        CodecError: if the payload is not a known binary event.
+    """
+    if len(payload) < _HEADER.size:
+        raise CodecError("Binary event is too short.")
+    magic, format_version, type_id, version = _HEADER.unpack_from(payload, 0)
+    if magic != MAGIC or format_version != FORMAT_VERSION:
+        raise CodecError(f"Unknown binary event format {magic:#x}/{format_version}.")
+    schema: EventSchema = SCHEMAS_BY_ID.get(type_id)
+    if schema is None or version not in schema.versions:
+        raise CodecError(f"Unknown binary event type {type_id} version {version}.")
+    fields = schema.versions[version]
+    pos = _HEADER.size
+    size = _bitmap_size(fields)
+    bitmap = int.from_bytes(payload[pos : pos + size], "little")
+    pos += size
+    layout = _LAYOUTS.get((type_id, version))
+    if layout is not None and bitmap == 0:
+        values = layout.struct.unpack_from(payload, pos)
+        data = {
+            name: v if conv is None else conv(v)
+            for name, conv, v in zip(layout.names, layout.from_wire, values)
+        }
+        return {"type": schema.name, "data": data}
+    data = {}
+    for i, (name, field_type) in enumerate(fields):
+        if bitmap & (1 << i):
+            data[name] = None
+        else:
+            data[name], pos = _UNPACKERS[field_type](payload, pos)
+    return {"type": schema.name, "data": data}
+
+
+def _bitmap_size(fields) -> int:
+    return (len(fields) + 7) // 8
@@ -0,0 +1,25 @@
+import dataclasses
+from datetime import date, datetime
+import json
+from typing import Any
+from uuid import UUID
+
+
+class EnhancedJSONEncoder(json.JSONEncoder):
+    def default(self, o):
+        if dataclasses.is_dataclass(o):
+            return dataclasses.asdict(o)
+        if isinstance(o, UUID):
+            return o.hex
+        if isinstance(o, (date, datetime)):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_json_event(event_type: str, event: Any) -> bytes:
+    obj = json.dumps({"type": event_type, "data": event}, cls=EnhancedJSONEncoder)
+    return bytes(obj, encoding="utf-8")
+
+
+def decode_json_event(payload: bytes) -> dict:
+    return json.loads(payload.decode("utf-8"))
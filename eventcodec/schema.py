@@ -0,0 +1,184 @@
+from dataclasses import dataclass
+from enum import Enum
+
+
+class FieldType(Enum):
+    UUID = 0  # 16 raw bytes
+    DATETIME = 1  # int64, microseconds since the epoch
+    DATE = 2  # int32, days since the epoch
+    INT = 3  # int32
+    BOOL = 4  # 1 byte
+    STR = 5  # varint length + utf-8 bytes
+
+
+@dataclass(frozen=True)
+class EventSchema:
+    """
+    Fixed binary field layout of one event type.
+
+    `versions` maps a schema version to its ordered list of fields; events are
+    always encoded with the latest version, older ones are kept for decoding.
+    """
+
+    name: str
+    type_id: int
+    versions: dict[int, tuple[tuple[str, FieldType], ...]]
+
+    @property
+    def latest_version(self) -> int:
+        return max(self.versions)
+
+
+T = FieldType
+
+# Layouts mirror the `DwhEvent` dataclasses of the backend (backend/backend/events/models.py).
+# Type ids and released versions must never change, add a new version instead.
+SCHEMAS = [
+    EventSchema(
+        "SignUpEvent",
+        1,
+        {
+            1: (
+                ("event_time", T.DATETIME),
+                ("user_id", T.UUID),
+                ("email", T.STR),
+                ("country_code", T.STR),
+                ("first_name", T.STR),
+                ("last_name", T.STR),
+                ("birth_date", T.DATE),
+            )
+        },
+    ),
+    EventSchema(
+        "SignInSuccessEvent",
+        2,
+        {1: (("event_time", T.DATETIME), ("user_id", T.UUID), ("session_id", T.UUID))},
+    ),
+    EventSchema(
+        "SignInFailureEvent",
+        3,
+        {1: (("event_time", T.DATETIME), ("reason", T.STR))},
+    ),
+    EventSchema(
+        "UserSubscriptionEvent",
+        4,
+        {1: (("event_time", T.DATETIME), ("user_id", T.UUID), ("session_id", T.UUID))},
+    ),
+    EventSchema(
+        "SongPlayEvent",
+        5,
+        {
+            1: (
+                ("event_time", T.DATETIME),
+                ("user_id", T.UUID),
+                ("session_id", T.UUID),
+                ("song_id", T.UUID),
+                ("at_time_sec", T.INT),
+            )
+        },
+    ),
+    EventSchema(
+        "SongStopEvent",
+        6,
+        {
+            1: (
+                ("event_time", T.DATETIME),
+                ("user_id", T.UUID),
+                ("session_id", T.UUID),
+                ("song_id", T.UUID),
+                ("at_time_sec", T.INT),
+                ("finished", T.BOOL),
+            )
+        },
+    ),
+    EventSchema(
+        "SongLikedEvent",
+        7,
+        {
+            1: (
+                ("event_time", T.DATETIME),
+                ("user_id", T.UUID),
+                ("session_id", T.UUID),
+                ("song_id", T.UUID),
+            )
+        },
+    ),
+    EventSchema(
+        "ArtistFollowedEvent",
+        8,
+        {
+            1: (
+                ("event_time", T.DATETIME),
+                ("user_id", T.UUID),
+                ("session_id", T.UUID),
+                ("artist_id", T.UUID),
+            )
+        },
+    ),
+    EventSchema(
+        "ArtistCreated",
+        9,
+        {
+            1: (
+                ("event_time", T.DATETIME),
+                ("id", T.UUID),
+                ("name", T.STR),
+                ("founded_year", T.INT),
+                ("country_code", T.STR),
+                ("genre_id", T.UUID),
+            )
+        },
+    ),
+    EventSchema(
+        "CollectionCreated",
+        10,
+        {
+            1: (
+                ("event_time", T.DATETIME),
+                ("id", T.UUID),
+                ("name", T.STR),
+                ("collection_type", T.STR),
+                ("artist_id", T.UUID),
+                ("genre_id", T.UUID),
+                ("released_dt", T.DATE),
+            )
+        },
+    ),
+    EventSchema(
+        "SongCreated",
+        11,
+        {
+            1: (
+                ("event_time", T.DATETIME),
+                ("collection_id", T.UUID),
+                ("artist_id", T.UUID),
+                ("genre_id", T.UUID),
+                ("id", T.UUID),
+                ("name", T.STR),
+                ("duration_sec", T.INT),
+            )
+        },
+    ),
+    EventSchema(
+        "GenreCreated",
+        12,
+        {
+            1: (
+                ("event_time", T.DATETIME),
+                ("id", T.UUID),
+                ("name", T.STR),
+                ("happiness_index", T.INT),
+                ("mean_duration_sec", T.INT),
+                ("country_code", T.STR),
+            )
+        },
+    ),
+    EventSchema(
+        "CountryEnabled",
+        13,
+        {1: (("event_time", T.DATETIME), ("country_code", T.STR))},
+    ),
+]
+
+SCHEMAS_BY_NAME = {s.name: s for s in SCHEMAS}
+SCHEMAS_BY_ID = {s.type_id: s for s in SCHEMAS}
@@ -6,6 +6,12 @@ class Config:
     # - 86400: 1 sim day per second
     # - 604800: 1 sim week per second
     CLOCK_MULTIPLIER = 3600
+    # "realtime": the sim time runs CLOCK_MULTIPLIER times faster than the real time
+    # "virtual": the sim time jumps to the next event as soon as the agents are done
+    # with the current one, so the simulation runs as fast as MSS responds
+    CLOCK_MODE = "realtime"
+    # loop iterations without new activity after which the virtual clock moves on
+    VIRTUAL_CLOCK_SETTLE_YIELDS = 3
 
     DB_HOST = "localhost"
     DB_PORT = "5432"
@@ -20,6 +26,21 @@ class Config:
     # Connection to MSS main application
     MSS_HOST = "localhost"
     MSS_PORT = "8080"
+    # connections to MSS shared by all the agents
+    HTTP_MAX_CONNECTIONS = 100
+    # requests sent or waiting for a connection at the same time
+    HTTP_MAX_IN_FLIGHT = 1000
+    HTTP_TIMEOUT_SEC = 10
+    HTTP_MAX_ATTEMPTS = 3
+    HTTP_BACKOFF_MAX_SEC = 5
+
+    # seed of the agents' random samples and decisions and of the clock noise, None
+    # for different ones on every run; only with a virtual clock, which orders the
+    # agents the same way every run, do the agents repeat the same decisions
+    RANDOM_SEED = None
+    # samples drawn at once per distribution by the controllers and by every user
+    RANDOM_BLOCK_SIZE = 1024
+    RANDOM_USER_BLOCK_SIZE = 16
 
     # Pre-generate test data
     DROP_DB_ON_LAUNCH = True
@@ -29,6 +50,15 @@ class Config:
     WARMUP_NUM_OF_COUNTRIES_ENABLED = 5
     WARMUP_NUM_OF_USERS = 50
 
+    # "task": every active user is a `UserAgent` with its own task
+    # "population": the active users are rows of one `UserPopulation`, for 100k+ users
+    USER_AGENTS = "task"
+    USER_POPULATION_INITIAL_SIZE = 1024
+    # how often the population looks for users due for their next step
+    USER_POPULATION_TICK_SEC = 1
+    # songs queued at most per user, enough for an LP and a song on repeat
+    USER_POPULATION_QUEUE_SIZE = 32
+
     # Simulation statistics
 
     STAT_USER_CONTROLLER = {
@@ -64,3 +94,21 @@ class Config:
     }
 
     ENABLE_COUNTRY_DELAY_DAYS = 30
+
+    # Headless event generator (python -m simulator.generate)
+    KAFKA_BOOTSTRAP_SERVERS = ["localhost:9092"]
+    KAFKA_DWH_TOPIC = "dwh_events"
+    KAFKA_EVENT_ENCODING = "binary"
+
+    GENERATOR_SEED = 42
+    GENERATOR_WORKERS = 4
+    GENERATOR_START_TIME = "2023-05-01T00:00:00"
+    GENERATOR_NUM_OF_COUNTRIES = 10
+    GENERATOR_NUM_OF_ARTISTS = 1000
+    GENERATOR_NUM_OF_USERS = 100000
+    GENERATOR_OUTPUT_DIR = "generated_events"
+    STAT_GENERATOR = {
+        "prob_follow": 0.05,
+        "zipf_exponent": 1.0,
+        "session_gap_sec": 1,
+    }
@@ -0,0 +1,63 @@
+import argparse
+from datetime import datetime
+import logging
+
+from .config import Config
+from .simulator.generator import GeneratorParams, generate
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generates DWH events without the backend."
+    )
+    parser.add_argument("--seed", type=int, default=Config.GENERATOR_SEED)
+    parser.add_argument("--workers", type=int, default=Config.GENERATOR_WORKERS)
+    parser.add_argument(
+        "--events",
+        type=int,
+        default=0,
+        help="events per worker, including the catalog events for worker 0, "
+        "0 to run until stopped",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=0,
+        help="events per second of all the workers, 0 for as fast as possible",
+    )
+    parser.add_argument("--sink", choices=["kafka", "file"], default="kafka")
+    parser.add_argument("--output-dir", default=Config.GENERATOR_OUTPUT_DIR)
+    parser.add_argument(
+        "--encoding", choices=["binary", "json"], default=Config.KAFKA_EVENT_ENCODING
+    )
+    parser.add_argument("--users", type=int, default=Config.GENERATOR_NUM_OF_USERS)
+    parser.add_argument("--artists", type=int, default=Config.GENERATOR_NUM_OF_ARTISTS)
+    args = parser.parse_args()
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s %(processName)s %(name)s: %(message)s",
+    )
+    generate(
+        GeneratorParams(
+            seed=args.seed,
+            workers=args.workers,
+            events=args.events,
+            rate=args.rate,
+            sink=args.sink,
+            encoding=args.encoding,
+            output_dir=args.output_dir,
+            kafka_bootstrap_servers=Config.KAFKA_BOOTSTRAP_SERVERS,
+            kafka_topic=Config.KAFKA_DWH_TOPIC,
+            start_time=datetime.fromisoformat(Config.GENERATOR_START_TIME),
+            countries=Config.GENERATOR_NUM_OF_COUNTRIES,
+            artists=args.artists,
+            users=args.users,
+            prob_leave_session=Config.STAT_USER["prob_leave_session"],
+            prob_subscription=Config.STAT_USER["prob_subscription"],
+            **Config.STAT_GENERATOR,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
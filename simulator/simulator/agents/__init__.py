@@ -1,5 +1,6 @@
-from .clock import Clock
+from .clock import Clock, VirtualClock
 from .artistcontroller import ArtistControllerAgent
 from .countrycontroller import CountryControllerAgent
 from .user import UserAgent
+from .population import UserPopulation
 from .usercontroller import UserControllerAgent
@@ -1,14 +1,22 @@
 import asyncio
+from contextlib import contextmanager
 from datetime import datetime, timedelta
+import heapq
+import itertools
 import time
-import random
+from typing import Iterator
+
 from flask import current_app as app
 
+from ..randomstream import RandomStream
+
 log = app.logger
 
 
 class Clock:
-    def __init__(self, config) -> None:
+    def __init__(self, config, random_stream: RandomStream) -> None:
+        # noise of the waits
+        self.random = random_stream
         self.clock_multiplier = config["CLOCK_MULTIPLIER"]
         self.elapsed_real_time_ns = time.monotonic_ns()
         self.current_sim_time_sec = time.time()
@@ -16,6 +24,14 @@ class Clock:
     def get_current_sim_time(self) -> datetime:
         return datetime.fromtimestamp(self.current_sim_time_sec)
 
+    def now_sec(self) -> float:
+        """
+        The sim time in seconds, including the real time elapsed since the last sync
+        of `current_sim_time_sec`, which is only updated once per sim minute.
+        """
+        elapsed_ns = time.monotonic_ns() - self.elapsed_real_time_ns
+        return self.current_sim_time_sec + (elapsed_ns / 1e9) * self.clock_multiplier
+
     def to_sim_time(self, delta: timedelta) -> timedelta:
         return delta * self.clock_multiplier
 
@@ -26,21 +42,28 @@ class Clock:
         self.clock_multiplier = multiplier
 
     async def sim_days(self, num_days: float, with_noise: bool = True) -> None:
-        noise_hours = random.randint(-2, 2) if with_noise else 0
+        noise_hours = self.random.randint(-2, 2) if with_noise else 0
         await self.sim_hours(num_days * 24 + noise_hours)
 
     async def sim_hours(self, num_hours: float, with_noise: bool = True) -> None:
-        noise_minutes = random.randint(-5, 5) if with_noise else 0
+        noise_minutes = self.random.randint(-5, 5) if with_noise else 0
         await self.sim_minutes(num_hours * 60 + noise_minutes)
 
     async def sim_minutes(self, num_minutes: float, with_noise: bool = True) -> None:
-        noise_seconds = random.randint(-5, 5) if with_noise else 0
+        noise_seconds = self.random.randint(-5, 5) if with_noise else 0
         await self.sim_seconds(num_minutes * 60 + noise_seconds)
 
     async def sim_seconds(self, num_seconds: float, with_noise: bool = True) -> None:
-        noise_seconds = random.randint(-1, 1) if with_noise else 0
+        noise_seconds = self.random.randint(-1, 1) if with_noise else 0
         await asyncio.sleep((num_seconds + noise_seconds) / self.clock_multiplier)
 
+    @contextmanager
+    def busy(self) -> Iterator[None]:
+        """
+        Marks work that takes real time outside of the clock, e.g. a request to MSS.
+        """
+        yield
+
     async def _sync_time(self) -> None:
         while True:
             await self.running.wait()
@@ -64,3 +87,98 @@ class Clock:
             tg.create_task(self._sync_time())
             tg.create_task(self._log_current_time())
         log.info(f"Simulator clock tasks stopped.")
+
+
+class VirtualClock(Clock):
+    """
+    Discrete-event clock: the sim time doesn't follow the real time, it jumps
+    straight to the next time an agent waits for.
+
+    Every `sim_*` wait is a timestamped wake-up in a priority queue. Once all the
+    woken agents wait for the clock again, and no request to MSS is in flight, the
+    time moves to the earliest wake-up and the agents waiting for it resume, in
+    the order of their wake-up times.
+    """
+
+    def __init__(self, config, random_stream: RandomStream) -> None:
+        super().__init__(config, random_stream)
+        self.settle_yields = config["VIRTUAL_CLOCK_SETTLE_YIELDS"]
+        self._wakeups: list[tuple[float, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._busy = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    def set_clock_multiplier(self, multiplier: int) -> None:
+        log.info("The virtual clock runs as fast as possible, ignoring the multiplier.")
+
+    def now_sec(self) -> float:
+        return self.current_sim_time_sec
+
+    @contextmanager
+    def busy(self) -> Iterator[None]:
+        self._busy += 1
+        self._idle.clear()
+        try:
+            yield
+        finally:
+            self._busy -= 1
+            if self._busy == 0:
+                self._idle.set()
+
+    async def sim_seconds(self, num_seconds: float, with_noise: bool = True) -> None:
+        noise_seconds = self.random.randint(-1, 1) if with_noise else 0
+        wake_at = self.current_sim_time_sec + max(num_seconds + noise_seconds, 0)
+        wakeup = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._wakeups, (wake_at, next(self._seq), wakeup))
+        await wakeup
+
+    async def _settle(self) -> None:
+        # lets the woken agents run until they all wait for the clock again: the
+        # number of wake-ups and requests stays the same for a few loop iterations
+        stable = 0
+        while stable < self.settle_yields:
+            before = len(self._wakeups)
+            await asyncio.sleep(0)
+            if self._busy:
+                await self._idle.wait()
+                stable = 0
+            elif len(self._wakeups) == before:
+                stable += 1
+            else:
+                stable = 0
+
+    async def _advance_time(self) -> None:
+        while True:
+            await self.running.wait()
+            await self._settle()
+            if not self._wakeups:
+                # nothing scheduled yet, e.g. the agents are still starting
+                await asyncio.sleep(0.01)
+                continue
+            self.current_sim_time_sec = max(
+                self.current_sim_time_sec, self._wakeups[0][0]
+            )
+            while self._wakeups and self._wakeups[0][0] <= self.current_sim_time_sec:
+                _, _, wakeup = heapq.heappop(self._wakeups)
+                # cancelled when the agent waiting for it was stopped
+                if not wakeup.done():
+                    wakeup.set_result(None)
+
+    async def _log_current_time(self) -> None:
+        started_ns = time.monotonic_ns()
+        while True:
+            await self.running.wait()
+            await self.sim_days(1, with_noise=False)
+            log.info(
+                f"[CLOCK {self.get_current_sim_time()}] Elapsed "
+                f"{(time.monotonic_ns() - started_ns) / 1e9:.1f}s"
+            )
+
+    async def run(self, running):
+        log.info("Initializing the virtual simulator clock.")
+        self.running = running
+        async with asyncio.TaskGroup() as tg:
+            tg.create_task(self._advance_time())
+            tg.create_task(self._log_current_time())
+        log.info(f"Simulator clock tasks stopped.")
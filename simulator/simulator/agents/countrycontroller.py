@@ -1,5 +1,4 @@
 import asyncio
-import random
 from typing import Optional
 
 import pycountry
@@ -7,36 +6,44 @@ from flask import current_app as app
 
 from . import Clock
 from ..client import APIClient
+from ..randomstream import RandomStreams
 
 log = app.logger
 
 
 class CountryControllerAgent:
-    def __init__(self, api_client: APIClient, config, clock: Clock) -> None:
+    def __init__(
+        self,
+        api_client: APIClient,
+        config,
+        clock: Clock,
+        random_streams: RandomStreams,
+    ) -> None:
         self.clock = clock
+        self.random = random_streams.stream("country_controller")
         self.api_client = api_client
-        self.countries = api_client.get_countries()
+        self.countries: dict = {}
 
         # config values
         self.warmup_num_countries = config["WARMUP_NUM_OF_COUNTRIES"]
         self.warmup_num_countries_enabled = config["WARMUP_NUM_OF_COUNTRIES_ENABLED"]
         self.enable_country_delay = config["ENABLE_COUNTRY_DELAY_DAYS"]
 
-    def warmup_db(self) -> None:
+    async def warmup_db(self) -> None:
         all_countries = list(pycountry.countries)
-        selected = random.sample(all_countries, self.warmup_num_countries)
+        selected = self.random.sample(all_countries, self.warmup_num_countries)
         log.debug(f"Countries selected for addition: {selected}.")
         for c in selected:
             code, name = c.alpha_2, c.name
-            self.api_client.add_country(code, name)
-        self.countries = self.api_client.get_countries()
-        to_enable = random.sample(
+            await self.api_client.add_country(code, name)
+        self.countries = await self.api_client.get_countries()
+        to_enable = self.random.sample(
             sorted(self.countries.keys()), self.warmup_num_countries_enabled
         )
         log.debug(f"Countries selected to enable: {to_enable}.")
         for c in to_enable:
-            self.api_client.enable_country(c)
-        self.countries = self.api_client.get_countries()
+            await self.api_client.enable_country(c)
+        self.countries = await self.api_client.get_countries()
         log.info(
             f"{self.warmup_num_countries} countries added, {self.warmup_num_countries_enabled} enabled."
         )
@@ -47,13 +54,13 @@ class CountryControllerAgent:
             code for code, enabled_at in self.countries.items() if enabled_at is None
         ]
         if disabled:
-            return random.choice(disabled)
+            return self.random.choice(disabled)
         else:
             return None
 
-    def _enable_country(self, code: str):
-        self.api_client.enable_country(code)
-        self.countries = self.api_client.get_countries()
+    async def _enable_country(self, code: str):
+        await self.api_client.enable_country(code)
+        self.countries = await self.api_client.get_countries()
         log.info(f"Enabled new country {code}.")
 
     async def _enable_country_task(self) -> None:
@@ -63,7 +70,7 @@ class CountryControllerAgent:
                 await self.clock.sim_days(self.enable_country_delay)
                 next_code = self._pick_next_country()
                 if next_code:
-                    self._enable_country(next_code)
+                    await self._enable_country(next_code)
                 else:
                     log.info("No country was selected for this iteration.")
 
@@ -73,6 +80,7 @@ class CountryControllerAgent:
     async def run(self, running) -> None:
         log.info(f"Initializing country controller agent.")
         self.running = running
+        self.countries = await self.api_client.get_countries()
         async with asyncio.TaskGroup() as tg:
             tg.create_task(self._enable_country_task())
         log.info(f"Country controller agent tasks stopped.")
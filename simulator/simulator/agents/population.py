@@ -0,0 +1,482 @@
+import asyncio
+from array import array
+from typing import Optional
+from uuid import UUID
+
+import numpy as np
+from flask import current_app as app
+
+from .. import db
+from ..client import APIClient
+from ..models import UserSim
+from ..randomstream import RandomStream
+from ..utils import clamp, commit_db
+from .clock import Clock
+from .user import (
+    SKIP_TIME_LOGNORM,
+    UserAgentState,
+    get_most_popular_songs,
+    inc_song_listen_count,
+)
+
+log = app.logger
+
+CREATED = UserAgentState.CREATED.value
+IDLE = UserAgentState.IDLE.value
+LISTENING = UserAgentState.LISTENING.value
+LEFT = UserAgentState.LEFT.value
+INVALID = UserAgentState.INVALID.value
+
+# columns of `UserPopulation.probs`
+PROBS = ("patriot_p", "explorer_p", "skip_p", "picky_p", "collection_p", "popular_p")
+PATRIOT, EXPLORER, SKIP, PICKY, COLLECTION, POPULAR = range(len(PROBS))
+
+
+class SongCatalog:
+    """
+    The songs the users have come across, shared by all of them. A song is
+    addressed by its row number, its attributes are kept in typed arrays.
+    """
+
+    def __init__(self) -> None:
+        self.song_index: dict[str, int] = {}
+        self.song_ids: list[str] = []
+        # -1 until the song itself is fetched, e.g. for a liked song only known by id
+        self.duration = array("i")
+        self.artist = array("i")
+        self.genre = array("i")
+        self.artist_index: dict[str, int] = {}
+        self.artist_ids: list[str] = []
+        self.genre_index: dict[str, int] = {}
+        self.genre_ids: list[str] = []
+
+    def song(self, song_id: str) -> int:
+        song_id = str(song_id)
+        song = self.song_index.get(song_id)
+        if song is None:
+            song = self.song_index[song_id] = len(self.song_ids)
+            self.song_ids.append(song_id)
+            self.duration.append(-1)
+            self.artist.append(-1)
+            self.genre.append(-1)
+        return song
+
+    def add_song(self, data: dict) -> int:
+        song = self.song(data["id"])
+        self.duration[song] = data["duration_sec"]
+        self.artist[song] = self.artist_of(data["artist_id"])
+        self.genre[song] = self._genre(data["genre_id"])
+        return song
+
+    def is_known(self, song: int) -> bool:
+        return self.duration[song] >= 0
+
+    def artist_of(self, artist_id: str) -> int:
+        artist_id = str(artist_id)
+        artist = self.artist_index.get(artist_id)
+        if artist is None:
+            artist = self.artist_index[artist_id] = len(self.artist_ids)
+            self.artist_ids.append(artist_id)
+        return artist
+
+    def _genre(self, genre_id: str) -> int:
+        genre_id = str(genre_id)
+        genre = self.genre_index.get(genre_id)
+        if genre is None:
+            genre = self.genre_index[genre_id] = len(self.genre_ids)
+            self.genre_ids.append(genre_id)
+        return genre
+
+
+class UserPopulation:
+    """
+    All the active users as one struct of arrays, stepped by a single task.
+
+    Every user goes through the same states and makes the same choices with the
+    same probabilities as a `UserAgent`, but is a row in the arrays below instead of
+    an object with its own task: the song queue is a ring buffer of catalog rows,
+    the timers are one array of the sim time of every user's next step. On every
+    tick the users due are found with one vectorized comparison, their leave and
+    skip decisions are drawn together, and their steps are run concurrently.
+    Rows of users who left are reused.
+    """
+
+    def __init__(
+        self,
+        api_client: APIClient,
+        sim_params,
+        clock: Clock,
+        random_stream: RandomStream,
+        config,
+    ) -> None:
+        self.api_client = api_client
+        self.sim_params = sim_params
+        self.clock = clock
+        self.random = random_stream
+        self.rng = random_stream.rng
+        self.tick_sec = config["USER_POPULATION_TICK_SEC"]
+        self.queue_size = config["USER_POPULATION_QUEUE_SIZE"]
+        self.catalog = SongCatalog()
+        self.steps: set[asyncio.Future] = set()
+
+        self.size = 0
+        self.free: list[int] = []
+        self.usersims: list[Optional[UserSim]] = []
+        self.tokens: list[Optional[str]] = []
+        self.liked: list[array] = []
+        self.followed: list[array] = []
+        self._allocate(config["USER_POPULATION_INITIAL_SIZE"])
+
+    def _allocate(self, capacity: int) -> None:
+        # name: (shape of a row, dtype, value of an empty row)
+        columns = {
+            "agent_id": ((), np.int64, 0),
+            "state": ((), np.int8, LEFT),
+            # a step of the user is running, the user isn't due until it's done
+            "stepping": ((), bool, False),
+            # sim time of the next step in seconds
+            "next_step": ((), np.float64, np.inf),
+            "probs": ((len(PROBS),), np.float32, 0),
+            "is_premium": ((), bool, False),
+            # the song being listened to and for how long, -1 between songs
+            "playing": ((), np.int32, -1),
+            "listen_for": ((), np.int32, 0),
+            # ring buffers of catalog rows
+            "queue": ((self.queue_size,), np.int32, -1),
+            "queue_head": ((), np.int16, 0),
+            "queue_len": ((), np.int16, 0),
+        }
+        for name, (shape, dtype, fill) in columns.items():
+            column = np.full((capacity, *shape), fill, dtype=dtype)
+            if hasattr(self, name):
+                column[: self.capacity] = getattr(self, name)
+            setattr(self, name, column)
+        self.capacity = capacity
+
+    def add(self, agent_id: int, usersim: UserSim) -> int:
+        """
+        Starts a session of the user, returns the row of the user.
+        """
+        if self.free:
+            row = self.free.pop()
+        else:
+            if self.size == self.capacity:
+                self._allocate(self.capacity * 2)
+            row = self.size
+            self.size += 1
+            self.usersims.append(None)
+            self.tokens.append(None)
+            self.liked.append(array("i"))
+            self.followed.append(array("i"))
+        self.agent_id[row] = agent_id
+        self.state[row] = CREATED
+        self.stepping[row] = False
+        self.next_step[row] = self._after_delay()
+        self.probs[row] = [getattr(usersim, name) for name in PROBS]
+        self.is_premium[row] = usersim.is_premium
+        self.playing[row] = -1
+        self.queue_len[row] = 0
+        self.usersims[row] = usersim
+        self.tokens[row] = None
+        self.liked[row], self.followed[row] = array("i"), array("i")
+        return row
+
+    def remove(self, row: int) -> None:
+        self.state[row] = LEFT
+        self.next_step[row] = np.inf
+        self.usersims[row] = None
+        self.tokens[row] = None
+        self.free.append(row)
+
+    def state_of(self, row: int) -> UserAgentState:
+        return UserAgentState(int(self.state[row]))
+
+    def _after_delay(self, noise: int = 0) -> float:
+        delay = self.sim_params["delay_between_states_sec"] + noise
+        return self.clock.now_sec() + max(delay, 0)
+
+    def _log(self, row: int, message: str) -> None:
+        log.debug(f"[USER-{self.agent_id[row]}] {message}")
+
+    # song queue
+
+    def _enqueue(self, row: int, songs: list[int]) -> None:
+        head, length = int(self.queue_head[row]), int(self.queue_len[row])
+        if len(songs) > self.queue_size - length:
+            self._log(row, f"Song queue is full, dropping {len(songs)} songs.")
+            songs = songs[: self.queue_size - length]
+        positions = np.arange(head + length, head + length + len(songs))
+        self.queue[row, positions % self.queue_size] = songs
+        self.queue_len[row] = length + len(songs)
+
+    def _enqueue_left(self, row: int, song: int, times: int) -> None:
+        head, length = int(self.queue_head[row]), int(self.queue_len[row])
+        times = min(times, self.queue_size - length)
+        self.queue[row, np.arange(head - times, head) % self.queue_size] = song
+        self.queue_head[row] = (head - times) % self.queue_size
+        self.queue_len[row] = length + times
+
+    def _dequeue(self, row: int) -> int:
+        head = int(self.queue_head[row])
+        self.queue_head[row] = (head + 1) % self.queue_size
+        self.queue_len[row] -= 1
+        return int(self.queue[row, head])
+
+    # scheduler
+
+    async def run(self, running) -> None:
+        log.info("Starting user population.")
+        while True:
+            await running.wait()
+            await self.clock.sim_seconds(self.tick_sec, with_noise=False)
+            try:
+                self._tick()
+            except:
+                log.exception("Error at user population tick")
+
+    def _tick(self) -> None:
+        n = self.size
+        due = np.flatnonzero(
+            (self.state[:n] <= LISTENING)
+            & ~self.stepping[:n]
+            & (self.next_step[:n] <= self.clock.now_sec())
+        )
+        if due.size == 0:
+            return
+        self.stepping[due] = True
+        state = self.state[due]
+        # users between songs and idle users consider leaving first
+        between_songs = (state == IDLE) | (
+            (state == LISTENING) & (self.playing[due] < 0)
+        )
+        leaving = between_songs & (
+            self.rng.random(due.size) < self.sim_params["prob_leave_session"]
+        )
+        for row in due[leaving]:
+            log.info(f"[USER-{self.agent_id[row]}] User left.")
+        self.state[due[leaving]] = LEFT
+        self.queue_len[due[leaving]] = 0
+        self.stepping[due[leaving]] = False
+        due = due[~leaving]
+        # users about to start a song decide now whether to finish it
+        full_listen = self.rng.random(due.size) > self.probs[due, SKIP]
+        skip_at = SKIP_TIME_LOGNORM["loc"] + SKIP_TIME_LOGNORM[
+            "scale"
+        ] * self.rng.lognormal(0, SKIP_TIME_LOGNORM["s"], due.size)
+        noise = self.rng.integers(-1, 2, due.size)
+        steps = asyncio.gather(
+            *(
+                self._step(row, full, int(skip), delay_noise)
+                for row, full, skip, delay_noise in zip(
+                    due.tolist(), full_listen.tolist(), skip_at.tolist(), noise.tolist()
+                )
+            )
+        )
+        # the loop only keeps weak references to the running steps
+        self.steps.add(steps)
+        steps.add_done_callback(self.steps.discard)
+
+    async def _step(
+        self, row: int, full_listen: bool, skip_at: int, delay_noise: int
+    ) -> None:
+        try:
+            match self.state_of(row):
+                case UserAgentState.CREATED:
+                    await self._sign_in(row)
+                case UserAgentState.IDLE:
+                    await self._choose_next_action(row)
+                case UserAgentState.LISTENING if self.playing[row] < 0:
+                    if await self._start_song(row, full_listen, skip_at):
+                        # the next step is the end of the song
+                        return
+                case UserAgentState.LISTENING:
+                    await self._finish_song(row)
+            self.next_step[row] = self._after_delay(delay_noise)
+        except:
+            log.exception(
+                f"[USER-{self.agent_id[row]}] Could not go to the next state."
+            )
+            self.state[row] = INVALID
+        finally:
+            self.stepping[row] = False
+
+    # states
+
+    async def _sign_in(self, row: int) -> None:
+        usersim = self.usersims[row]
+        try:
+            self.tokens[row] = await self.api_client.sign_in(
+                usersim.email, usersim.password
+            )
+            log.info(
+                f"[USER-{self.agent_id[row]}] Signed in successfully at "
+                f"{self.clock.get_current_sim_time()} sim time."
+            )
+            self.state[row] = IDLE
+        except:
+            log.info(f"[USER-{self.agent_id[row]}] Sign in failed.")
+            self.state[row] = INVALID
+
+    async def _consider_subscription(self, row: int) -> None:
+        p = self.sim_params["prob_subscription"]
+        if not self.is_premium[row] and self.random.random() < p:
+            await self.api_client.post_subscribe(self.tokens[row])
+            usersim = self.usersims[row]
+            usersim.is_premium = True
+            self.is_premium[row] = True
+            db.session.add(usersim)
+            commit_db(usersim, "UserSim")
+            log.info(f"[USER-{self.agent_id[row]}] User made a premium subscription.")
+
+    async def _choose_next_action(self, row: int) -> None:
+        await self._consider_subscription(row)
+        token = self.tokens[row]
+        catalog = self.catalog
+        liked = await self.api_client.get_all_likes(token=token)
+        followed = await self.api_client.get_all_follows(token)
+        self.liked[row] = array("i", (catalog.song(id) for id in liked))
+        self.followed[row] = array("i", (catalog.artist_of(id) for id in followed))
+        if len(liked) == 0 and len(followed) == 0:
+            search_new = True
+        else:
+            search_new = self.random.random() < self.probs[row, EXPLORER]
+        if search_new:
+            await self._choose_new_music(row)
+        else:
+            await self._choose_liked_music(row)
+
+    async def _fetch_song(self, song: int) -> int:
+        if not self.catalog.is_known(song):
+            data = await self.api_client.get_song(UUID(self.catalog.song_ids[song]))
+            self.catalog.add_song(data)
+        return song
+
+    async def _fetch_collections(self, artist_id: str) -> list[list[int]]:
+        collections = await self.api_client.get_collections_by_artist(
+            artist_id=artist_id
+        )
+        return [
+            [self.catalog.add_song(song) for song in collection["songs"]]
+            for collection in collections
+        ]
+
+    async def _choose_liked_music(self, row: int) -> None:
+        liked, followed = self.liked[row], self.followed[row]
+        if len(liked) == 0:
+            pick_collection = True
+        elif len(followed) == 0:
+            pick_collection = False
+        else:
+            pick_collection = self.random.random() < self.probs[row, COLLECTION]
+
+        if pick_collection:
+            self._log(row, "Wants to listen to a collection of a followed artist.")
+            next_artist = self.catalog.artist_ids[self.random.choice(followed)]
+            collection = self.random.choice(await self._fetch_collections(next_artist))
+            self._enqueue(row, collection)
+        else:
+            self._log(row, "Wants to listen to a liked song.")
+            self._enqueue(row, [await self._fetch_song(self.random.choice(liked))])
+        self.state[row] = LISTENING
+
+    async def _choose_new_music(self, row: int) -> None:
+        self._log(row, "Searching for new music.")
+        usersim, catalog = self.usersims[row], self.catalog
+        from_same_country = self.random.random() < self.probs[row, PATRIOT]
+        country_param = usersim.country_code if from_same_country else None
+        if self.random.random() < self.probs[row, POPULAR]:
+            len_playlist = self.random.randint(1, 5)
+            songs = get_most_popular_songs(len_playlist)
+            if songs:
+                self._enqueue(
+                    row,
+                    [
+                        await self._fetch_song(catalog.song(songsim.song_id))
+                        for songsim in songs
+                    ],
+                )
+                self.state[row] = LISTENING
+            else:
+                song = await self.api_client.get_random_song(country_param)
+                if song:
+                    self._enqueue(row, [catalog.add_song(song)])
+                    self.state[row] = LISTENING
+        else:
+            liked = self.liked[row]
+            if liked:
+                random_liked_song = await self._fetch_song(self.random.choice(liked))
+                genre_id = catalog.genre_ids[catalog.genre[random_liked_song]]
+                artist = await self.api_client.get_random_artist(
+                    country=country_param, genre_id=genre_id
+                )
+            else:
+                artist = None
+
+            if artist is None:
+                artist = await self.api_client.get_random_artist(country=country_param)
+
+            if artist:
+                collections = await self._fetch_collections(artist["id"])
+                if collections:
+                    self._enqueue(row, self.random.choice(collections))
+                    self.state[row] = LISTENING
+                else:
+                    self._log(row, f"Artist {artist} has not released anything yet.")
+            else:
+                self._log(row, "No new artists found.")
+
+    async def _start_song(self, row: int, full_listen: bool, skip_at: int) -> bool:
+        if self.queue_len[row] == 0:
+            self._log(row, "Song queue is empty, going idle.")
+            self.state[row] = IDLE
+            return False
+        song = self._dequeue(row)
+        duration = self.catalog.duration[song]
+        listen_for = duration if full_listen else clamp(skip_at, 1, duration)
+        await self.api_client.play_song(
+            UUID(self.catalog.song_ids[song]), start_time=0, token=self.tokens[row]
+        )
+        self.playing[row] = song
+        self.listen_for[row] = listen_for
+        self.next_step[row] = self.clock.now_sec() + listen_for
+        return True
+
+    async def _finish_song(self, row: int) -> None:
+        song, listen_for = int(self.playing[row]), int(self.listen_for[row])
+        self.playing[row] = -1
+        song_id = self.catalog.song_ids[song]
+        await self.api_client.stop_song(
+            UUID(song_id), stop_time=listen_for, token=self.tokens[row]
+        )
+        if listen_for > 0.5 * self.catalog.duration[song]:
+            inc_song_listen_count(song_id)
+            like_the_song = (
+                self.random.random() > self.probs[row, PICKY]
+                and song not in self.liked[row]
+            )
+            if like_the_song:
+                await self._like_song(row, song)
+        else:
+            self._log(row, f"Skipped at {listen_for}s: {song_id}.")
+
+    async def _like_song(self, row: int, song: int) -> None:
+        token, catalog = self.tokens[row], self.catalog
+        await self.api_client.like(UUID(catalog.song_ids[song]), token)
+        self.liked[row].append(song)
+        artist = catalog.artist[song]
+        artist_id = catalog.artist_ids[artist]
+        by_artist = await self.api_client.get_all_likes(token, artist_id=artist_id)
+
+        # maybe also follow the artist (if liked already 3 or more their songs)
+        follow_artist = (
+            artist not in self.followed[row]
+            and self.random.random() < 0.8
+            and len(by_artist) >= 3
+        )
+        if follow_artist:
+            await self.api_client.follow(UUID(artist_id), token=token)
+            self.followed[row].append(artist)
+
+        # maybe put on repeat after the like
+        if self.random.random() < 0.8:
+            self._enqueue_left(row, song, self.random.randint(1, 4))
@@ -1,5 +1,4 @@
 import asyncio
-import random
 from datetime import date, datetime, timedelta
 from asyncio import Queue
 from typing import Optional
@@ -7,7 +6,6 @@ from uuid import UUID
 
 import numpy as np
 from flask import current_app as app
-from scipy.stats import truncnorm
 from sqlalchemy.sql.expression import func
 
 log = app.logger
@@ -15,15 +13,25 @@ log = app.logger
 from .. import db
 from ..agents.user import UserAgentState
 from ..client import APIClient
-from ..models import UserSim
+from ..models import USER_BEHAVIOR_PARAMS, UserSim
 from ..namegen import choose_weighted, fake
+from ..randomstream import RandomStreams
 from ..utils import commit_db
-from . import Clock, UserAgent
+from . import Clock, UserAgent, UserPopulation
 
 
 class UserControllerAgent:
-    def __init__(self, api_client: APIClient, config, clock: Clock) -> None:
+    def __init__(
+        self,
+        api_client: APIClient,
+        config,
+        clock: Clock,
+        random_streams: RandomStreams,
+    ) -> None:
         self.clock = clock
+        self.random_streams = random_streams
+        self.random = random_streams.stream("user_controller")
+        self.user_block_size = config["RANDOM_USER_BLOCK_SIZE"]
 
         # config values
         self.warmup_num_users = config["WARMUP_NUM_OF_USERS"]
@@ -37,12 +45,23 @@ class UserControllerAgent:
 
         self.last_user_id = 0
         self.user_query: Queue[UserSim] = Queue(maxsize=100)
-        self.active_users: dict[UUID, UserAgent] = dict()
+        # agents by user id, or rows of the population by user id
+        self.active_users: dict[UUID, UserAgent | int] = dict()
+        if config["USER_AGENTS"] == "population":
+            self.population = UserPopulation(
+                api_client,
+                self.user_sim_params,
+                clock,
+                random_streams.stream("user_population"),
+                config,
+            )
+        else:
+            self.population = None
         self.total_ws = 1
 
         self._reset_user_metrics()
 
-        self.countries = api_client.get_countries(only_enabled=True)
+        self.countries: dict = {}
 
     def _reset_user_metrics(self) -> None:
         if hasattr(self, "user_metrics"):
@@ -53,12 +72,12 @@ class UserControllerAgent:
             for name in UserAgentState._member_names_:
                 self.user_metrics[name] = 0
 
-    def warmup_db(self) -> None:
-        self.countries = self.api_client.get_countries(only_enabled=True)
+    async def warmup_db(self) -> None:
+        self.countries = await self.api_client.get_countries(only_enabled=True)
         for _ in range(self.warmup_num_users):
             country_code = self._choose_country()
             if country_code:
-                self._generate_user(country_code)
+                await self._generate_user(country_code)
         log.info(f"{self.warmup_num_users} users generated.")
 
     def _get_next_user_id(self) -> int:
@@ -68,10 +87,10 @@ class UserControllerAgent:
     def _calculate_countries_weights(self) -> tuple[dict[str, float], float]:
         countries_ws = dict()
         total_w = 0
-        now = datetime.utcnow()
+        # countries are enabled at the sim time
+        now = self.clock.get_current_sim_time()
         for code, enabled_at in self.countries.items():
-            elapsed = now - enabled_at
-            elapsed_sim = self.clock.to_sim_time(elapsed)
+            elapsed_sim = now - enabled_at
             days_sim = elapsed_sim / timedelta(days=1)
             w = np.exp(-self.sim_params["prob_country_weight_lambda"] * days_sim)
             total_w += w
@@ -92,12 +111,10 @@ class UserControllerAgent:
         sigma = self.sim_params["prob_user_age_sigma"]
         min_age = self.sim_params["prob_user_age_min"]
         max_age = self.sim_params["prob_user_age_max"]
-        a = (min_age - mu) / sigma  # how many sigmas to the left of the mean
-        b = (max_age - mu) / sigma  # how many sigmas to the right of the mean
-        age = int(truncnorm.rvs(a, b, loc=mu, scale=sigma))
+        age = int(self.random.truncnorm(mu, sigma, min_age, max_age))
         return fake.date_of_birth(minimum_age=age, maximum_age=age).isoformat()
 
-    def _generate_user(self, country_code: str) -> Optional[UserSim]:
+    async def _generate_user(self, country_code: str) -> Optional[UserSim]:
         email = fake.ascii_free_email()
         password = fake.password()
         profile = {
@@ -105,10 +122,15 @@ class UserControllerAgent:
             "last_name": fake.last_name(),
             "birth_date": self._gen_birth_date(),
         }
-        usersim = UserSim(email=email, password=password, country_code=country_code)
+        usersim = UserSim(
+            email=email,
+            password=password,
+            country_code=country_code,
+            **{name: self.random.behavior_p(name) for name in USER_BEHAVIOR_PARAMS},
+        )
         log.info(f"Signing up a new user with email={email}, password={password}.")
         try:
-            user_id = self.api_client.sign_up(usersim, profile)
+            user_id = await self.api_client.sign_up(usersim, profile)
             usersim.id = user_id
             db.session.add(usersim)
             commit_db(usersim, "UserSim", is_update=False)
@@ -123,13 +145,13 @@ class UserControllerAgent:
             await self.running.wait()
             try:
                 await self.clock.sim_seconds(self.sim_params["delay_create_users_sec"])
-                noise = random.randint(-1, 1)
+                noise = self.random.randint(-1, 1)
                 new_users_num = int(self.total_ws) + noise
                 log.info(f"Creating {new_users_num} new users.")
                 for _ in range(new_users_num):
                     country_code = self._choose_country()
                     if country_code:
-                        usersim = self._generate_user(country_code)
+                        usersim = await self._generate_user(country_code)
                         await self.user_query.put(usersim)
                         log.debug(
                             f"Registered new user {usersim}. Current user query: {self.user_query}."
@@ -146,7 +168,7 @@ class UserControllerAgent:
             await self.running.wait()
             try:
                 await self.clock.sim_seconds(self.sim_params["delay_select_users_sec"])
-                num_of_users = random.randint(0, 5)
+                num_of_users = self.random.randint(0, 5)
                 users = UserSim.query.order_by(func.random()).limit(num_of_users).all()
                 for user in users:
                     if user.id not in self.active_users.keys():
@@ -164,26 +186,45 @@ class UserControllerAgent:
                 await self.clock.sim_seconds(self.sim_params["delay_run_users_sec"])
                 if not self.user_query.empty():
                     usersim = await self.user_query.get()
-                    if usersim.id not in self.active_users.keys():
+                    if usersim.id in self.active_users.keys():
+                        log.info(
+                            f"Could not run user {usersim}: already active as {self.active_users[usersim.id]}."
+                        )
+                    elif self.population is not None:
+                        agent_id = self._get_next_user_id()
+                        row = self.population.add(agent_id, usersim)
+                        self.active_users[usersim.id] = row
+                        log.info(f"Run user agent id={agent_id} in row {row}.")
+                    else:
+                        agent_id = self._get_next_user_id()
                         agent = UserAgent(
-                            self._get_next_user_id(),
+                            agent_id,
                             usersim,
                             self.api_client,
                             self.user_sim_params,
                             self.clock,
+                            self.random_streams.stream(
+                                "user", agent_id, block_size=self.user_block_size
+                            ),
                         )
                         asyncio.create_task(agent.run(self.running))
                         self.active_users[usersim.id] = agent
                         log.info(f"Run user agent id={agent.agent_id}.")
-                    else:
-                        log.info(
-                            f"Could not run user {usersim}: already active as {self.active_users[usersim.id]}."
-                        )
                 else:
                     log.debug(f"Run users: user query is empty.")
             except:
                 log.exception("Error at _run_users_task")
 
+    def _user_state(self, user_id: UUID) -> UserAgentState:
+        if self.population is not None:
+            return self.population.state_of(self.active_users[user_id])
+        return self.active_users[user_id].state
+
+    def _remove_user(self, user_id: UUID) -> None:
+        agent = self.active_users.pop(user_id)
+        if self.population is not None:
+            self.population.remove(agent)
+
     async def _clean_up_users_task(self) -> None:
         while True:
             await self.running.wait()
@@ -197,15 +238,15 @@ class UserControllerAgent:
                 active_user_ids = list(self.active_users.keys())
                 if active_user_ids:
                     for user_id in active_user_ids:
-                        usersim = self.active_users[user_id]
-                        self.user_metrics[usersim.state.name] += 1
-                        match usersim.state:
+                        state = self._user_state(user_id)
+                        self.user_metrics[state.name] += 1
+                        match state:
                             case UserAgentState.INVALID:
                                 invalid.append(user_id)
-                                del self.active_users[user_id]
+                                self._remove_user(user_id)
                             case UserAgentState.LEFT:
                                 left.append(user_id)
-                                del self.active_users[user_id]
+                                self._remove_user(user_id)
                     new_users_len = len(self.active_users)
                     log.debug(f"Current metrics: {self.user_metrics}")
                     log.debug(
@@ -219,9 +260,12 @@ class UserControllerAgent:
     async def run(self, running) -> None:
         log.info(f"Initializing user controller agent.")
         self.running = running
+        self.countries = await self.api_client.get_countries(only_enabled=True)
         async with asyncio.TaskGroup() as tg:
             tg.create_task(self._create_user_task())
             tg.create_task(self._select_users_task())
             tg.create_task(self._run_users_task())
             tg.create_task(self._clean_up_users_task())
+            if self.population is not None:
+                tg.create_task(self.population.run(self.running))
         log.info(f"User controller agent tasks stopped.")
@@ -1,10 +1,12 @@
-import json
+import asyncio
+from dataclasses import dataclass
 from datetime import datetime
-from typing import Optional
+import json
+import random
+from typing import Any, Optional
 
-import urllib3
+import aiohttp
 from flask import current_app as app
-from tenacity import retry, stop_after_attempt, wait_random_exponential
 
 from uuid import UUID
 
@@ -15,53 +17,144 @@ from .models import UserSim
 log = app.logger
 
 
+@dataclass
+class Response:
+    status: int
+    data: bytes
+
+    def json(self) -> Any:
+        return json.loads(self.data)
+
+
 class APIClient:
+    """
+    Asynchronous client of the MSS API, shared by all the agents.
+
+    Requests of all the agents overlap on one connection pool of at most
+    `max_connections` connections, with at most `max_in_flight` requests sent or
+    waiting for a connection at a time. Failed requests (connection errors, timeouts,
+    HTTP 429 and 503) are retried with exponential backoff and jitter. Other 5xx
+    responses are only retried for idempotent requests, GETs by default: the backend
+    may have committed a POST before failing, and sending it again would duplicate it.
+    """
+
     http_schema = "http"
 
-    def __init__(self, host: str, port: int, clock: Clock) -> None:
+    # worth retrying: rate limited, or the backend is overloaded or restarting
+    retry_statuses = {429, 503}
+    # also worth retrying when sending the request again does no harm
+    idempotent_retry_statuses = {429, 500, 502, 503, 504}
+
+    def __init__(self, host: str, port: int, clock: Clock, config) -> None:
         self.url = f"http://{host}:{port}"
         log.info(f"Initializing HTTP client for url {self.url}")
-        self.http = urllib3.PoolManager()
         self.clock = clock
+        self.max_connections = config["HTTP_MAX_CONNECTIONS"]
+        self.timeout = aiohttp.ClientTimeout(total=config["HTTP_TIMEOUT_SEC"])
+        self.max_attempts = config["HTTP_MAX_ATTEMPTS"]
+        self.backoff_max_sec = config["HTTP_BACKOFF_MAX_SEC"]
+        self._in_flight = asyncio.Semaphore(config["HTTP_MAX_IN_FLIGHT"])
+        self._session: Optional[aiohttp.ClientSession] = None
 
     _override_time_header = "Override-Current-Time"
 
-    @retry(
-        stop=stop_after_attempt(3), wait=wait_random_exponential(multiplier=1, max=5)
-    )
-    def send_post(self, path: str, data: Optional[dict] = None, jwt=None):
-        url = f"{self.url}{path}"
-        payload = json.dumps(data) if data else None
-        headers = {
-            "Content-Type": "application/json",
-            "Override-Current-Time": self.clock.get_current_sim_time().isoformat(),
-        }
-        if jwt:
-            headers["Authorization"] = f"Bearer {jwt}"
-        auth = f"Bearer {jwt}" if jwt else None
-        log.info(f"REQ POST {url} {payload}")
-        resp = self.http.request("POST", url, headers=headers, body=payload)
-        log.info(f"RESP POST {url}: HTTP {resp.status}, data: {resp.data}")
-        return resp
-
-    @retry(
-        stop=stop_after_attempt(3), wait=wait_random_exponential(multiplier=1, max=5)
-    )
-    def send_get(self, path: str, params: Optional[dict[str, str]] = None, jwt=None):
+    def _get_session(self) -> aiohttp.ClientSession:
+        # created on first use, the session is bound to the running event loop
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+                timeout=self.timeout,
+            )
+        return self._session
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _send(
+        self,
+        method: str,
+        url: str,
+        data: Optional[dict],
+        params: Optional[dict[str, str]],
+        headers: dict[str, str],
+    ) -> Response:
+        # the simulated time of every attempt is the time it is sent at
+        headers[
+            self._override_time_header
+        ] = self.clock.get_current_sim_time().isoformat()
+        async with self._in_flight:
+            async with self._get_session().request(
+                method, url, json=data, params=params, headers=headers
+            ) as resp:
+                response = Response(resp.status, await resp.read())
+        log.info(f"RESP {method} {url}: HTTP {response.status}, data: {response.data}")
+        return response
+
+    async def _request(
+        self,
+        method: str,
+        path: str,
+        data: Optional[dict] = None,
+        params: Optional[dict[str, str]] = None,
+        jwt=None,
+        idempotent: bool = False,
+    ) -> Response:
         url = f"{self.url}{path}"
-        headers = {
-            "Override-Current-Time": self.clock.get_current_sim_time().isoformat()
-        }
+        headers = {}
         if jwt:
             headers["Authorization"] = f"Bearer {jwt}"
-        auth = f"Bearer {jwt}" if jwt else None
-        log.info(f"REQ GET {url} with params {params}")
-        resp = self.http.request("GET", url, headers=headers, fields=params)
-        log.info(f"RESP GET {url}: HTTP {resp.status}, data: {resp.data}")
-        return resp
-
-    def sign_up(self, usersim: UserSim, profile: dict) -> UUID:
-        resp = self.send_post(
+        # the sim time doesn't move while the request is in flight
+        with self.clock.busy():
+            return await self._request_with_retries(
+                method, url, data, params, headers, idempotent
+            )
+
+    async def _request_with_retries(
+        self,
+        method: str,
+        url: str,
+        data: Optional[dict],
+        params: Optional[dict[str, str]],
+        headers: dict[str, str],
+        idempotent: bool,
+    ) -> Response:
+        retry_statuses = (
+            self.idempotent_retry_statuses if idempotent else self.retry_statuses
+        )
+        for attempt in range(1, self.max_attempts):
+            try:
+                response = await self._send(method, url, data, params, headers)
+                if response.status not in retry_statuses:
+                    return response
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                log.warning(f"{method} {url} failed, attempt {attempt}.", exc_info=True)
+            # full jitter, so that the retries of many agents don't come in waves
+            backoff = min(self.backoff_max_sec, 2 ** (attempt - 1))
+            await asyncio.sleep(random.uniform(0, backoff))
+        return await self._send(method, url, data, params, headers)
+
+    async def send_post(
+        self,
+        path: str,
+        data: Optional[dict] = None,
+        jwt=None,
+        idempotent: bool = False,
+    ):
+        log.info(f"REQ POST {self.url}{path} {data}")
+        return await self._request(
+            "POST", path, data=data, jwt=jwt, idempotent=idempotent
+        )
+
+    async def send_get(
+        self, path: str, params: Optional[dict[str, str]] = None, jwt=None
+    ):
+        log.info(f"REQ GET {self.url}{path} with params {params}")
+        return await self._request("GET", path, params=params, jwt=jwt, idempotent=True)
+
+    async def sign_up(self, usersim: UserSim, profile: dict) -> UUID:
+        resp = await self.send_post(
             "/auth/sign_up",
             {
                 "email": usersim.email,
@@ -72,61 +165,71 @@ class APIClient:
         )
         return resp.json()["user_id"]
 
-    def sign_in(self, email: str, password: str) -> str:
-        resp = self.send_post(
+    async def sign_in(self, email: str, password: str) -> str:
+        resp = await self.send_post(
             "/auth/sign_in",
             {"email": email, "password": password},
         )
         return resp.json()["access_token"]
 
-    def play_song(self, song_id: UUID, start_time: int, token: str) -> None:
-        resp = self.send_post(
+    async def play_song(self, song_id: UUID, start_time: int, token: str) -> None:
+        resp = await self.send_post(
             "/api/play", {"song_id": str(song_id), "start_time": start_time}, jwt=token
         )
 
-    def stop_song(self, song_id: UUID, stop_time: int, token: str) -> None:
-        resp = self.send_post(
+    async def stop_song(self, song_id: UUID, stop_time: int, token: str) -> None:
+        resp = await self.send_post(
             "/api/stop", {"song_id": str(song_id), "stop_time": stop_time}, jwt=token
         )
 
-    def like(self, song_id: UUID, token: str) -> None:
-        self.send_post(f"/api/like/song", {"song_id": str(song_id)}, jwt=token)
+    async def like(self, song_id: UUID, token: str) -> None:
+        await self.send_post(f"/api/like/song", {"song_id": str(song_id)}, jwt=token)
 
-    def get_all_likes(self, token: str, artist_id: Optional[UUID] = None) -> list[UUID]:
+    async def get_all_likes(
+        self, token: str, artist_id: Optional[UUID] = None
+    ) -> list[UUID]:
         if artist_id is not None:
             params = {"artist_id": str(artist_id)}
         else:
             params = None
-        resp = self.send_get(f"/api/like/songs", params, jwt=token)
+        resp = await self.send_get(f"/api/like/songs", params, jwt=token)
         return resp.json()
 
-    def follow(self, artist_id: UUID, token: str) -> None:
-        self.send_post(f"/api/follow/artist", {"artist_id": str(artist_id)}, jwt=token)
+    async def follow(self, artist_id: UUID, token: str) -> None:
+        await self.send_post(
+            f"/api/follow/artist", {"artist_id": str(artist_id)}, jwt=token
+        )
 
-    def get_all_follows(self, token: str) -> list[UUID]:
-        resp = self.send_get(f"/api/follow/artists", jwt=token)
+    async def get_all_follows(self, token: str) -> list[UUID]:
+        resp = await self.send_get(f"/api/follow/artists", jwt=token)
         return resp.json()
 
-    def create_artist(self, artist_data: dict) -> UUID:
-        resp = self.send_post("/music/artist", artist_data)
+    async def create_artist(self, artist_data: dict) -> UUID:
+        resp = await self.send_post("/music/artist", artist_data)
         return UUID(resp.json()["id"])
 
-    def create_genre(self, genre_data: dict) -> UUID:
-        resp = self.send_post("/music/genre", genre_data)
+    async def create_genre(self, genre_data: dict) -> UUID:
+        resp = await self.send_post("/music/genre", genre_data)
         return UUID(resp.json()["id"])
 
-    def create_collection(self, collection_data: dict) -> UUID:
-        resp = self.send_post("/music/collection", collection_data)
+    async def create_collection(self, collection_data: dict) -> UUID:
+        resp = await self.send_post("/music/collection", collection_data)
         return UUID(resp.json()["id"])
 
-    def add_country(self, code: str, name: str) -> None:
-        self.send_post("/common/country", {"code": code, "name": name})
+    async def create_collections(self, collections_data: list[dict]) -> list[UUID]:
+        resp = await self.send_post(
+            "/music/collections", {"collections": collections_data}
+        )
+        return [UUID(id) for id in resp.json()["ids"]]
+
+    async def add_country(self, code: str, name: str) -> None:
+        await self.send_post("/common/country", {"code": code, "name": name})
 
-    def enable_country(self, country_code: str) -> None:
-        self.send_post(f"/common/country/{country_code}/enable")
+    async def enable_country(self, country_code: str) -> None:
+        await self.send_post(f"/common/country/{country_code}/enable")
 
-    def get_countries(self, only_enabled: bool = False) -> dict:
-        resp = self.send_get(
+    async def get_countries(self, only_enabled: bool = False) -> dict:
+        resp = await self.send_get(
             f"/common/countries", params={"enabled": str(only_enabled)}
         )
         return {
@@ -136,52 +239,52 @@ class APIClient:
             for country in resp.json()
         }
 
-    def get_genre(self, genre_id: UUID) -> dict:
-        resp = self.send_get(f"/music/genre/{str(genre_id)}")
+    async def get_genre(self, genre_id: UUID) -> dict:
+        resp = await self.send_get(f"/music/genre/{str(genre_id)}")
         return resp.json()
 
-    def get_genres(self, country: Optional[str] = None) -> list[dict]:
+    async def get_genres(self, country: Optional[str] = None) -> list[dict]:
         params = {} if country is None else {"country": country}
-        resp = self.send_get(f"/music/genres", params=params)
+        resp = await self.send_get(f"/music/genres", params=params)
         return resp.json()
 
-    def get_artist(self, artist_id: UUID) -> dict:
-        resp = self.send_get(f"/music/artist/{str(artist_id)}")
+    async def get_artist(self, artist_id: UUID) -> dict:
+        resp = await self.send_get(f"/music/artist/{str(artist_id)}")
         return resp.json()
 
-    def get_song(self, song_id: UUID) -> dict:
-        resp = self.send_get(f"/music/song/{str(song_id)}")
+    async def get_song(self, song_id: UUID) -> dict:
+        resp = await self.send_get(f"/music/song/{str(song_id)}")
         return resp.json()
 
-    def get_random_song(self, country: Optional[str] = None) -> Optional[dict]:
+    async def get_random_song(self, country: Optional[str] = None) -> Optional[dict]:
         params = {} if country is None else {"country": country}
-        resp = self.send_get(f"/music/song/random", params)
+        resp = await self.send_get(f"/music/song/random", params)
         if resp.status == 404:
             return None
         else:
             return resp.json()
 
-    def get_random_artist(
+    async def get_random_artist(
         self, country: Optional[str] = None, genre_id: Optional[UUID] = None
     ) -> Optional[dict]:
         params = {}
         if country:
             params["country"] = country
         if genre_id:
-            params["genre_id"] = genre_id
-        resp = self.send_get(f"/music/artist/random", params)
+            params["genre_id"] = str(genre_id)
+        resp = await self.send_get(f"/music/artist/random", params)
         if resp.status == 404:
             return None
         else:
             return resp.json()
 
-    def get_collection(self, collection_id: UUID) -> dict:
-        resp = self.send_get(f"/music/collection/{str(collection_id)}")
+    async def get_collection(self, collection_id: UUID) -> dict:
+        resp = await self.send_get(f"/music/collection/{str(collection_id)}")
         return resp.json()
 
-    def get_collections_by_artist(self, artist_id: UUID) -> dict:
-        resp = self.send_get(f"/music/artist/{str(artist_id)}/collections")
+    async def get_collections_by_artist(self, artist_id: UUID) -> dict:
+        resp = await self.send_get(f"/music/artist/{str(artist_id)}/collections")
         return resp.json()
 
-    def post_subscribe(self, token: str) -> None:
-        resp = self.send_post("/api/subscribe", jwt=token)
+    async def post_subscribe(self, token: str) -> None:
+        resp = await self.send_post("/api/subscribe", jwt=token)
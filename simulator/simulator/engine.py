@@ -1,10 +1,13 @@
 import asyncio
+import random
 
 from flask import current_app as app
 
 from .agents import clock
 from .agents import ArtistControllerAgent, CountryControllerAgent, UserControllerAgent
 from .client import APIClient
+from .namegen import fake
+from .randomstream import RandomStreams
 
 log = app.logger
 
@@ -12,23 +15,36 @@ log = app.logger
 class Engine:
     def __init__(self, config) -> None:
         self.config = config
-        self.sim_clock = clock.Clock(config)
-        api_client = APIClient(config["MSS_HOST"], config["MSS_PORT"], self.sim_clock)
-        self.user_controller = UserControllerAgent(api_client, config, self.sim_clock)
+        self.random_streams = RandomStreams(config)
+        if config["RANDOM_SEED"] is not None:
+            # the generated names come from the global random module and Faker
+            random.seed(config["RANDOM_SEED"])
+            fake.seed_instance(config["RANDOM_SEED"])
+        clock_stream = self.random_streams.stream("clock")
+        if config["CLOCK_MODE"] == "virtual":
+            self.sim_clock = clock.VirtualClock(config, clock_stream)
+        else:
+            self.sim_clock = clock.Clock(config, clock_stream)
+        self.api_client = APIClient(
+            config["MSS_HOST"], config["MSS_PORT"], self.sim_clock, config
+        )
+        self.user_controller = UserControllerAgent(
+            self.api_client, config, self.sim_clock, self.random_streams
+        )
         self.artist_controller = ArtistControllerAgent(
-            api_client, config, self.sim_clock
+            self.api_client, config, self.sim_clock, self.random_streams
         )
         self.country_controller = CountryControllerAgent(
-            api_client, config, self.sim_clock
+            self.api_client, config, self.sim_clock, self.random_streams
         )
 
-    def warmup_db(self) -> None:
+    async def warmup_db(self) -> None:
         log.info("Pre-generating country test data.")
-        self.country_controller.warmup_db()
+        await self.country_controller.warmup_db()
         log.info("Pre-generating music library test data.")
-        self.artist_controller.warmup_db()
+        await self.artist_controller.warmup_db()
         log.info("Pre-generating user test data.")
-        self.user_controller.warmup_db()
+        await self.user_controller.warmup_db()
         log.info("Test data generated.")
 
     async def run(self) -> None:
@@ -36,8 +52,15 @@ class Engine:
         self._loop = asyncio.get_running_loop()
         self.running = asyncio.Event()
 
+        try:
+            await self._run()
+        finally:
+            await self.api_client.close()
+        log.info("Simulator engine tasks stopped.")
+
+    async def _run(self) -> None:
         if self.config["WARMUP_ENABLED"]:
-            self.warmup_db()
+            await self.warmup_db()
 
         async with asyncio.TaskGroup() as tg:
             self.sim_clock_task = tg.create_task(self.sim_clock.run(self.running))
@@ -50,7 +73,6 @@ class Engine:
             self.country_controller_task = tg.create_task(
                 self.country_controller.run(self.running)
             )
-        log.info("Simulator engine tasks stopped.")
 
     def start(self) -> None:
         log.info("Starting the simulator engine.")
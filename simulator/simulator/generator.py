@@ -0,0 +1,428 @@
+"""
+Headless generator of DWH events for load tests of the stage and the Data Vault.
+
+Produces the events the backend would publish for a simulated catalog and user
+base, in the backend's wire format, straight to the DWH topic or to files, without
+the backend and the agents. The output only depends on the seed and the number of
+workers: every worker generates the same catalog and its own share of the users
+and their sessions, each with its own random stream.
+"""
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+import logging
+import multiprocessing
+import os
+import random
+import time
+from typing import Iterator
+from uuid import UUID
+
+import numpy as np
+import pycountry
+from eventcodec import serialize
+from kafka import KafkaProducer
+
+from .models import USER_BEHAVIOR_PARAMS, gen_normal_p
+from .namegen import fake
+
+log = logging.getLogger(__name__)
+
+# events between two checks of the rate limit and two progress reports
+CHUNK_EVENTS = 10000
+
+
+@dataclass
+class GeneratorParams:
+    seed: int
+    workers: int
+    # events per worker, 0 to run until stopped; the catalog events count toward
+    # worker 0's
+    events: int
+    # events per second of all the workers together, 0 for as fast as possible
+    rate: float
+    sink: str
+    encoding: str
+    output_dir: str
+    kafka_bootstrap_servers: list[str]
+    kafka_topic: str
+    start_time: datetime
+    countries: int
+    artists: int
+    users: int
+    # the same as the agents' STAT_USER
+    prob_leave_session: float
+    prob_subscription: float
+    prob_follow: float
+    # popularity of the songs falls with their rank as rank ** -zipf_exponent
+    zipf_exponent: float
+    # mean sim time between the starts of two sessions of one worker
+    session_gap_sec: float
+
+
+@dataclass
+class Catalog:
+    """
+    Songs as parallel lists indexed by song number, to pick them quickly.
+    """
+
+    countries: list[str]
+    artist_ids: list[UUID]
+    song_ids: list[UUID]
+    song_artist: list[int]
+    song_duration: list[int]
+    # cumulative popularity weights of all the songs and of the songs by country
+    song_cum_weights: list[float]
+    songs_by_country: dict[str, tuple[list[int], list[float]]]
+
+
+@dataclass
+class UserProfile:
+    id: UUID
+    country_code: str
+    patriot_p: float
+    skip_p: float
+    picky_p: float
+    is_premium: bool = False
+    # sim time the user's last session ended, a user has one session at a time
+    free_at: datetime = datetime.min
+    liked: set[int] = field(default_factory=set)
+    # liked songs by artist
+    liked_by_artist: dict[int, int] = field(default_factory=dict)
+    followed: set[int] = field(default_factory=set)
+
+
+def random_uuid(rnd: random.Random) -> UUID:
+    return UUID(bytes=rnd.randbytes(16), version=4)
+
+
+class EventGenerator:
+    def __init__(self, params: GeneratorParams, worker: int) -> None:
+        self.params = params
+        self.worker = worker
+        # string seeds are hashed the same way in every process
+        self.rnd = random.Random(f"{params.seed}:{worker}")
+
+    def catalog_events(self) -> Iterator[tuple[str, dict]]:
+        """
+        Builds the catalog, the same in every worker, and yields its events.
+        """
+        p = self.params
+        # namegen draws from the global random module and Faker
+        random.seed(p.seed)
+        fake.seed_instance(p.seed)
+        rnd = random.Random(f"{p.seed}:catalog")
+        t = p.start_time
+        all_countries = sorted(c.alpha_2 for c in pycountry.countries)
+        countries = rnd.sample(all_countries, p.countries)
+        for code in countries:
+            yield "CountryEnabled", {"event_time": t, "country_code": code}
+        genres = []
+        for code in countries:
+            genre_id = random_uuid(rnd)
+            genres.append((genre_id, code))
+            yield "GenreCreated", {
+                "event_time": t,
+                "id": genre_id,
+                "name": fake.genre(),
+                "happiness_index": rnd.randint(-100, 100),
+                "mean_duration_sec": rnd.randint(120, 300),
+                "country_code": code,
+            }
+        artist_ids, song_ids = [], []
+        song_artist, song_duration, song_country = [], [], []
+        for artist in range(p.artists):
+            artist_id = random_uuid(rnd)
+            genre_id, code = rnd.choice(genres)
+            artist_ids.append(artist_id)
+            yield "ArtistCreated", {
+                "event_time": t,
+                "id": artist_id,
+                "name": fake.artist(),
+                "founded_year": rnd.randint(1950, p.start_time.year),
+                "country_code": code,
+                "genre_id": genre_id,
+            }
+            for _ in range(rnd.randint(1, 3)):
+                collection_id = random_uuid(rnd)
+                collection_type = rnd.choice(["LP", "EP", "SINGLE"])
+                yield "CollectionCreated", {
+                    "event_time": t,
+                    "id": collection_id,
+                    "name": fake.collection(),
+                    "collection_type": collection_type,
+                    "artist_id": artist_id,
+                    "genre_id": genre_id,
+                    "released_dt": t.date(),
+                }
+                num_songs = {"LP": (7, 15), "EP": (4, 7), "SINGLE": (1, 3)}
+                for _ in range(rnd.randint(*num_songs[collection_type])):
+                    song_id = random_uuid(rnd)
+                    duration = max(30, int(rnd.normalvariate(210, 60)))
+                    song_ids.append(song_id)
+                    song_artist.append(artist)
+                    song_duration.append(duration)
+                    song_country.append(code)
+                    yield "SongCreated", {
+                        "event_time": t,
+                        "collection_id": collection_id,
+                        "artist_id": artist_id,
+                        "genre_id": genre_id,
+                        "id": song_id,
+                        "name": fake.song(),
+                        "duration_sec": duration,
+                    }
+        # popularity is a zipf law over a random order of the songs
+        weights = np.arange(1, len(song_ids) + 1, dtype=np.float64) ** -p.zipf_exponent
+        np.random.default_rng(p.seed).shuffle(weights)
+        songs_by_country = {}
+        for code in countries:
+            songs = [i for i, c in enumerate(song_country) if c == code]
+            if songs:
+                songs_by_country[code] = (songs, np.cumsum(weights[songs]).tolist())
+        self.catalog = Catalog(
+            countries=countries,
+            artist_ids=artist_ids,
+            song_ids=song_ids,
+            song_artist=song_artist,
+            song_duration=song_duration,
+            song_cum_weights=np.cumsum(weights).tolist(),
+            songs_by_country=songs_by_country,
+        )
+
+    def user_events(self) -> Iterator[tuple[str, dict]]:
+        """
+        Signs up the users of this worker.
+        """
+        p = self.params
+        count = p.users // p.workers + (self.worker < p.users % p.workers)
+        np_rnd = np.random.default_rng([p.seed, self.worker])
+        probs = {
+            name: gen_normal_p(
+                *USER_BEHAVIOR_PARAMS[name], size=count, random_state=np_rnd
+            )
+            for name in ("patriot_p", "skip_p", "picky_p")
+        }
+        self.users = []
+        for i in range(count):
+            user = UserProfile(
+                id=random_uuid(self.rnd),
+                country_code=self.rnd.choice(self.catalog.countries),
+                patriot_p=probs["patriot_p"][i],
+                skip_p=probs["skip_p"][i],
+                picky_p=probs["picky_p"][i],
+            )
+            self.users.append(user)
+            yield "SignUpEvent", {
+                "event_time": p.start_time,
+                "user_id": user.id,
+                "email": f"user{self.worker}.{i}@example.com",
+                "country_code": user.country_code,
+                "first_name": fake.first_name(),
+                "last_name": fake.last_name(),
+                "birth_date": date(self.rnd.randint(1950, 2007), 1, 1)
+                + timedelta(days=self.rnd.randint(0, 364)),
+            }
+
+    def _pick_song(self, user: UserProfile) -> int:
+        catalog = self.catalog
+        if user.country_code in catalog.songs_by_country and (
+            self.rnd.random() < user.patriot_p
+        ):
+            songs, cum_weights = catalog.songs_by_country[user.country_code]
+            return self.rnd.choices(songs, cum_weights=cum_weights)[0]
+        return self.rnd.choices(
+            range(len(catalog.song_ids)), cum_weights=catalog.song_cum_weights
+        )[0]
+
+    def session_events(
+        self, user: UserProfile, t: datetime
+    ) -> Iterator[tuple[str, dict]]:
+        """
+        One session of the user, with the same choices as a `UserAgent` makes.
+        Sets when the user is free again.
+        """
+        p, rnd, catalog = self.params, self.rnd, self.catalog
+        session_id = random_uuid(rnd)
+        yield "SignInSuccessEvent", {
+            "event_time": t,
+            "user_id": user.id,
+            "session_id": session_id,
+        }
+        if not user.is_premium and rnd.random() < p.prob_subscription:
+            user.is_premium = True
+            yield "UserSubscriptionEvent", {
+                "event_time": t,
+                "user_id": user.id,
+                "session_id": session_id,
+            }
+        while rnd.random() >= p.prob_leave_session:
+            song = self._pick_song(user)
+            song_id = catalog.song_ids[song]
+            duration = catalog.song_duration[song]
+            t += timedelta(seconds=rnd.randint(1, 10))
+            yield "SongPlayEvent", {
+                "event_time": t,
+                "user_id": user.id,
+                "session_id": session_id,
+                "song_id": song_id,
+                "at_time_sec": 0,
+            }
+            finished = rnd.random() > user.skip_p
+            # skips are more likely near the start, as `UserAgent._get_skip_time`
+            listen_for = (
+                duration
+                if finished
+                else min(duration, max(1, int(rnd.lognormvariate(2.3, 1.0))))
+            )
+            t += timedelta(seconds=listen_for)
+            yield "SongStopEvent", {
+                "event_time": t,
+                "user_id": user.id,
+                "session_id": session_id,
+                "song_id": song_id,
+                "at_time_sec": listen_for,
+                "finished": finished,
+            }
+            if finished and rnd.random() > user.picky_p and song not in user.liked:
+                artist = catalog.song_artist[song]
+                user.liked.add(song)
+                user.liked_by_artist[artist] = user.liked_by_artist.get(artist, 0) + 1
+                yield "SongLikedEvent", {
+                    "event_time": t,
+                    "user_id": user.id,
+                    "session_id": session_id,
+                    "song_id": song_id,
+                }
+                # as `UserAgent._like_song`, once 3 songs of the artist are liked
+                if (
+                    artist not in user.followed
+                    and rnd.random() < p.prob_follow
+                    and user.liked_by_artist[artist] >= 3
+                ):
+                    user.followed.add(artist)
+                    yield "ArtistFollowedEvent", {
+                        "event_time": t,
+                        "user_id": user.id,
+                        "session_id": session_id,
+                        "artist_id": catalog.artist_ids[artist],
+                    }
+        user.free_at = t
+
+    def events(self) -> Iterator[tuple[str, dict]]:
+        catalog_events = self.catalog_events()
+        if self.worker == 0:
+            yield from catalog_events
+        else:
+            for _ in catalog_events:
+                pass
+        yield from self.user_events()
+        t = self.params.start_time
+        while self.users:
+            t += timedelta(
+                seconds=self.rnd.expovariate(1 / self.params.session_gap_sec)
+            )
+            user = self.rnd.choice(self.users)
+            # a user still in a session doesn't start another one
+            if user.free_at <= t:
+                yield from self.session_events(user, t)
+
+
+class KafkaSink:
+    def __init__(self, bootstrap_servers: list[str], topic: str) -> None:
+        self.topic = topic
+        self.producer = KafkaProducer(
+            bootstrap_servers=bootstrap_servers,
+            compression_type="gzip",
+            linger_ms=50,
+            batch_size=1 << 20,
+            acks=1,
+        )
+
+    def write(self, payload: bytes) -> None:
+        self.producer.send(self.topic, value=payload)
+
+    def close(self) -> None:
+        self.producer.flush()
+        self.producer.close()
+
+
+class FileSink:
+    """
+    Writes the events one after another, each prefixed with its 4-byte length.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.file = open(path, "wb", buffering=1 << 20)
+
+    def write(self, payload: bytes) -> None:
+        self.file.write(len(payload).to_bytes(4, "big"))
+        self.file.write(payload)
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def read_file_events(path: str) -> Iterator[bytes]:
+    """
+    Reads the events written by `FileSink`, e.g. to replay them to Kafka.
+    """
+    with open(path, "rb", buffering=1 << 20) as file:
+        while header := file.read(4):
+            yield file.read(int.from_bytes(header, "big"))
+
+
+def _open_sink(params: GeneratorParams, worker: int):
+    if params.sink == "kafka":
+        return KafkaSink(params.kafka_bootstrap_servers, params.kafka_topic)
+    os.makedirs(params.output_dir, exist_ok=True)
+    return FileSink(os.path.join(params.output_dir, f"events-{worker}.bin"))
+
+
+def run_worker(params: GeneratorParams, worker: int) -> None:
+    sink = _open_sink(params, worker)
+    # every worker gets an equal share of the rate
+    rate = params.rate / params.workers
+    count = 0
+    started = last_report = time.monotonic()
+    try:
+        for event_type, event in EventGenerator(params, worker).events():
+            sink.write(serialize(event_type, event, encoding=params.encoding))
+            count += 1
+            if count == params.events:
+                break
+            if count % CHUNK_EVENTS:
+                continue
+            now = time.monotonic()
+            if rate:
+                ahead = count / rate - (now - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+            if now - last_report >= 10:
+                log.info(
+                    f"Worker {worker}: {count} events, "
+                    f"{count / (now - started):.0f} events/sec."
+                )
+                last_report = now
+    finally:
+        sink.close()
+    elapsed = time.monotonic() - started
+    log.info(
+        f"Worker {worker} generated {count} events in {elapsed:.1f}s, "
+        f"{count / elapsed:.0f} events/sec."
+    )
+
+
+def generate(params: GeneratorParams) -> None:
+    if params.workers <= 1:
+        run_worker(params, 0)
+        return
+    processes = [
+        multiprocessing.Process(
+            target=run_worker, args=(params, worker), name=f"generator-{worker}"
+        )
+        for worker in range(params.workers)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
@@ -1,5 +1,7 @@
 from datetime import datetime
 from uuid import uuid4
+
+import numpy as np
 from scipy.stats import truncnorm
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.dialects.postgresql import UUID
@@ -19,35 +21,48 @@ class TimedModel(db.Model):
     )
 
 
-def gen_normal_p(mu: float, sigma: float) -> float:
-    # a value between 0 and 1
+def gen_normal_p(mu: float, sigma: float, size=None, random_state=None):
+    # a value between 0 and 1, or an array of `size` of them
     a, b = (0 - mu) / sigma, (100 - mu) / sigma
-    percent = max(min(truncnorm.rvs(a, b, loc=mu, scale=sigma), 100), 0)
-    return percent * 0.01
+    percent = truncnorm.rvs(
+        a, b, loc=mu, scale=sigma, size=size, random_state=random_state
+    )
+    return np.clip(percent, 0, 100) * 0.01
+
+
+# (mean, sigma) in percent of the behavior probabilities of the users
+USER_BEHAVIOR_PARAMS = {
+    "patriot_p": (30, 20),
+    "explorer_p": (30, 20),
+    "skip_p": (80, 30),
+    "picky_p": (30, 20),
+    "collection_p": (20, 20),
+    "popular_p": (80, 20),
+}
 
 
 def gen_patriot_p() -> float:
-    return gen_normal_p(mu=30, sigma=20)
+    return float(gen_normal_p(*USER_BEHAVIOR_PARAMS["patriot_p"]))
 
 
 def gen_explorer_p() -> float:
-    return gen_normal_p(mu=30, sigma=20)
+    return float(gen_normal_p(*USER_BEHAVIOR_PARAMS["explorer_p"]))
 
 
 def gen_skip_p() -> float:
-    return gen_normal_p(mu=80, sigma=30)
+    return float(gen_normal_p(*USER_BEHAVIOR_PARAMS["skip_p"]))
 
 
 def gen_picky_p() -> float:
-    return gen_normal_p(mu=30, sigma=20)
+    return float(gen_normal_p(*USER_BEHAVIOR_PARAMS["picky_p"]))
 
 
 def gen_collection_p() -> float:
-    return gen_normal_p(mu=20, sigma=20)
+    return float(gen_normal_p(*USER_BEHAVIOR_PARAMS["collection_p"]))
 
 
 def gen_popular_p() -> float:
-    return gen_normal_p(mu=80, sigma=20)
+    return float(gen_normal_p(*USER_BEHAVIOR_PARAMS["popular_p"]))
 
 
 class UserSim(TimedModel):
@@ -0,0 +1,107 @@
+from typing import Callable, Optional, Sequence, TypeVar, Union
+import zlib
+
+import numpy as np
+from scipy.stats import truncnorm
+
+from .models import USER_BEHAVIOR_PARAMS, gen_normal_p
+
+T = TypeVar("T")
+
+
+class RandomStream:
+    """
+    Samples of the distributions the agents draw from, drawn in blocks of
+    `block_size` per distribution and handed out one at a time, so that the
+    overhead of a NumPy or SciPy call is paid once per block and not once per sample.
+    Blocks are only drawn for the distributions actually used.
+    """
+
+    def __init__(self, seed: np.random.SeedSequence, block_size: int) -> None:
+        self.rng = np.random.default_rng(seed)
+        self.block_size = block_size
+        self._blocks: dict[tuple, list[float]] = {}
+
+    def _sample(self, key: tuple, draw: Callable[[int], np.ndarray]) -> float:
+        block = self._blocks.get(key)
+        if not block:
+            # reversed, so that the samples are popped in the order they were drawn
+            block = draw(self.block_size)[::-1].tolist()
+            self._blocks[key] = block
+        return block.pop()
+
+    def random(self) -> float:
+        """
+        A uniform value in [0, 1), as `random.random()`.
+        """
+        return self._sample(("random",), self.rng.random)
+
+    def uniform(self, low: float, high: float) -> float:
+        return low + (high - low) * self.random()
+
+    def randint(self, low: int, high: int) -> int:
+        """
+        An integer in [low, high], both included, as `random.randint()`.
+        """
+        return low + int(self.random() * (high - low + 1))
+
+    def choice(self, seq: Sequence[T]) -> T:
+        return seq[int(self.random() * len(seq))]
+
+    def sample(self, seq: Sequence[T], k: int) -> list[T]:
+        return [seq[i] for i in self.rng.choice(len(seq), size=k, replace=False)]
+
+    def normal(self, loc: float, scale: float) -> float:
+        # one block of standard normal samples serves any mean and deviation
+        return loc + scale * self._sample(("normal",), self.rng.standard_normal)
+
+    def lognorm(self, s: float, loc: float = 0, scale: float = 1) -> float:
+        """
+        The same distribution as `scipy.stats.lognorm(s, loc, scale)`.
+        """
+        key = ("lognorm", s)
+        return loc + scale * self._sample(key, lambda n: self.rng.lognormal(0, s, n))
+
+    def truncnorm(self, mu: float, sigma: float, low: float, high: float) -> float:
+        """
+        A normal value truncated between `low` and `high`.
+        """
+        a, b = (low - mu) / sigma, (high - mu) / sigma
+        return self._sample(
+            ("truncnorm", mu, sigma, low, high),
+            lambda n: truncnorm.rvs(
+                a, b, loc=mu, scale=sigma, size=n, random_state=self.rng
+            ),
+        )
+
+    def behavior_p(self, name: str) -> float:
+        """
+        One of the `UserSim` behavior probabilities, e.g. "skip_p".
+        """
+        return self._sample(
+            ("behavior_p", name),
+            lambda n: gen_normal_p(
+                *USER_BEHAVIOR_PARAMS[name], size=n, random_state=self.rng
+            ),
+        )
+
+
+class RandomStreams:
+    """
+    Hands out an independent `RandomStream` to every agent. The stream of an agent
+    only depends on the seed and the agent's key, so with a fixed seed an agent
+    draws the same samples whatever the other agents do.
+    """
+
+    def __init__(self, config) -> None:
+        self.seed = np.random.SeedSequence(config["RANDOM_SEED"])
+        self.block_size = config["RANDOM_BLOCK_SIZE"]
+
+    def stream(
+        self, *key: Union[str, int], block_size: Optional[int] = None
+    ) -> RandomStream:
+        spawn_key = tuple(
+            zlib.crc32(part.encode()) if isinstance(part, str) else part for part in key
+        )
+        seed = np.random.SeedSequence(self.seed.entropy, spawn_key=spawn_key)
+        return RandomStream(seed, block_size or self.block_size)